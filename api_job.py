@@ -3,19 +3,42 @@ Daily Cron job from 7am to Midnight to pull data from the API, clean the SQL and
 """
 from datetime import datetime
 
-from data_analysis.pillow_reports import generate_report
-
 #!/usr/bin/python3
 from data_pipeline.api_requests import AirLabsData
+from src.const import TRACE_FILE_NAME
+from src.tracing import trace_job
+from src.utils import FileFolderManager
 
-# Adding Airlines
-if __name__ == "__main__":
 
-    today = datetime.now()
+def main(today=None, path_sql_db=None, snapshots=None, trace_path=None, settings=None):
+    """
+    Ingest the saved schedules of the day, clean the flights and generate the report, the stages are traced
+
+    :param today: (datetime, optional) the day of the job. Default is None, which uses the current time.
+    :param path_sql_db: (str, optional) path of the SQLite database. Default is None, see SqlManager.
+    :param snapshots: (SnapshotStore, optional) the archive of the payloads. Default is None, see AirLabsData.
+    :param trace_path: (str, optional) the JSON lines file of the spans. Default is None, TRACE_FILE_NAME next to the database.
+    :param settings: (Settings, optional) the settings. Default is None, which uses get_settings().
+    :return: (tuple) the result of generate_report
+    """
+    # The report pulls pandas, matplotlib and Pillow, they are imported once the ingest is done
+    from data_analysis.pillow_reports import generate_report
+
+    if today is None:
+        today = datetime.now()
+    if trace_path is None:
+        trace_path = FileFolderManager(directory="data_pipeline/", name_file=TRACE_FILE_NAME).file_dir
 
-    airlabs = AirLabsData(today)
-    airlabs.get_arrivals()
-    airlabs.get_departures()
-    airlabs.clean_sql_table(today)
+    with trace_job("api_job", trace_path):
+        # One connection for the ingest, the cleaning and the report
+        with AirLabsData(today, path_sql_db=path_sql_db, snapshots=snapshots, settings=settings) as airlabs:
+            airlabs.get_arrivals()
+            airlabs.get_departures()
+            airlabs.clean_sql_table(today)
 
-    generate_report(today)
+            return generate_report(today, airlabs)
+
+
+# Adding Airlines
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+"""
+Benchmarks of the data pipeline, run them from the root of the project:
+python -m benchmarks.<module>
+"""
@@ -0,0 +1,68 @@
+"""
+Airport enrichment of a schedule, per flight, with an Airports() index built on every lookup
+against the shared index and the memoized airport_info
+
+The old enrichment takes minutes on 5k flights, so it is timed on the first flights of the payload only.
+
+python -m benchmarks.bench_airport_enrichment [nb_flights] [nb_flights_before]
+"""
+import json
+import sys
+import time
+from datetime import datetime
+
+from benchmarks.payloads import fake_schedule
+from src.airports import AIRPORT_LIST_PATH, OTHER_LIST_PATH, Airport, Other
+from src.utils import _airport_info, airport_info, remove_non_alphanumeric
+
+with open(AIRPORT_LIST_PATH, "r", encoding="UTF-8") as f:
+    AIRPORT_LIST = json.load(f)
+with open(OTHER_LIST_PATH, "r", encoding="UTF-8") as f:
+    OTHER_LIST = json.load(f)
+
+
+def lookup_before(airport_iata, field):
+    """
+    get_airport_name and get_airport_country before the shared index, Airports() built the two dicts on every call
+    """
+    airports = {_[3].upper(): Airport(*_) for _ in AIRPORT_LIST}
+    other = {_[0].upper(): Other(*_) for _ in OTHER_LIST}
+    airport = airports.get(airport_iata) or other.get(airport_iata)
+    if airport is None:
+        return "UNKNOWN"
+    return remove_non_alphanumeric(getattr(airport, field).upper())
+
+
+def enrich_before(flight):
+    return (
+        lookup_before(flight["dep_iata"], "name"),
+        lookup_before(flight["arr_iata"], "name"),
+        lookup_before(flight["arr_iata"], "country"),
+        lookup_before(flight["dep_iata"], "country"),
+    )
+
+
+def enrich_after(flight):
+    departure_info = airport_info(flight["dep_iata"])
+    arrival_info = airport_info(flight["arr_iata"])
+    return departure_info.name, arrival_info.name, arrival_info.country, departure_info.country
+
+
+if __name__ == "__main__":
+    NB_FLIGHTS = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    NB_FLIGHTS_BEFORE = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    FLIGHTS = fake_schedule(NB_FLIGHTS, datetime(2023, 1, 10), seed=0)["response"]
+
+    start = time.perf_counter()
+    before = [enrich_before(flight) for flight in FLIGHTS[:NB_FLIGHTS_BEFORE]]
+    before_time = (time.perf_counter() - start) / len(before)
+
+    _airport_info.cache_clear()
+    start = time.perf_counter()
+    after = [enrich_after(flight) for flight in FLIGHTS]
+    after_time = (time.perf_counter() - start) / len(after)
+
+    assert after[: len(before)] == before
+    print(f"{NB_FLIGHTS} flights, {_airport_info.cache_info().currsize} airports")
+    print(f"before {before_time * 1e6:>10.1f} us/flight (first {len(before)} flights)")
+    print(f"after  {after_time * 1e6:>10.1f} us/flight  x{before_time / after_time:.0f}")
@@ -0,0 +1,48 @@
+"""
+correct_datetime_info, leg by leg, against correct_datetime_info_batch on the same legs
+
+python -m benchmarks.bench_correct_datetime [nb_legs]
+"""
+import sys
+import time
+from datetime import datetime
+
+from benchmarks.payloads import fake_schedule
+from src.utils import correct_datetime_info, correct_datetime_info_batch
+
+
+def departure_legs(nb_legs):
+    """
+    :returns: (list(tuple)) the departure legs of a synthetic schedule spread over 30 days
+    """
+    legs = []
+    for day in range(1, 31):
+        for flight in fake_schedule(nb_legs // 30 + 1, datetime(2023, 1, day), seed=day)["response"]:
+            legs.append(
+                (
+                    flight.get("dep_actual", ""),
+                    flight.get("dep_estimated", ""),
+                    flight["dep_time"],
+                    flight["status"],
+                    flight["delayed"] or 0,
+                )
+            )
+    return legs[:nb_legs]
+
+
+if __name__ == "__main__":
+    NB_LEGS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    LEGS = departure_legs(NB_LEGS)
+
+    start = time.perf_counter()
+    scalar = [correct_datetime_info(*leg, "active") for leg in LEGS]
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = correct_datetime_info_batch(*zip(*LEGS), "active")
+    batch_time = time.perf_counter() - start
+
+    assert list(zip(*batch)) == scalar
+    print(f"{NB_LEGS} legs")
+    print(f"scalar {scalar_time:>8.3f} s")
+    print(f"batch  {batch_time:>8.3f} s  x{scalar_time / batch_time:.0f}")
@@ -0,0 +1,57 @@
+"""
+Conversion of timestamp columns to the time of Tunisia, value by value with pytz against localize_timestamps
+
+- day: the scheduled, estimated and actual times of a day of flights, as get_df_sql_data converts them
+- month: the distinct timestamps of 30 days, as correct_datetime_info_batch converts them
+
+python -m benchmarks.bench_localize [nb_flights]
+"""
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from benchmarks.payloads import fake_schedule
+from src.utils import localize_timestamps, parse_timestamp
+
+
+def timestamps(nb_flights, nb_days):
+    """
+    :returns: (list(str)) the timestamps of a synthetic schedule, blank when unknown
+    """
+    values = []
+    for day in range(1, nb_days + 1):
+        for flight in fake_schedule(nb_flights, datetime(2023, 1, day), seed=day)["response"]:
+            values.extend(flight.get(key, "") for key in ("dep_time", "arr_time", "dep_estimated", "arr_estimated", "dep_actual", "arr_actual"))
+    return values
+
+
+def localize_before(values):
+    """
+    The conversion before localize_timestamps: one parse by value, as TimeAttribute does without its cache
+    """
+    return [parse_timestamp.__wrapped__(value) if value else None for value in values]
+
+
+def timed(localize, values, repeat=5):
+    """
+    :returns: (tuple) the best time of the repeats, and the result
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = localize(values)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == "__main__":
+    NB_FLIGHTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    for name, values in (("day", timestamps(NB_FLIGHTS, 1)), ("month", list(set(timestamps(NB_FLIGHTS, 30))))):
+        before_time, before = timed(localize_before, values)
+        after_time, after = timed(localize_timestamps, values)
+
+        assert [value.timestamp() if value else None for value in before] == [None if value is pd.NaT else value.timestamp() for value in after]
+        print(f"{name:<6} {len(values):>7} timestamps  before {before_time * 1e3:>8.2f} ms  after {after_time * 1e3:>8.2f} ms  x{before_time / after_time:.1f}")
@@ -0,0 +1,60 @@
+"""
+Disk use and write time of a day of fetches, in the snapshot archives against the json files
+
+- overwrite: the indent=4 json file of the day, replaced by every fetch (only the last fetch is kept)
+- files: one indent=4 json file per fetch, to keep the same history as the archives
+- snapshots: one gzip member per fetch appended to the monthly archive
+
+python -m benchmarks.bench_snapshots [nb_flights] [nb_fetches]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from itertools import product
+
+from benchmarks.payloads import fake_schedule
+from data_pipeline.snapshots import SnapshotStore
+from src.const import AIRPORTS_IATA, TYPE_FLIGHTS
+
+
+def disk_use(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def write_overwrite(directory, fetches):
+    for _, airport_iata, type_flight, payload in fetches:
+        with open(os.path.join(directory, f"{airport_iata}_{type_flight.lower()}_flights.json"), "w", encoding="UTF-8") as file:
+            json.dump(payload, file, indent=4)
+
+
+def write_files(directory, fetches):
+    for timestamp, airport_iata, type_flight, payload in fetches:
+        with open(os.path.join(directory, f"{int(timestamp)}_{airport_iata}_{type_flight.lower()}_flights.json"), "w", encoding="UTF-8") as file:
+            json.dump(payload, file, indent=4)
+
+
+def write_snapshots(directory, fetches):
+    store = SnapshotStore(directory)
+    for timestamp, airport_iata, type_flight, payload in fetches:
+        store.append(airport_iata, type_flight, payload, timestamp)
+
+
+if __name__ == "__main__":
+    NB_FLIGHTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    NB_FETCHES = int(sys.argv[2]) if len(sys.argv) > 2 else 24
+    START = datetime(2023, 1, 10).timestamp()
+    FETCHES = [
+        (START + fetch * 3600, airport_iata, type_flight, fake_schedule(NB_FLIGHTS, datetime(2023, 1, 10), seed=fetch))
+        for fetch, (airport_iata, type_flight) in product(range(NB_FETCHES), product(AIRPORTS_IATA, TYPE_FLIGHTS))
+    ]
+
+    print(f"{len(FETCHES)} fetches of {NB_FLIGHTS} flights")
+    for name, write in (("overwrite", write_overwrite), ("files", write_files), ("snapshots", write_snapshots)):
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            write(directory, FETCHES)
+            elapsed = time.perf_counter() - start
+            print(f"{name:<10} {disk_use(directory) / 1e6:>8.2f} MB {elapsed * 1e3 / len(FETCHES):>8.2f} ms/fetch")
@@ -0,0 +1,135 @@
+"""
+Connection count and wall time of one ingest (`AirLabsData.get_flights`) and one report (`generate_report`).
+"before" replays the connect / commit / close per statement of the previous SqlManager,
+"after" is the long-lived connection of the current SqlManager.
+
+python -m benchmarks.bench_sql_connections [nb_flights]
+"""
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from tempfile import TemporaryDirectory
+
+from benchmarks.payloads import fake_schedule
+from data_analysis.pillow_reports import generate_report
+from data_pipeline.api_requests import AirLabsData
+from data_pipeline.sql_functions import SqlManager
+from src.const import FLIGHT_TABLE_COLUMNS, SQL_TABLE_NAME
+
+BENCH_DAY = datetime(2023, 1, 10, 12)
+
+_connect = sqlite3.connect
+CONNECTIONS = {"count": 0}
+
+
+def counting_connect(*args, **kwargs):
+    """
+    sqlite3.connect counting every opened connection
+    """
+    CONNECTIONS["count"] += 1
+    return _connect(*args, **kwargs)
+
+
+class ClosedCursor:
+    """
+    Cursor of a closed connection: the description is kept, the rows are fetched again like
+    `get_df_sql_data` used to do with a second `execute_sql(sql, "fetchall")`
+    """
+
+    def __init__(self, manager, sql, description):
+        self.manager = manager
+        self.sql = sql
+        self.description = description
+
+    def fetchall(self):
+        return self.manager.execute_sql(self.sql, "fetchall")
+
+
+class PerQueryMixin:
+    """
+    Previous behaviour: one connection per statement, committed and closed right away
+    """
+
+    def execute_sql(self, sql=None, fetchmethod=None):
+        conn = sqlite3.connect(self.path_sql_db)
+        sql_execute = conn.cursor().execute(sql)
+        fetch_sql = ClosedCursor(self, sql, sql_execute.description)
+        if fetchmethod == "fetchone":
+            fetch_sql = sql_execute.fetchone()
+        elif fetchmethod == "fetchall":
+            fetch_sql = sql_execute.fetchall()
+        conn.commit()
+        conn.close()
+        return fetch_sql
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        yield None
+
+    def upsert_flights(self, flights, fingerprints=None):
+        flights = list(flights)
+        if fingerprints is None:
+            fingerprints = [None] * len(flights)
+        for values, fingerprint in zip(flights, fingerprints):
+            key = values[0]
+            columns = FLIGHT_TABLE_COLUMNS
+            if fingerprint is not None:
+                columns, values = (*columns, "FINGERPRINT"), (*values, fingerprint)
+            if self.execute_sql(f'SELECT 1 FROM {SQL_TABLE_NAME} WHERE (ID_FLIGHT = "{key}")', "fetchone") is not None:
+                cross_col = ", ".join(f'{col}="{value}"' for col, value in zip(columns, values))
+                self.execute_sql(f'UPDATE {SQL_TABLE_NAME} SET {cross_col} WHERE ID_FLIGHT="{key}"')
+            else:
+                self.execute_sql(f"INSERT INTO {SQL_TABLE_NAME} {str(columns)} VALUES {values}")
+        return len(flights)
+
+
+class PerQueryAirLabsData(PerQueryMixin, AirLabsData):
+    pass
+
+
+class PerQuerySqlManager(PerQueryMixin, SqlManager):
+    pass
+
+
+def measure(func):
+    """
+    :returns: (tuple) number of connections opened and wall time of func
+    """
+    CONNECTIONS["count"] = 0
+    start = time.perf_counter()
+    func()
+    return CONNECTIONS["count"], time.perf_counter() - start
+
+
+def run(nb_flights):
+    payload = fake_schedule(nb_flights, BENCH_DAY, seed=1)
+    results = []
+    with TemporaryDirectory() as temp_dir:
+        for label, airlabs_cls, manager_cls in [
+            ("before", PerQueryAirLabsData, PerQuerySqlManager),
+            ("after", AirLabsData, SqlManager),
+        ]:
+            path_db = os.path.join(temp_dir, f"{label}.db")
+
+            def ingest():
+                with airlabs_cls(BENCH_DAY, path_sql_db=path_db) as airlabs:
+                    airlabs.get_flights(payload)
+
+            def report():
+                with manager_cls(path_db) as sql_table:
+                    os.remove(generate_report(BENCH_DAY, sql_table)[0])
+
+            results.append((label, "get_flights", *measure(ingest)))
+            results.append((label, "generate_report", *measure(report)))
+    return results
+
+
+if __name__ == "__main__":
+    sqlite3.connect = counting_connect
+    NB_FLIGHTS = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    print(f"{'':8}{'step':18}{'connections':>12}{'seconds':>10}   ({NB_FLIGHTS} flights)")
+    for label, step, count, seconds in run(NB_FLIGHTS):
+        print(f"{label:8}{step:18}{count:>12}{seconds:>10.3f}")
@@ -0,0 +1,61 @@
+"""
+Import time of the job entry points, read from `python -X importtime` in a fresh interpreter
+
+- the modules costing the most to import, with their cumulative time
+- the deferred modules: the cost each run of the ingest no longer pays
+
+Exit code 1 when the import of the module exceeds its budget, so it can gate a CI run.
+
+python -m benchmarks.bench_startup [module] [budget_ms]
+"""
+import subprocess
+import sys
+
+from src.const import STARTUP_DEFERRED_MODULES, STARTUP_IMPORT_BUDGET_MS
+
+
+def import_times(module: str) -> dict:
+    """
+    Import a module in a fresh interpreter and parse the report of -X importtime
+
+    :param module: (str) the dotted name of the module
+    :return: (dict) the self and cumulative microseconds by imported module, in the order of the report
+    """
+    assert isinstance(module, str), "Wrong Type: module must be a string"
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or line.endswith("imported package"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def import_time_ms(module: str, runs=5) -> float:
+    """
+    :param module: (str) the dotted name of the module
+    :param runs: (int, optional) number of fresh interpreters, the fastest is kept to ignore the noise of the machine. Default is 5.
+    :return: (float) the cumulative milliseconds to import the module
+    """
+    return min(import_times(module)[module][1] for _ in range(runs)) / 1e3
+
+
+if __name__ == "__main__":
+    MODULE = sys.argv[1] if len(sys.argv) > 1 else "data_pipeline.api_requests"
+    BUDGET_MS = float(sys.argv[2]) if len(sys.argv) > 2 else STARTUP_IMPORT_BUDGET_MS
+
+    TIMES = import_times(MODULE)
+    print(f"{MODULE}: {len(TIMES)} modules imported")
+    for name, (self_us, cumulative_us) in sorted(TIMES.items(), key=lambda item: -item[1][1])[:15]:
+        print(f"{name:<40} self {self_us / 1e3:>7.2f} ms  cumulative {cumulative_us / 1e3:>7.2f} ms")
+
+    print("deferred modules, imported on their own")
+    for name in STARTUP_DEFERRED_MODULES:
+        loaded = "loaded" if name in TIMES else "not loaded"
+        print(f"{name:<40} {import_time_ms(name, runs=1):>7.2f} ms  {loaded} by {MODULE}")
+
+    ELAPSED_MS = import_time_ms(MODULE)
+    print(f"{MODULE} {ELAPSED_MS:.2f} ms, budget {BUDGET_MS:.0f} ms")
+    sys.exit(ELAPSED_MS > BUDGET_MS)
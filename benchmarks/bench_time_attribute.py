@@ -0,0 +1,66 @@
+"""
+Construction of TimeAttribute plus the typical accesses, before and after the lazy fields
+
+- key: get_flight_key, full_under_score only
+- report: isodate, month and short_under_score, as the report paths do
+- datetime: the datetime only, as AirLabsData and correct_datetime_info do
+
+python -m benchmarks.bench_time_attribute [nb_times]
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from benchmarks.payloads import fake_schedule
+from src.utils import TUNISIA_TZ, TimeAttribute
+
+
+class TimeAttributeBefore:
+    """
+    TimeAttribute before the lazy fields: a timezone lookup, two datetime.now() and eight strftime per instance
+    """
+
+    def __init__(self, time_str=None):
+        self.pytz_tn = pytz.timezone(TUNISIA_TZ)
+        self.today = datetime.now().astimezone(self.pytz_tn)
+        self.yesterday = (datetime.now() - timedelta(days=1)).astimezone(self.pytz_tn)
+        if time_str:
+            if isinstance(time_str, str):
+                self.datetime = datetime.fromisoformat(time_str).astimezone(self.pytz_tn)
+            else:
+                self.datetime = time_str.astimezone(self.pytz_tn)
+            self.dateformat = self.datetime.strftime("%d/%m/%Y")
+            self.isodate = self.datetime.strftime("%Y-%m-%d")
+            self.full_hour = self.datetime.strftime("%H:%M")
+            self.full_day = self.datetime.strftime("%a %d %b %Y")
+            self.hour = self.datetime.strftime("%H")
+            self.month = self.datetime.strftime("%m")
+            self.full_under_score = self.datetime.strftime("%d_%m_%Y_%H_%M")
+            self.short_under_score = self.datetime.strftime("%d_%m_%Y")
+
+
+ACCESSES = {
+    "key": lambda time_attribute: time_attribute.full_under_score,
+    "report": lambda time_attribute: (time_attribute.isodate, time_attribute.month, time_attribute.short_under_score),
+    "datetime": lambda time_attribute: time_attribute.datetime,
+}
+
+
+def timed(cls, times, access):
+    start = time.perf_counter()
+    results = [access(cls(time_str)) for time_str in times]
+    return (time.perf_counter() - start) / len(times), results
+
+
+if __name__ == "__main__":
+    NB_TIMES = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    TIMES = [flight["dep_time"] for flight in fake_schedule(NB_TIMES, datetime(2023, 1, 10), seed=0)["response"]]
+
+    print(f"{NB_TIMES} timestamps")
+    for name, access in ACCESSES.items():
+        before_time, before = timed(TimeAttributeBefore, TIMES, access)
+        after_time, after = timed(TimeAttribute, TIMES, access)
+        assert before == after
+        print(f"{name:<9} before {before_time * 1e6:>6.2f} us  after {after_time * 1e6:>6.2f} us  x{before_time / after_time:.1f}")
@@ -0,0 +1,57 @@
+"""
+Synthetic AirLabs schedule payloads used by the benchmarks
+"""
+import random
+from datetime import datetime, timedelta
+
+AIRLINES = ["TU", "BJ", "AF", "TO"]
+ROUTES = [
+    ("TUN", "CDG", "FRANCE"),
+    ("TUN", "ORY", "FRANCE"),
+    ("TUN", "MRS", "FRANCE"),
+    ("TUN", "LYS", "FRANCE"),
+    ("TUN", "FCO", "ITALY"),
+    ("TUN", "IST", "TURKEY"),
+    ("TUN", "DJE", "TUNISIA"),
+]
+STATUSES = ["scheduled", "cancelled", "active", "landed"]
+
+
+def fake_schedule(nb_flights: int, day: datetime, seed=None):
+    """
+    Generate an AirLabs-like schedule payload
+
+    :param nb_flights: (int) number of flights in the payload
+    :param day: (datetime) the day of the scheduled departures
+    :param seed: (int, optional) the seed of the random generator. Defaults to None
+
+    :returns: (dict) a payload shaped like `get_json_api(...).json()`
+    """
+    rand = random.Random(seed)
+    flights = []
+    for index in range(nb_flights):
+        dep_iata, arr_iata, _ = rand.choice(ROUTES)
+        if rand.random() < 0.5:
+            dep_iata, arr_iata = arr_iata, dep_iata
+        airline = rand.choice(AIRLINES)
+        dep_time = day.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(minutes=rand.randrange(0, 24 * 60, 5))
+        arr_time = dep_time + timedelta(minutes=rand.randrange(45, 240, 5))
+        delay = rand.choice([None, 0, 5, 15, 30, 90])
+        flight = {
+            "airline_iata": airline,
+            "flight_iata": f"{airline}{index:04d}",
+            "status": rand.choice(STATUSES),
+            "dep_iata": dep_iata,
+            "arr_iata": arr_iata,
+            "dep_time": dep_time.strftime("%Y-%m-%d %H:%M"),
+            "arr_time": arr_time.strftime("%Y-%m-%d %H:%M"),
+            "delayed": delay,
+        }
+        if delay:
+            flight["dep_estimated"] = (dep_time + timedelta(minutes=delay)).strftime("%Y-%m-%d %H:%M")
+            flight["arr_estimated"] = (arr_time + timedelta(minutes=delay)).strftime("%Y-%m-%d %H:%M")
+        if rand.random() < 0.5:
+            flight["dep_actual"] = flight.get("dep_estimated", flight["dep_time"])
+            flight["arr_actual"] = flight.get("arr_estimated", flight["arr_time"])
+        flights.append(flight)
+    return {"request": {}, "response": flights}
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+"""
+KPI engine of the daily report
+All the figures of the report are read by one query and returned as a DailyKpi, the drawing functions only render it.
+"""
+from typing import NamedTuple, Optional
+
+from src.const import DAILY_KPI_TABLE_NAME, FLIGHT_STATUS, SQL_OPERATORS, SQL_TABLE_NAME, TYPE_FLIGHTS
+
+
+class WorstFlight(NamedTuple):
+    """
+    The flight with the highest arrival delay of the day
+    """
+
+    departure_airport: str
+    arrival_airport: str
+    flight_number: str
+    airline: str
+
+
+class DailyKpi(NamedTuple):
+    """
+    The KPI of one airline for one departure date, the delays are in minutes
+    """
+
+    nb_scheduled: int
+    nb_cancelled: int
+    nb_active: int
+    nb_landed: int
+    nb_delays_dep: int
+    min_delay_dep: int
+    max_delay_dep: int
+    avg_delay_dep: int
+    nb_delays_arr: int
+    min_delay_arr: int
+    max_delay_arr: int
+    avg_delay_arr: int
+    worst_flight: Optional[WorstFlight]
+
+    def count_status(self, status: str) -> int:
+        """
+        :param status: (str) 'scheduled', 'cancelled', 'active', 'landed'
+        :return: (int) the number of flights with this status
+        """
+        return getattr(self, f"nb_{status}")
+
+    def nb_delays(self, type_flight: str) -> int:
+        """
+        :param type_flight: (str) DEPARTURE or ARRIVAL
+        :return: (int) the number of delayed flights
+        """
+        return getattr(self, f"nb_delays_{type_flight[:3].lower()}")
+
+    def delay(self, sql_op: str, type_flight: str) -> int:
+        """
+        :param sql_op: (str) MIN, MAX or AVG
+        :param type_flight: (str) DEPARTURE or ARRIVAL
+        :return: (int) the delay in minutes
+        """
+        return getattr(self, f"{sql_op.lower()}_delay_{type_flight[:3].lower()}")
+
+
+def _pivot(column: str, type_flight: str) -> str:
+    """
+    Conditional aggregation picking the column of one type of flight out of the rollup rows
+    """
+    return f"MAX(CASE WHEN FLIGHT_TYPE = '{type_flight}' THEN {column} END)"
+
+
+def daily_kpi_query() -> str:
+    """
+    Build the query of the report KPI: the DEPARTURE and ARRIVAL rollup rows of the day pivoted in one row,
+    joined with the worst flight of the day.
+    The parameters are the date and the airline, twice.
+
+    :return: (str) the SQL query
+    """
+    columns = [_pivot(f"NB_{status.upper()}", "DEPARTURE") for status in FLIGHT_STATUS]
+    for type_flight in TYPE_FLIGHTS:
+        columns.append(_pivot("NB_DELAYED", type_flight))
+        columns.extend(_pivot(f"{sql_op}_DELAY", type_flight) for sql_op in SQL_OPERATORS)
+    select = ",\n            ".join(columns)
+    return f"""
+    SELECT
+        kpi.*,
+        worst.DEPARTURE_AIRPORT,
+        worst.ARRIVAL_AIRPORT,
+        worst.FLIGHT_NUMBER,
+        worst.AIRLINE
+    FROM (
+        SELECT
+            {select}
+        FROM {DAILY_KPI_TABLE_NAME}
+        WHERE (KPI_DATE = ?) AND (AIRLINE = ?)
+    ) AS kpi
+    LEFT JOIN (
+        SELECT DEPARTURE_AIRPORT, ARRIVAL_AIRPORT, FLIGHT_NUMBER, AIRLINE
+        FROM {SQL_TABLE_NAME}
+        WHERE (
+            (DEPARTURE_DATE = ?) AND
+            (AIRLINE = ?) AND
+            (ARRIVAL_DELAY > 0) AND
+            (FLIGHT_STATUS <> 'cancelled')
+        )
+        ORDER BY ARRIVAL_DELAY DESC, ID_FLIGHT
+        LIMIT 1
+    ) AS worst ON 1
+    """
+
+
+def compute_daily_kpi(sql_table, query_date: str, airline="TU") -> DailyKpi:
+    """
+    Compute all the KPI of the report with one query
+
+    :param sql_table: (SqlManager) the manager to query
+    :param query_date: (str) the departure date of the flights, YYYY-MM-DD
+    :param airline: (str, optional) the IATA code of the airline. Defaults to "TU"
+    :return: (DailyKpi) the KPI, missing figures are 0 and the average delays are truncated to whole minutes
+    """
+    row = sql_table.conn.execute(daily_kpi_query(), (query_date, airline, query_date, airline)).fetchone()
+    figures = [int(value or 0) for value in row[:-4]]
+    worst_flight = None
+    if figures[DailyKpi._fields.index("max_delay_arr")] > 0 and row[-4] is not None:
+        worst_flight = WorstFlight(*row[-4:])
+    return DailyKpi(*figures, worst_flight)
@@ -8,8 +8,8 @@ from matplotlib import pyplot as plt  # font manager
 from matplotlib import use as mat_use
 
 from data_pipeline.sql_functions import SqlManager
-from src.const import SQL_TABLE_NAME
-from src.utils import SKYFONT, FileFolderManager, TimeAttribute
+from src.const import FLIGHT_TIMESTAMP_COLUMNS, SQL_TABLE_NAME
+from src.utils import SKYFONT, FileFolderManager, TimeAttribute, localize_timestamps
 
 mat_use("Agg")
 
@@ -26,35 +26,42 @@ def get_font_prop(font_name: str, size_font: int):
     return fm.FontProperties(fname=font_name, size=size_font)
 
 
-def get_df_sql_data(datetime_query, type_flight: str):
+def get_df_sql_data(datetime_query, type_flight: str, sql_table=None):
     """
     to convert a SQL table to a database pandas
 
     :param datetime_query (datetime): datetime of query
     :param type_flight (str): DEPARTURE or ARRIVAL
+    :param sql_table (SqlManager, optional): the manager to query. Defaults to a new SqlManager
 
-    :returns: (pandas): a pandas dataframe out of SQL table
+    :returns: (pandas): a pandas dataframe out of SQL table, the timestamps are aware datetimes in the time of Tunisia
     """
     # todays date
-    sql_table = SqlManager()
-    todays_date = TimeAttribute(datetime_query).dateformat
+    if sql_table is None:
+        sql_table = SqlManager()
+    todays_date = TimeAttribute(datetime_query).isodate
 
     sql_df = f"""
     SELECT * 
     FROM {SQL_TABLE_NAME} 
     WHERE (
-        ({type_flight}_DATE = "{str(todays_date)}") AND 
-        (FLIGHT_STATUS <> "cancelled")
+        ({type_flight}_DATE = ?) AND 
+        (FLIGHT_STATUS <> 'cancelled')
     )
     """
 
-    query = sql_table.execute_sql(sql_df)
-    data = sql_table.execute_sql(sql_df, "fetchall")
+    query = sql_table.conn.execute(sql_df, (todays_date,))
+    data = query.fetchall()
     cols = [column[0] for column in query.description]
 
     df = pd.DataFrame.from_records(data=data, columns=cols)
     df = df.convert_dtypes()
 
+    # The timestamps of the day are converted in one call, column after column
+    timestamps = localize_timestamps(df[list(FLIGHT_TIMESTAMP_COLUMNS)].to_numpy(dtype="object").ravel(order="F"))
+    for position, column in enumerate(FLIGHT_TIMESTAMP_COLUMNS):
+        df[column] = timestamps[position * len(df) : (position + 1) * len(df)]
+
     return df
 
 
@@ -110,7 +117,11 @@ def ax_metadata(ax, title: str, font_prop):
 
 
 def plot_from_to_airport(
-    datetime_query, type_flight: str, from_airport: str, to_airport: str
+    datetime_query,
+    type_flight: str,
+    from_airport: str,
+    to_airport: str,
+    sql_table=None,
 ):
     """
     Function to create an SQL request and transform the table into pandas
@@ -121,13 +132,14 @@ def plot_from_to_airport(
         type_flight (str): DEPARTURE or ARRIVAL
         from_airport (str): departure airport
         to_airport (str): arrival airport
+        sql_table (SqlManager, optional): the manager to query. Defaults to None
 
     :returns:
         _type_: A bar chart plot with average delay as function of each Airline
         calculated through departure airport to arrival airport
     """
     # Transform the SQL table to pandas + refactor the types
-    df = get_df_sql_data(datetime_query, type_flight)
+    df = get_df_sql_data(datetime_query, type_flight, sql_table)
     if df.empty:
         print("DataFrame is empty!")
         return
@@ -141,7 +153,6 @@ def plot_from_to_airport(
     ]
     df_ftype_delay = (
         df_ftype_delay.fillna(0)
-        .replace("", 0)
         .replace("TU", "TUNISAIR")
         .replace("AF", "AIR FRANCE")
         .replace("BJ", "NOUVELAIR")
@@ -203,18 +214,19 @@ def plot_from_to_airport(
     return picture_to_save
 
 
-def plot_tunisair_arrival_dep_delays(datetime_query):
+def plot_tunisair_arrival_dep_delays(datetime_query, sql_table=None):
     """
     To create a line chart of AVG departure and arrival delays of Tunisair
     Args:
         datetime_query (_type_): datetime used for query
+        sql_table (SqlManager, optional): the manager to query. Defaults to None
 
     :returns:
         _type_: a matplotlib plot of the evolution of Tunisair delays for departure
         and arrivals
     """
     # Transform the SQL table to pandas + refactor the types
-    df = get_df_sql_data(datetime_query, "DEPARTURE")
+    df = get_df_sql_data(datetime_query, "DEPARTURE", sql_table)
     if df.empty:
         print("DataFrame is empty!")
         return
@@ -228,20 +240,13 @@ def plot_tunisair_arrival_dep_delays(datetime_query):
             "DEPARTURE_HOUR",
         ]
     ]
-    df_ftype_delay = df_ftype_delay.fillna(0).replace("", 0)
-    df_ftype_delay["DEPARTURE_DELAY"] = df_ftype_delay[
-        "DEPARTURE_DELAY"
-    ].astype("float64")
-    df_ftype_delay["ARRIVAL_DELAY"] = df_ftype_delay["ARRIVAL_DELAY"].astype(
-        "float64"
-    )
+    df_ftype_delay = df_ftype_delay.fillna(0)
     df_ftype_delay = df_ftype_delay.rename(
         columns={
             "DEPARTURE_DELAY": "AVG DEP DELAY",
             "ARRIVAL_DELAY": "AVG ARR DELAY",
         }
     )
-    df_ftype_delay = df_ftype_delay.fillna(0).replace("", 0)
     list_dep = list(df_ftype_delay["DEPARTURE_HOUR"].unique())
     df_ftype_delay = df_ftype_delay.groupby(["DEPARTURE_HOUR"]).mean().fillna(0)
     # Creating the figures
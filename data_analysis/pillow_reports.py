@@ -11,22 +11,22 @@ from data_analysis.pandas_matplotlib import (
     plot_from_to_airport,
     plot_tunisair_arrival_dep_delays,
 )
+from data_analysis.kpi_engine import compute_daily_kpi
 from data_pipeline.sql_functions import SqlManager
 from src.const import (
     AIRLINE_NAMES,
     FLIGHT_STATUS,
     FONT_SIZE,
     SQL_OPERATORS,
-    SQL_TABLE_NAME,
     TYPE_FLIGHTS,
 )
+from src.tracing import span
 from src.utils import (
     GLYPH_AIRPORT,
     SKYFONT,
     SKYFONT_INVERTED,
     FileFolderManager,
     TimeAttribute,
-    is_blank,
 )
 
 
@@ -110,9 +110,7 @@ def paste_plots(reportImg, x, y, plot_pic: str):
     return reportImg
 
 
-def paste_kpi(
-    report, v_start_arr, v_start_dep, v_start, h_start, query_date_formatted
-):
+def paste_kpi(report, v_start_arr, v_start_dep, v_start, h_start, daily_kpi):
     """
     to create 2 rounded blocks and insert KPI ,
     Count Min Max AVG per Departure Arrival
@@ -123,12 +121,11 @@ def paste_kpi(
         v_start_dep (_type_): position in x for departure
         v_start (_type_): global x pos
         h_start (_type_): global y pos
-        query_date_formatted (_type_): query date formatted DD/MM/YYYY
+        daily_kpi (DailyKpi): the KPI of the day
 
     :returns:
         _type_: the image updated with relevant count, MIN, MAX AVG KPI
     """
-    sql_table = SqlManager()
     for rounded_start in [v_start_arr, v_start_dep]:
         report.rounded_rectangle(
             (rounded_start, h_start + 35, rounded_start + 480, h_start + 115),
@@ -141,113 +138,47 @@ def paste_kpi(
         v_start = (v_start_dep if type_f == "DEPARTURE" else v_start_arr) + 50
 
         # Counting how many delays
-        count_nb = sql_table.execute_sql(
-            f"""
-            SELECT COUNT(*) 
-            FROM {SQL_TABLE_NAME} 
-            WHERE (
-                (DEPARTURE_DATE = "{str(query_date_formatted)}") AND 
-                (AIRLINE = "TU") AND 
-                ({type_f}_DELAY <> "0") AND 
-                ({type_f}_DELAY <> "") AND 
-                (FLIGHT_STATUS <> "cancelled")
-            )
-            """,
-            "fetchone",
-        )[0]
-        if type_f == "ARRIVAL":
-            nb_delays_arr = count_nb
-        elif type_f == "DEPARTURE":
-            nb_delays_dep = count_nb
         width_text, height_text = add_banner(
             report,
             v_start + 30,
             h_start_bytype,
             f"DELAYED {type_f}:",
-            f"{count_nb}",
+            f"{daily_kpi.nb_delays(type_f)}",
         )
         h_start_bytype = h_start + 85
 
         # add more info on MIN MAX AVG
         for sql_op in SQL_OPERATORS:
-            sql_execute_query = sql_table.execute_sql(
-                f"""
-                SELECT {sql_op}({type_f}_DELAY) 
-                FROM {SQL_TABLE_NAME} 
-                WHERE (
-                    (DEPARTURE_DATE = "{str(query_date_formatted)}") AND 
-                    (AIRLINE = "TU") AND 
-                    ({type_f}_DELAY <> "0") AND 
-                    ({type_f}_DELAY <> "") AND 
-                    (FLIGHT_STATUS <> "cancelled")
-                )
-                """,
-                "fetchone",
-            )[0]
-            result_fetch = int(
-                0
-                if (
-                    ((sql_execute_query is None))
-                    | (is_blank(sql_execute_query))
-                )
-                else sql_execute_query
-            )
-            result_fetch = int(round(result_fetch, 0))
-            if (sql_op == "MAX") & (type_f == "ARRIVAL"):
-                max_arrival_delay = result_fetch
             width_text, height_text = add_banner(
                 report,
                 v_start,
                 h_start_bytype,
                 f"{sql_op}:",
-                f"{result_fetch}M",
+                f"{daily_kpi.delay(sql_op, type_f)}M",
             )
             v_start = v_start + width_text
-    return v_start, h_start, max_arrival_delay, nb_delays_arr, nb_delays_dep
+    return v_start, h_start
 
 
-def past_worse_flight(
-    report, max_arrival_delay, h_start, query_date_formatted: str
-):
+def past_worse_flight(report, daily_kpi, h_start):
     """
     Args:
         report (_type_): the report from PILLOW
-        max_arrival_delay (_type_): the max queried arrival delay
+        daily_kpi (DailyKpi): the KPI of the day
         h_start (_type_):  global y pos
-        query_date_formatted (str): query date formatted DD/MM/YYYY
 
     :returns:
         _type_: the image updated with the worse flight made by Tunisair
     """
-    sql_table = SqlManager()
-    worse_flight = (
-        []
-        if max_arrival_delay == 0
-        else sql_table.execute_sql(
-            f"""
-            SELECT 
-                DEPARTURE_AIRPORT, 
-                ARRIVAL_AIRPORT, 
-                FLIGHT_NUMBER, 
-                AIRLINE 
-            FROM {SQL_TABLE_NAME}  
-            WHERE (
-                (DEPARTURE_DATE = "{query_date_formatted}") AND
-                (AIRLINE = "TU") AND 
-                (ARRIVAL_DELAY = "{str(max_arrival_delay)}") AND 
-                (FLIGHT_STATUS <> "cancelled")
-            )
-            """,
-            "fetchone",
-        )
-    )
-
     h_worse_flight = h_start + 125
     return (
         draw_with_max_arrival(
-            worse_flight, report, h_worse_flight, max_arrival_delay
+            daily_kpi.worst_flight,
+            report,
+            h_worse_flight,
+            daily_kpi.max_delay_arr,
         )
-        if max_arrival_delay > 0
+        if daily_kpi.worst_flight is not None
         else draw_with_no_max_arrival(report, h_worse_flight)
     )
 
@@ -369,20 +300,19 @@ def past_titles(report, datetime_query):
     return report
 
 
-def flight_status_kpi(report, query_date_formatted: str, h_start, v_start_dep):
+def flight_status_kpi(report, daily_kpi, h_start, v_start_dep):
     """
     To generate the KPI count per flight status (Scheduled, Canceled, Active, Landed)
 
     Args:
         report (_type_): the report from PILLOW
-        query_date_formatted (str): query date formatted DD/MM/YYYY
+        daily_kpi (DailyKpi): the KPI of the day
         h_start (_type_): global y pos
         v_start_dep (_type_): position in x for departure
 
     :returns:
         _type_: the image updated with the KPI by flight status
     """
-    sql_table = SqlManager()
     h_start = h_start + 15
     width_text, height_text = add_banner(
         report, v_start_dep, h_start, "TUNISAIR FLIGHTS", ""
@@ -390,21 +320,8 @@ def flight_status_kpi(report, query_date_formatted: str, h_start, v_start_dep):
 
     v_start = v_start_dep + width_text + 10
     for status in FLIGHT_STATUS:
-        count_sql_status = sql_table.execute_sql(
-            f"""
-            SELECT COUNT(*) 
-            FROM {SQL_TABLE_NAME} 
-            WHERE (
-                (DEPARTURE_DATE = "{query_date_formatted}") AND 
-                (AIRLINE = "TU") AND 
-                (FLIGHT_STATUS = "{status}")
-            )
-            """,
-            "fetchone",
-        )[0]
-
         width_text, height_text = add_banner(
-            report, v_start, h_start, f"{status}:", count_sql_status
+            report, v_start, h_start, f"{status}:", daily_kpi.count_status(status)
         )
 
         v_start = v_start + width_text + 10
@@ -426,99 +343,100 @@ def get_picture_to_save_loc(datetime_query):
     ).file_dir
 
 
-def generate_report(datetime_query):
+def generate_report(datetime_query, sql_table=None):
     """
     Function to generate the daily report as function of current time
+    All the queries of the report go through one SqlManager
+
     Args:
         datetime_query (_type_): datetime
+        sql_table (SqlManager, optional): the manager to query. Defaults to None,
+        a new manager is then opened and closed for the report
 
     :returns:
         _type_: the path of the report image
     """
+    if sql_table is None:
+        with SqlManager() as sql_table:
+            return generate_report(datetime_query, sql_table)
 
     # Create necessary folders and paths
-    query_date_formatted = TimeAttribute(datetime_query).dateformat
+    # All the KPI of the report in one query
+    with span("kpi_query"):
+        daily_kpi = compute_daily_kpi(sql_table, TimeAttribute(datetime_query).isodate)
     picture_to_save = get_picture_to_save_loc(datetime_query)
-    reportImg = Image.new("RGB", (1080, 720), color="white")
-
-    # LOGO BLOCK
-    with Image.open(
-        FileFolderManager(
-            directory="src", name_file="tunisair_alert_logo.png"
-        ).file_dir
-    ) as tunisair_logo:
-        reportImg.paste(tunisair_logo, (25, 7))
-
-    report = ImageDraw.Draw(reportImg)
-    # TITLES BLOCKS
-    past_titles(report, datetime_query)
-
-    # Positions
-    v_start_dep = 15  # vertical position for DEPARTURES
-    v_start_arr = 580  # vertical position for ARRIVALS
-    h_start = 80  # horizontal position
-
-    # KPI BLOCKS
-    report.rectangle((0, h_start, 1080, 720), fill="black")
-
-    # To get the repartition count by flight status
-    v_start, h_start = flight_status_kpi(
-        report, query_date_formatted, h_start, v_start_dep
-    )
 
-    # To prepare the KPI of counting in Departure & Counting in Arrivals
-    # 2 rounded rectangles that will contain the KPIs
-    (
-        v_start,
-        h_start,
-        max_arrival_delay,
-        nb_delays_arr,
-        nb_delays_dep,
-    ) = paste_kpi(
-        report, v_start_arr, v_start_dep, v_start, h_start, query_date_formatted
-    )
+    # PLOTS
+    with span("plot", plot="delays"):
+        plot_delays = plot_tunisair_arrival_dep_delays(datetime_query, sql_table)
+    with span("plot", plot="departures"):
+        plot_departures = plot_from_to_airport(
+            datetime_query, "DEPARTURE", "TUNISIA", "FRANCE", sql_table
+        )
+    with span("plot", plot="arrivals"):
+        plot_arrivals = plot_from_to_airport(
+            datetime_query, "ARRIVAL", "FRANCE", "TUNISIA", sql_table
+        )
 
-    # Get the information of WORSE Flight
-    text_worse_flight = past_worse_flight(
-        report, max_arrival_delay, h_start, query_date_formatted
-    )
+    with span("composite"):
+        reportImg = Image.new("RGB", (1080, 720), color="white")
 
-    # PLOT BLOCKS
-    paste_plots(
-        reportImg,
-        v_start_dep,
-        290,
-        plot_tunisair_arrival_dep_delays(datetime_query),
-    )
+        # LOGO BLOCK
+        with Image.open(
+            FileFolderManager(
+                directory="src", name_file="tunisair_alert_logo.png"
+            ).file_dir
+        ) as tunisair_logo:
+            reportImg.paste(tunisair_logo, (25, 7))
 
-    plot_h_pos = 470
-    paste_plots(
-        reportImg,
-        v_start_dep,
-        plot_h_pos,
-        plot_from_to_airport(datetime_query, "DEPARTURE", "TUNISIA", "FRANCE"),
-    )
+        report = ImageDraw.Draw(reportImg)
+        # TITLES BLOCKS
+        past_titles(report, datetime_query)
 
-    paste_plots(
-        reportImg,
-        530,
-        plot_h_pos,
-        plot_from_to_airport(datetime_query, "ARRIVAL", "FRANCE", "TUNISIA"),
-    )
+        # Positions
+        v_start_dep = 15  # vertical position for DEPARTURES
+        v_start_arr = 580  # vertical position for ARRIVALS
+        h_start = 80  # horizontal position
 
-    report.rounded_rectangle(
-        (v_start_dep, 290, 1060, 705), radius=20, outline="orange"
-    )
+        # KPI BLOCKS
+        report.rectangle((0, h_start, 1080, 720), fill="black")
+
+        # To get the repartition count by flight status
+        v_start, h_start = flight_status_kpi(
+            report, daily_kpi, h_start, v_start_dep
+        )
+
+        # To prepare the KPI of counting in Departure & Counting in Arrivals
+        # 2 rounded rectangles that will contain the KPIs
+        v_start, h_start = paste_kpi(
+            report, v_start_arr, v_start_dep, v_start, h_start, daily_kpi
+        )
+
+        # Get the information of WORSE Flight
+        text_worse_flight = past_worse_flight(report, daily_kpi, h_start)
+
+        # PLOT BLOCKS
+        paste_plots(reportImg, v_start_dep, 290, plot_delays)
+
+        plot_h_pos = 470
+        paste_plots(reportImg, v_start_dep, plot_h_pos, plot_departures)
+
+        paste_plots(reportImg, 530, plot_h_pos, plot_arrivals)
+
+        report.rounded_rectangle(
+            (v_start_dep, 290, 1060, 705), radius=20, outline="orange"
+        )
 
     # SAVE PICTURE
-    reportImg.save(picture_to_save)
+    with span("save"):
+        reportImg.save(picture_to_save)
     print(
         f"Daily report created for {TimeAttribute(datetime_query).short_under_score}"
     )
     return (
         picture_to_save,
-        nb_delays_arr,
-        nb_delays_dep,
-        max_arrival_delay,
+        daily_kpi.nb_delays_arr,
+        daily_kpi.nb_delays_dep,
+        daily_kpi.max_delay_arr,
         text_worse_flight,
     )
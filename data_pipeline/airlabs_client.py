@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+"""
+HTTP client of the AirLabs API
+One pooled session keeps the connections and TLS sessions alive between the requests of a run,
+asks for compressed bodies and retries the network and server errors.
+The JSON bodies are cached on disk: a fresh entry is served without any request, a stale one is
+revalidated with If-None-Match / If-Modified-Since.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.const import AIRLABS_API_URL, API_CACHE_MAX_AGE, API_MAX_CONCURRENCY, API_RETRIES
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "json_data", "cache")
+# Query parameters left out of the cache key
+SECRET_PARAMETERS = {"api_key"}
+
+
+class AirLabsClient:
+    """
+    Client of the AirLabs API, shared by the threads of AirLabsData.fetch_schedules
+
+    :param api_url: (str, optional) URL of the schedules endpoint. Default is AIRLABS_API_URL.
+    :param cache_dir: (str, optional) directory of the response cache. Default is CACHE_DIR, None disables the cache.
+    :param max_age: (int, optional) seconds during which a cached response is served without a request. Default is API_CACHE_MAX_AGE.
+    :param pool_size: (int, optional) number of connections kept alive. Default is API_MAX_CONCURRENCY.
+    :param retries: (int, optional) number of retries of a failed request. Default is API_RETRIES.
+    """
+
+    def __init__(self, api_url=AIRLABS_API_URL, cache_dir=CACHE_DIR, max_age=API_CACHE_MAX_AGE, pool_size=API_MAX_CONCURRENCY, retries=API_RETRIES):
+        assert isinstance(max_age, (int, float)), "Wrong Type: max_age must be a number of seconds"
+        self.api_url = api_url
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+            respect_retry_after_header=True,
+        )
+        self.session = requests.Session()
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry))
+
+        self._lock = threading.Lock()
+        self.stats = dict.fromkeys(["hits", "revalidated", "misses", "bytes_received", "bytes_decoded", "bytes_cached"], 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the connections of the session
+        """
+        self.session.close()
+
+    def count(self, **increments):
+        """
+        Add to the counters, the client is used by several threads
+
+        :param increments: (int) the value to add to each counter
+        """
+        with self._lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    def cache_path(self, params: list) -> str:
+        """
+        Path of the cached body of a request, the secret parameters are not part of the key
+
+        :param params: (list(tuple)) the query parameters
+        :return: (str) the path of the body, its metadata has the same name with a .meta suffix
+        """
+        query = urlencode(sorted((key, value) for key, value in params if key not in SECRET_PARAMETERS))
+        return os.path.join(self.cache_dir, hashlib.sha256(f"{self.api_url}?{query}".encode()).hexdigest()[:32] + ".json")
+
+    def read_cache(self, path: str):
+        """
+        :param path: (str) the path of the cached body
+        :return: (tuple(bytes, dict)) the body and its metadata, (None, {}) if the request is not cached
+        """
+        try:
+            with open(f"{path}.meta", "r", encoding="UTF-8") as file:
+                meta = json.load(file)
+            with open(path, "rb") as file:
+                return file.read(), meta
+        except (FileNotFoundError, ValueError):
+            return None, {}
+
+    def write_cache(self, path: str, body, meta: dict):
+        """
+        Save a body and its metadata, each file is replaced atomically
+
+        :param path: (str) the path of the cached body
+        :param body: (bytes) the body, None to only update the metadata
+        :param meta: (dict) the validators and the time of the response
+        """
+        if body is not None:
+            with open(f"{path}.tmp", "wb") as file:
+                file.write(body)
+            os.replace(f"{path}.tmp", path)
+        with open(f"{path}.meta.tmp", "w", encoding="UTF-8") as file:
+            json.dump(meta, file)
+        os.replace(f"{path}.meta.tmp", f"{path}.meta")
+
+    def get_json(self, params: list, timeout=300) -> dict:
+        """
+        GET the endpoint and decode the JSON body, from the cache when it is fresh or not modified.
+        The body is read and decoded whole: the payload is archived as a whole in the snapshots,
+        the ingest then streams its flights from the archive with iter_json_array.
+
+        :param params: (list(tuple)) the query parameters, a parameter can be repeated
+        :param timeout: (int, optional) timeout of the request in seconds. Default is 300.
+        :raises requests.exceptions.RequestException: if the request fails after the retries or returns an error status
+        :return: (dict) the decoded JSON body
+        """
+        path = self.cache_path(params) if self.cache_dir is not None else None
+        body, meta = self.read_cache(path) if path is not None else (None, {})
+        if body is not None and time.time() - meta.get("fetched_at", 0) < self.max_age:
+            self.count(hits=1, bytes_cached=len(body))
+            return json.loads(body)
+
+        headers = {}
+        if body is not None and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if body is not None and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        response = self.session.get(self.api_url, params=params, headers=headers, timeout=timeout)
+        if response.status_code == 304 and body is not None:
+            self.count(revalidated=1, bytes_received=response.raw.tell(), bytes_cached=len(body))
+            self.write_cache(path, None, {**meta, "fetched_at": time.time()})
+            return json.loads(body)
+
+        response.raise_for_status()
+        self.count(misses=1, bytes_received=response.raw.tell(), bytes_decoded=len(response.content))
+        payload = response.json()
+        # AirLabs reports some errors, e.g. a wrong api_key, in a 200 body
+        if path is not None and "error" not in payload:
+            meta = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fetched_at": time.time(),
+            }
+            self.write_cache(path, response.content, meta)
+        return payload
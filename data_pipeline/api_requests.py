@@ -2,84 +2,304 @@
 """
 Api AIRLAB request management
 """
-import backoff
-import requests  # APIs
-
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
+from data_pipeline.json_stream import iter_json_array
+from data_pipeline.snapshots import SnapshotStore
 from data_pipeline.sql_functions import SqlManager  # SQL interactions
-from src.utils import FileFolderManager, TimeAttribute, correct_datetime_info, get_airport_country, get_airport_name, get_env, get_flight_key
+from src.const import AIRLABS_API_URL, AIRLINES_IATA, AIRPORTS_IATA, API_MAX_CONCURRENCY, FINAL_FLIGHT_STATUS, FLIGHT_BATCH_SIZE, FLIGHT_TABLE_COLUMNS, TYPE_FLIGHTS
+from src.tracing import iterate, span
+from src.utils import TimeAttribute, airport_info, correct_datetime_info_batch, get_flight_key, parse_timestamp
+
+
+def normalize_flights(real_time_flights):
+    """
+    First stage of the ingest, keep the fields of the API response used by the table
+
+    :param real_time_flights: (iterable(dict)) the flights of the API response
+
+    ::returns: (generator(dict)) the flights
+    """
+    for flight in real_time_flights:
+        departure_delay = flight["delayed"] if "delayed" in flight else 0
+        departure_delay = 0 if departure_delay is None else int(departure_delay)
+        yield {
+            "airline": flight["airline_iata"],
+            "flight_number": flight["flight_iata"],
+            "flight_status": flight["status"],
+            "departure_iata": flight["dep_iata"],
+            "arrival_iata": flight["arr_iata"],
+            "departure_scheduled": flight["dep_time"],
+            "arrival_scheduled": flight["arr_time"],
+            # Handling if exist
+            # Data cleaning
+            "departure_estimated": flight["dep_estimated"] if "dep_estimated" in flight else "",
+            "arrival_estimated": flight["arr_estimated"] if "arr_estimated" in flight else "",
+            "departure_actual": flight["dep_actual"] if "dep_actual" in flight else "",
+            "arrival_actual": flight["arr_actual"] if "arr_actual" in flight else "",
+            "departure_delay": departure_delay,
+            "arrival_delay": departure_delay,
+        }
+
+
+def fingerprint_flights(flights):
+    """
+    Add the key of each flight and the fingerprint of its API record, before any cleaning or enrichment
+
+    :param flights: (iterable(dict)) the normalized flights
+
+    ::returns: (generator(dict)) the flights with their id_flight and fingerprint
+    """
+    for flight in flights:
+        flight["id_flight"] = get_flight_key(flight["flight_number"], flight["departure_scheduled"])
+        flight["fingerprint"] = hashlib.blake2b(json.dumps(flight, sort_keys=True).encode(), digest_size=16).hexdigest()
+        yield flight
+
+
+def enrich_flights(flights):
+    """
+    Data enrichment, add the names and countries of the airports
 
+    :param flights: (iterable(dict)) the normalized flights
 
-def fatal_code(error_code):
+    ::returns: (generator(dict)) the enriched flights
     """
-    Fatal code of response backoff
+    for flight in flights:
+        departure_info = airport_info(flight["departure_iata"])
+        arrival_info = airport_info(flight["arrival_iata"])
+        flight["departure_airport"] = departure_info.name
+        flight["arrival_airport"] = arrival_info.name
+        flight["arrival_country"] = arrival_info.country
+        flight["departure_country"] = departure_info.country
+        yield flight
 
-    :params e: (int), response
 
-    ::returns: (bool), error value response
+def batched(items, batch_size: int):
     """
-    return 400 <= error_code.status_code < 500
+    Group the items of an iterable in lists
+
+    :param items: (iterable) the items
+    :param batch_size: (int) the maximum size of a list
+
+    ::returns: (generator(list)) the lists of at most batch_size items
+    """
+    assert isinstance(batch_size, int), "Wrong Type: batch_size must be an int"
+    assert batch_size > 0, "Wrong Value: batch_size must be positive"
+
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def correct_flights(batches):
+    """
+    Correct the times, status and delays of each batch and build the rows of the table
+
+    :param batches: (iterable(list(dict))) the enriched flights, by batch
+
+    ::returns: (generator(list(tuple))) the rows in FLIGHT_TABLE_COLUMNS order, by batch
+    """
+    for flights in batches:
+
+        def column(name):
+            return [flight[name] for flight in flights]
+
+        ##################################################
+        # Data Cleaning
+        # I have seen that the  flight status and delays are sometimes wrong and needs to be corrected
+        # Correction of landing
+        # correction of departure delay
+        ##################################################
+        (dep_hour, departure_date, flight_status, departure_delay,) = correct_datetime_info_batch(
+            column("departure_actual"),
+            column("departure_estimated"),
+            column("departure_scheduled"),
+            column("flight_status"),
+            column("departure_delay"),
+            "active",
+        )
+        ##################################################
+        # Correction of arrival delay
+        ##################################################
+        (arr_hour, arrival_date, flight_status, arrival_delay,) = correct_datetime_info_batch(
+            column("arrival_actual"),
+            column("arrival_estimated"),
+            column("arrival_scheduled"),
+            flight_status,
+            column("arrival_delay"),
+            "landed",
+        )
+
+        ##################################################
+        # Data to be injected in the SQL
+        # The Flight_number _ FULL DATE will be my unique key
+        ##################################################
+        yield [
+            (
+                flight["id_flight"],
+                dep_date,
+                arr_date,
+                flight["flight_number"],
+                status,
+                flight["departure_iata"],
+                flight["departure_airport"],
+                flight["arrival_iata"],
+                flight["arrival_airport"],
+                flight["departure_scheduled"],
+                dep_h,
+                flight["arrival_scheduled"],
+                arr_h,
+                flight["departure_estimated"],
+                flight["arrival_estimated"],
+                flight["departure_actual"],
+                flight["arrival_actual"],
+                dep_delay,
+                arr_delay,
+                flight["airline"],
+                flight["arrival_country"],
+                flight["departure_country"],
+            )
+            for flight, dep_h, dep_date, status, dep_delay, arr_h, arr_date, arr_delay in zip(
+                flights,
+                dep_hour.tolist(),
+                departure_date.tolist(),
+                flight_status.tolist(),
+                departure_delay.tolist(),
+                arr_hour.tolist(),
+                arrival_date.tolist(),
+                arrival_delay.tolist(),
+            )
+        ]
 
 
 class AirLabsData(SqlManager):
     """
     A class for managing data related to airlabs.
     Subclass of SqlManager, which is responsible for executing database queries.
-    This class also handles file management for json data files of arrival and departure flights.
+    This class also archives the payloads of arrival and departure flights, see data_pipeline.snapshots.
 
 
     :param datetime_query: (datetime), The date and time to query the data for.
-    :param force_update: (bool), A flag to indicate whether to force an update of the data. If set to True, the data will be retrieved from the database, even if it already exists in the json files. Default is False.
+    :param force_update: (bool), A flag to indicate whether to force an update of the data.
+        If set to True, the data will be retrieved from the database, even if it already exists in the json files. Default is False.
+    :param path_sql_db: (str, optional), path of the SQLite database. Default is None, see SqlManager.
+    :param client: (AirLabsClient, optional), client of the API. Default is None, which creates a client with the default cache.
+    :param snapshots: (SnapshotStore, optional), archive of the payloads. Default is None, which uses the default directory.
+    :param settings: (Settings, optional), the settings. Default is None, see SqlManager.
 
     :returns: None
     """
 
-    def __init__(self, datetime_query, force_update=None):
-        super().__init__()
+    api_url = AIRLABS_API_URL
+
+    def __init__(self, datetime_query, force_update=None, path_sql_db=None, client=None, snapshots=None, settings=None):
+        super().__init__(path_sql_db, settings)
+        self._client = client
+        if snapshots is None:
+            snapshots = SnapshotStore()
+        self.snapshots = snapshots
         if force_update is None:
             force_update = False
-        datetime_query = TimeAttribute(datetime_query)
-        self.file_arrival = FileFolderManager(
-            directory=f"data_pipeline/json_data/arrivals/{datetime_query.month}",
-            name_file=f"{datetime_query.short_under_score}_arrival_flights.json",
-        )
-        self.file_departure = FileFolderManager(
-            directory=f"data_pipeline/json_data/departures/{datetime_query.month}",
-            name_file=f"{datetime_query.short_under_score}_departure_flights.json",
-        )
+        self.datetime_query = TimeAttribute(datetime_query).datetime
         self.execute_force_update(force_update)
 
-    def execute_force_update(self, force_update):
+    @property
+    def client(self):
+        """
+        :return: (AirLabsClient) the client of the API, created on the first request so the jobs reading the snapshots do not import requests
         """
-        Execute force update for the json files containing arrival and departure flight data.
-        If the `force_update` flag is set to True, the data will be retrieved from the API and saved to the json files, even if the data already exists in the files.
+        return self._ensure_client()
 
-        :param force_update: (bool) A flag to indicate whether to force an update of the data. If set to True, the data will be retrieved from the API and saved to the json files.
-        :return: None
+    def _ensure_client(self):
+        """
+        Create the client of the API if it does not exist yet
+
+        :return: (AirLabsClient) the client
+        """
+        if self._client is None:
+            from data_pipeline.airlabs_client import AirLabsClient
+
+            self._client = AirLabsClient(self.api_url)
+        return self._client
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if self._client is not None:
+            self._client.close()
+
+    def execute_force_update(self, force_update, fetched_at=None):
         """
-        if force_update:
-            self.file_arrival.save_json(self.get_json_api("departure", "TUN", ["TU", "BJ", "AF", "TO"]).json())
-            self.file_departure.save_json(self.get_json_api("arrival", "TUN", ["TU", "BJ", "AF", "TO"]).json())
+        Execute force update of the archive of arrival and departure flight data.
+        If the `force_update` flag is set to True, the data will be retrieved from the API and appended to the snapshots, the previous fetches are kept.
+        The airports and types of flights are fetched concurrently, see fetch_schedules.
+
+        :param force_update: (bool) A flag to indicate whether to force an update of the data. If set to True, the data will be retrieved from the API and archived.
+        :param fetched_at: (float, optional) epoch of the fetch in the snapshots. Default is None, which uses the current time.
+        :return: (dict) the JSON payload by (airport_iata, type_flight) fetched, empty if force_update is False
+        """
+        if not force_update:
+            return {}
+        if fetched_at is None:
+            fetched_at = time.time()
+        schedules = self.fetch_schedules()
+        for (airport_iata, type_flight), json_flight in schedules.items():
+            self.snapshots.append(airport_iata, type_flight, json_flight, fetched_at)
+        print(f"AirLabs client: {self.client.stats}")
+        return schedules
+
+    def fetch_schedules(self, airports_iata=None, airline_iata=None, max_workers=API_MAX_CONCURRENCY):
+        """
+        Fetch the schedules of every airport and type of flight in parallel.
+        The requests share the pooled session and the retries of the client, at most max_workers requests are in flight.
+
+        :param airports_iata: (list(str), optional) The IATA codes of the airports. Default is None, which uses AIRPORTS_IATA.
+        :param airline_iata: (list(str), optional) The IATA codes of the airlines. Default is None, which uses AIRLINES_IATA.
+        :param max_workers: (int, optional) The maximum number of concurrent requests. Default is API_MAX_CONCURRENCY.
+        :return: (dict) The JSON payload by (airport_iata, type_flight), the requests that failed are left out
+        """
+        if airports_iata is None:
+            airports_iata = AIRPORTS_IATA
+        if airline_iata is None:
+            airline_iata = AIRLINES_IATA
+        assert isinstance(max_workers, int), "Wrong Type: max_workers must be an int"
+        assert max_workers > 0, "Wrong Value: max_workers must be positive"
+
+        import requests
+
+        # Fail fast on a missing token, and create the client shared by the workers before they start
+        self.settings.require("token_airlab")
+        self._ensure_client()
+        keys = list(product(airports_iata, TYPE_FLIGHTS))
+        schedules = {}
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="airlabs") as executor:
+            futures = {key: executor.submit(self.get_json_api, key[1], key[0], airline_iata) for key in keys}
+            for key, future in futures.items():
+                try:
+                    schedules[key] = future.result()
+                except (requests.exceptions.RequestException, ValueError) as error:
+                    print(f"{key[1]} schedule of {key[0]} failed: {error}")
+        return schedules
 
-    @backoff.on_exception(
-        backoff.expo,
-        requests.exceptions.RequestException,
-        max_time=300,
-        giveup=fatal_code,
-    )
     def get_json_api(self, type_flight: str, airport_iata: str, airline_iata=None):
         """
-        Retrieve flight data from the API in JSON format.
+        Retrieve flight data from the API in JSON format, through the client and its cache.
 
         :param type_flight: (str) The type of flight to retrieve data for. Can be either "DEPARTURE" or "ARRIVAL".
         :param airport_iata: (str) The IATA code of the airport to retrieve data for.
         :param airline_iata: (list(str), optional) A list of IATA codes of airlines to filter the data by. Default is None.
-        :return: (requests.Response) The JSON response of the API request
+        :return: (dict) The JSON response of the API request
         """
+        _token = self.settings.require("token_airlab").token_airlab
 
-        _token = get_env("token_airlab")
-
-        assert isinstance(_token, str), "_token must be a string"
-        assert _token.strip() != "", "_token must not be an empty string"
         assert isinstance(airport_iata, str), "airport_iata must be a string"
         assert isinstance(type_flight, str), "airport_iata must be a string"
         assert type_flight in {
@@ -90,39 +310,49 @@ class AirLabsData(SqlManager):
 
         print("getting json API")
         if airline_iata:
-            airline_iata = f"&airline_iata={airline_iata}" if isinstance(airline_iata, str) else "".join([f"&airline_iata={airline}" for airline in airline_iata])
-
+            airline_iata = [airline_iata] if isinstance(airline_iata, str) else list(airline_iata)
         else:
-            airline_iata = ""
-        api_request = f"https://airlabs.co/api/v9/schedules?{type_flight[:3]}_iata={airport_iata}{airline_iata}&api_key={_token}"
-        return requests.get(api_request, timeout=300)
+            airline_iata = []
+        params = [(f"{type_flight[:3].lower()}_iata", airport_iata)] + [("airline_iata", airline) for airline in airline_iata] + [("api_key", _token)]
+        with span("fetch", airport=airport_iata, type=type_flight) as fetch_span:
+            json_flight = self.client.get_json(params, timeout=300)
+            fetch_span.set(rows=len(json_flight.get("response", [])))
+        return json_flight
 
     def get_arrivals(self):
         """
-        Retrieve and process arrival flight data.
+        Retrieve and process arrival flight data of every airport.
 
         :param: None
         :return: None
         """
-        json_flight = None
-        while not json_flight:
-            json_flight = self.file_arrival.read_json()
-
-        self.get_flights(json_flight)
+        self.get_saved_flights("ARRIVAL")
 
     def get_departures(self):
         """
-        Process flight data from the API response.
-        Extracts relevant information and performs data cleaning and enrichment.
+        Retrieve and process departure flight data of every airport.
 
-        :param json_flight: (dict) The JSON flight data from the API response.
+        :param: None
         :return: None
         """
-        json_flight = None
-        while not json_flight:
-            json_flight = self.file_departure.read_json()
+        self.get_saved_flights("DEPARTURE")
 
-        self.get_flights(json_flight)
+    def get_saved_flights(self, type_flight):
+        """
+        Process the last snapshot of the day of each airport for a type of flight, the airports without a snapshot are skipped
+
+        :param type_flight: (str) "DEPARTURE" or "ARRIVAL"
+        :return: None
+        """
+        assert type_flight in TYPE_FLIGHTS, "Wrong Value: type_flight must be either 'DEPARTURE' or 'ARRIVAL'"
+
+        for airport_iata in AIRPORTS_IATA:
+            json_stream = self.snapshots.latest(airport_iata, type_flight, self.datetime_query)
+            if json_stream is None:
+                print(f"No {type_flight} schedule of {airport_iata}")
+                continue
+            with json_stream:
+                self.ingest_flights(iter_json_array(json_stream, "response"))
 
     def get_flights(self, json_flight):
         """
@@ -132,97 +362,92 @@ class AirLabsData(SqlManager):
 
         :returns: None
         """
-        # Get the response data
-        real_time_flights = json_flight["response"]
-
-        # Loop through each flight and  prepare the data
-        for flight in real_time_flights:
-            airline = flight["airline_iata"]
-            flight_number = flight["flight_iata"]
-            flight_status = flight["status"]
-            departure_iata = flight["dep_iata"]
-            arrival_iata = flight["arr_iata"]
-            departure_scheduled = flight["dep_time"]
-            arrival_scheduled = flight["arr_time"]
-
-            # Data enrichment
-            departure_airport = get_airport_name(departure_iata)
-            arrival_airport = get_airport_name(arrival_iata)
-            arrival_country = get_airport_country(arrival_iata)
-            departure_country = get_airport_country(departure_iata)
+        self.ingest_flights(json_flight["response"])
 
-            # Handling if exist
-            # Data cleaning
-            departure_estimated = flight["dep_estimated"] if "dep_estimated" in flight else ""
-            arrival_estimated = flight["arr_estimated"] if "arr_estimated" in flight else ""
-            departure_actual = flight["dep_actual"] if "dep_actual" in flight else ""
-            arrival_actual = flight["arr_actual"] if "arr_actual" in flight else ""
-            departure_delay = flight["delayed"] if "delayed" in flight else 0
-            arrival_delay = flight["delayed"] if "delayed" in flight else 0
-            departure_delay = 0 if departure_delay is None else int(departure_delay)
-            arrival_delay = 0 if arrival_delay is None else int(arrival_delay)
-
-            ##################################################
-            # Data Cleaning
-            # I have seen that the  flight status and delays are sometimes wrong and needs to be corrected
-            # Correction of landing
-            # correction of departure delay
-            ##################################################
-
-            (dep_hour, departure_date, flight_status, departure_delay,) = correct_datetime_info(
-                departure_actual,
-                departure_estimated,
-                departure_scheduled,
-                flight_status,
-                departure_delay,
-                "active",
-            )
-            ##################################################
-            # Correction of arrival delay
-            ##################################################
-            (arr_hour, arrival_date, flight_status, arrival_delay,) = correct_datetime_info(
-                arrival_actual,
-                arrival_estimated,
-                arrival_scheduled,
-                flight_status,
-                arrival_delay,
-                "landed",
-            )
+    def ingest_flights(self, real_time_flights, batch_size=FLIGHT_BATCH_SIZE):
+        """
+        Clean, enrich and upsert the flights of the API, batch by batch.
+        real_time_flights can be a generator, e.g. iter_json_array, only one batch is in memory at a time.
+        The flights whose API record has the fingerprint saved by the previous ingest and whose status is final are skipped
+        before any cleaning. The other unchanged records are corrected again, their status moves with the time, and their
+        row is written only if the status moved.
+        The batches are written in one transaction.
+
+        :param real_time_flights: (iterable(dict)) the flights of the API response
+        :param batch_size: (int, optional) number of flights corrected and upserted together. Default is FLIGHT_BATCH_SIZE.
+        :return: (dict) the number of new, changed and unchanged flights
+        """
+        churn = dict.fromkeys(["new", "changed", "unchanged"], 0)
+        timestamps = parse_timestamp.cache_info()
+        with span("ingest") as ingest_span, self.transaction():
+            # The items are parsed as the batches are pulled, the parse spans time each pull
+            for flights in iterate("parse", batched(fingerprint_flights(normalize_flights(real_time_flights)), batch_size)):
+                with span("diff", rows=len(flights)):
+                    flights = self.changed_flights(flights, churn)
+                if not flights:
+                    continue
+                with span("enrich", rows=len(flights)):
+                    flights = list(enrich_flights(flights))
+                with span("correct", rows=len(flights)):
+                    flights_extracted = [row for rows in correct_flights([flights]) for row in rows]
+                flights, flights_extracted = self.moved_flights(flights, flights_extracted, churn)
+                if not flights:
+                    continue
+                ##################################################
+                # Updating the SQL TABLE
+                # If the unique key exist => It will be updated
+                # Else it will be created
+                ##################################################
+                with span("upsert", rows=len(flights_extracted)):
+                    self.upsert_flights(flights_extracted, [flight["fingerprint"] for flight in flights])
+            # The timestamps of the batch parsed from the shared cache or again
+            cache_info = parse_timestamp.cache_info()
+            ingest_span.set(**churn, timestamp_hits=cache_info.hits - timestamps.hits, timestamp_misses=cache_info.misses - timestamps.misses)
+        print(f"Import completed: {churn['new']} new, {churn['changed']} changed, {churn['unchanged']} unchanged flights")
+        return churn
+
+    def changed_flights(self, flights, churn):
+        """
+        Keep the flights that are not in the table, whose fingerprint changed or whose status may move with the time.
+        The last ones keep their saved status in `saved_status`, they are counted once corrected, see moved_flights.
 
-            ##################################################
-            # Data to be injected in the SQL
-            # The Flight_number _ FULL DATE will be my unique key
-            # Replacing NONE by null text string
-            ##################################################
-            flight_key = get_flight_key(flight_number, departure_scheduled)
-            flight_extracted = (
-                flight_key,
-                departure_date,
-                arrival_date,
-                flight_number,
-                flight_status,
-                departure_iata,
-                departure_airport,
-                arrival_iata,
-                arrival_airport,
-                departure_scheduled,
-                dep_hour,
-                arrival_scheduled,
-                arr_hour,
-                departure_estimated,
-                arrival_estimated,
-                departure_actual,
-                arrival_actual,
-                departure_delay,
-                arrival_delay,
-                airline,
-                arrival_country,
-                departure_country,
-            )
-            ##################################################
-            # Updating the SQL TABLE
-            # If the unique key exist => It will be updated
-            # Else it will be created
-            ##################################################
-            self.update_table(flight_key, flight_extracted)
-        print("Import completed")
+        :param flights: (list(dict)) the fingerprinted flights of a batch
+        :param churn: (dict) the counts of new, changed and unchanged flights, updated in place
+        :return: (list(dict)) the flights to correct
+        """
+        saved = self.saved_states(list({flight["id_flight"] for flight in flights}))
+        changed = []
+        for flight in flights:
+            fingerprint, status = saved.get(flight["id_flight"], (None, None))
+            if flight["id_flight"] not in saved:
+                churn["new"] += 1
+            elif fingerprint != flight["fingerprint"]:
+                churn["changed"] += 1
+            elif status in FINAL_FLIGHT_STATUS:
+                churn["unchanged"] += 1
+                continue
+            else:
+                flight["saved_status"] = status
+            changed.append(flight)
+        return changed
+
+    @staticmethod
+    def moved_flights(flights, rows, churn):
+        """
+        Drop the unchanged records whose corrected status is still the saved one
+
+        :param flights: (list(dict)) the flights of changed_flights
+        :param rows: (list(tuple)) their corrected rows in FLIGHT_TABLE_COLUMNS order
+        :param churn: (dict) the counts of new, changed and unchanged flights, updated in place
+        :return: (tuple(list(dict), list(tuple))) the flights and the rows to write
+        """
+        status_index = FLIGHT_TABLE_COLUMNS.index("FLIGHT_STATUS")
+        kept = []
+        for flight, row in zip(flights, rows):
+            if "saved_status" in flight:
+                moved = row[status_index] != flight["saved_status"]
+                churn["changed" if moved else "unchanged"] += 1
+                if not moved:
+                    continue
+            kept.append((flight, row))
+        return [flight for flight, _ in kept], [row for _, row in kept]
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+"""
+Rebuild the flights from the archived payloads, e.g. after a fix of the cleaning or of the enrichment
+The days of a period are split in units of one airport and one type of flight. The workers of a process pool
+replay the snapshots of a unit, then normalize, clean and enrich its flights. The main process is the single
+writer: it upserts the units in order in a fresh database and checkpoints each unit in the same transaction,
+so an interrupted backfill resumes after the last unit written.
+The daily json files of the previous layout are imported in the snapshots first with --legacy-dir.
+
+python -m data_pipeline.backfill START END --db path [--snapshots directory] [--legacy-dir directory] [--workers N]
+"""
+import os
+import time
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import partial
+from itertools import product
+from typing import NamedTuple
+
+from data_pipeline.api_requests import batched, correct_flights, enrich_flights, fingerprint_flights, normalize_flights
+from data_pipeline.snapshots import SNAPSHOT_DIR, SnapshotStore
+from data_pipeline.sql_functions import SqlManager
+from src.const import AIRPORTS_IATA, BACKFILL_TABLE, BACKFILL_TABLE_NAME, FLIGHT_BATCH_SIZE, SQL_TABLE_NAME, TYPE_FLIGHTS
+
+# Seconds between two progress reports
+PROGRESS_INTERVAL = 10
+
+
+class BackfillUnit(NamedTuple):
+    """
+    The payloads of one airport and type of flight fetched during a day
+    """
+
+    day: date
+    airport_iata: str
+    type_flight: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.day.isoformat()}_{self.airport_iata}_{self.type_flight}"
+
+
+def backfill_units(start: date, end: date) -> list:
+    """
+    :param start: (date) first day
+    :param end: (date) last day, included
+    :return: (list(BackfillUnit)) the units of the period, day by day
+    """
+    assert start <= end, "Wrong Value: start must be before end"
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    return [BackfillUnit(day, airport_iata, type_flight) for day, airport_iata, type_flight in product(days, AIRPORTS_IATA, TYPE_FLIGHTS)]
+
+
+def process_unit(snapshot_dir: str, unit: BackfillUnit):
+    """
+    Worker of the backfill, replay the snapshots of a unit and build the rows of its flights.
+    A flight fetched several times keeps its last record, as the hourly ingests would have.
+
+    :param snapshot_dir: (str) root directory of the snapshots
+    :param unit: (BackfillUnit) the unit
+    :return: (tuple(list(tuple), list(str), int)) the rows in FLIGHT_TABLE_COLUMNS order, their fingerprints and the number of payloads
+    """
+    store = SnapshotStore(snapshot_dir)
+    start, end = store.day_bounds(unit.day)
+    flights = {}
+    nb_payloads = 0
+    for _, payload in store.replay(unit.airport_iata, unit.type_flight, start, end):
+        nb_payloads += 1
+        for flight in fingerprint_flights(normalize_flights(payload.get("response", []))):
+            flights[flight["id_flight"]] = flight
+
+    flights = list(flights.values())
+    rows = [row for batch in correct_flights(batched(enrich_flights(flights), FLIGHT_BATCH_SIZE)) for row in batch]
+    return rows, [flight["fingerprint"] for flight in flights], nb_payloads
+
+
+def completed_units(sql_table: SqlManager) -> set:
+    """
+    Create the checkpoint table if needed, a database with flights and without checkpoint is not a backfill
+
+    :param sql_table: (SqlManager) the database of the backfill
+    :raises ValueError: if the database already has flights that were not written by a backfill
+    :return: (set(str)) the keys of the units already written
+    """
+    tables = {row[0] for row in sql_table.execute_sql("SELECT name FROM sqlite_master WHERE type = 'table'", "fetchall")}
+    if BACKFILL_TABLE_NAME not in tables and sql_table.execute_sql(f"SELECT COUNT(*) FROM {SQL_TABLE_NAME}", "fetchone")[0]:
+        raise ValueError(f"Wrong Value: {sql_table.path_sql_db} is not a backfill database, use a new path")
+    sql_table.execute_sql(f"CREATE TABLE IF NOT EXISTS {BACKFILL_TABLE_NAME} {BACKFILL_TABLE}")
+    return {row[0] for row in sql_table.execute_sql(f"SELECT UNIT FROM {BACKFILL_TABLE_NAME}", "fetchall")}
+
+
+def ordered_results(executor, func, items, window: int):
+    """
+    Map a function over the items in a pool, at most `window` items are pending or waiting to be consumed
+
+    :param executor: (concurrent.futures.Executor) the pool
+    :param func: (callable) the function, picklable
+    :param items: (list) the items
+    :param window: (int) the maximum number of submitted items not consumed yet
+    :return: (generator(tuple)) the item and its result, in the order of the items
+    """
+    pending = deque()
+    for item in items:
+        pending.append((item, executor.submit(func, item)))
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+def backfill(start: date, end: date, path_sql_db: str, snapshot_dir=SNAPSHOT_DIR, workers=None, legacy_dir=None):
+    """
+    Rebuild the flights of a period from the snapshots in a fresh database
+
+    :param start: (date) first day
+    :param end: (date) last day, included
+    :param path_sql_db: (str) path of the database, created if it does not exist, resumed if it is an interrupted backfill
+    :param snapshot_dir: (str, optional) root directory of the snapshots. Default is SNAPSHOT_DIR.
+    :param workers: (int, optional) number of processes. Default is None, one per CPU.
+    :param legacy_dir: (str, optional) json_data directory of the previous layout, imported in the snapshots first.
+        Default is None, the snapshots only.
+    :raises ValueError: if the database has flights that were not written by a backfill
+    :return: (dict) the number of units, payloads and flights written and the elapsed seconds
+    """
+    stats = dict.fromkeys(["units", "payloads", "flights"], 0)
+    started = last_report = time.perf_counter()
+    if legacy_dir is not None:
+        print(f"{SnapshotStore(snapshot_dir).import_legacy(legacy_dir)} legacy files imported from {legacy_dir}")
+    with SqlManager(path_sql_db) as sql_table:
+        done = completed_units(sql_table)
+        units = [unit for unit in backfill_units(start, end) if unit.key not in done]
+        print(f"Backfill of {start} to {end}: {len(units)} units to process, {len(done)} already written")
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = ordered_results(executor, partial(process_unit, snapshot_dir), units, 2 * workers)
+            for unit, (rows, fingerprints, nb_payloads) in results:
+                with sql_table.transaction():
+                    if rows:
+                        sql_table.upsert_flights(rows, fingerprints)
+                    sql_table.conn.execute(
+                        f"INSERT INTO {BACKFILL_TABLE_NAME} VALUES (?, ?, ?, ?)",
+                        (unit.key, nb_payloads, len(rows), datetime.now().isoformat(timespec="seconds")),
+                    )
+                stats["units"] += 1
+                stats["payloads"] += nb_payloads
+                stats["flights"] += len(rows)
+                if time.perf_counter() - last_report > PROGRESS_INTERVAL:
+                    last_report = time.perf_counter()
+                    print(f"{stats['units']}/{len(units)} units, {stats['flights'] / (last_report - started):.0f} flights/s")
+
+    stats["seconds"] = time.perf_counter() - started
+    print(
+        f"Backfill completed: {stats['units']} units, {stats['payloads']} payloads, {stats['flights']} flights "
+        f"in {stats['seconds']:.1f} s, {stats['flights'] / max(stats['seconds'], 1e-9):.0f} flights/s"
+    )
+    return stats
+
+
+def main():  # pragma: no cover
+    """
+    Main function
+    """
+    parser = ArgumentParser("Rebuild the flights from the archived payloads")
+    parser.add_argument("start", type=date.fromisoformat, help="first day, YYYY-MM-DD")
+    parser.add_argument("end", type=date.fromisoformat, help="last day included, YYYY-MM-DD")
+    parser.add_argument("--db", required=True, help="path of the new database, an interrupted backfill is resumed")
+    parser.add_argument("--snapshots", default=SNAPSHOT_DIR, help="root directory of the snapshots")
+    parser.add_argument("--legacy-dir", default=None, help="json_data directory of the previous layout to import first")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes, default is one per CPU")
+    args = parser.parse_args()
+
+    backfill(args.start, args.end, args.db, args.snapshots, args.workers, args.legacy_dir)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+"""
+Long-running ingest, instead of a cold start of api_job.py every hour
+One process keeps the AirLabs session, the database connection and the airport caches. It fetches more often
+when flights are in the air or due soon and less often overnight, and regenerates the report only when an
+ingest added or changed flights. SIGTERM or SIGINT stop it after the current fetch.
+
+python -m data_pipeline.daemon
+"""
+import signal
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from data_pipeline.api_requests import AirLabsData
+from src.const import POLL_BUSY_FLIGHTS, POLL_INTERVAL_MAX, POLL_INTERVAL_MIN, POLL_LOOKAHEAD, SQL_TABLE_NAME
+from src.utils import PYTZ_TN
+
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+class SystemClock:
+    """
+    Clock of the daemon, a wait ends early when the daemon is stopped
+    """
+
+    def __init__(self):
+        self.tz = PYTZ_TN
+
+    def now(self) -> datetime:
+        """
+        :return: (datetime) the current time in Tunisia
+        """
+        return datetime.now(self.tz)
+
+    def wait(self, event: threading.Event, seconds: float) -> bool:
+        """
+        :param event: (threading.Event) the stop event of the daemon
+        :param seconds: (float) the time to wait
+        :return: (bool) True if the event is set
+        """
+        return event.wait(seconds)
+
+
+def poll_interval(busy_flights: int) -> float:
+    """
+    Seconds until the next fetch, from POLL_INTERVAL_MAX without flights down to POLL_INTERVAL_MIN
+
+    :param busy_flights: (int) the number of flights in the air or due soon
+    :return: (float) the interval
+    """
+    assert busy_flights >= 0, "Wrong Value: busy_flights must be positive"
+    return POLL_INTERVAL_MIN + (POLL_INTERVAL_MAX - POLL_INTERVAL_MIN) * POLL_BUSY_FLIGHTS / (POLL_BUSY_FLIGHTS + busy_flights)
+
+
+def busy_flights(sql_table, now: datetime) -> int:
+    """
+    Count the flights in the air or scheduled to depart or arrive within POLL_LOOKAHEAD
+
+    :param sql_table: (SqlManager) the database
+    :param now: (datetime) the current time in Tunisia
+    :return: (int) the number of flights
+    """
+    start = now.strftime("%Y-%m-%d %H:%M")
+    end = (now + timedelta(seconds=POLL_LOOKAHEAD)).strftime("%Y-%m-%d %H:%M")
+    yesterday = (now - timedelta(days=1)).strftime("%Y-%m-%d")
+    return sql_table.conn.execute(
+        f"""
+        SELECT COUNT(*) FROM {SQL_TABLE_NAME}
+        WHERE ((FLIGHT_STATUS = 'active') AND (DEPARTURE_DATE >= ?))
+        OR (DEPARTURE_SCHEDULED BETWEEN ? AND ?)
+        OR (ARRIVAL_SCHEDULED BETWEEN ? AND ?)
+        """,
+        (yesterday, start, end, start, end),
+    ).fetchone()[0]
+
+
+def regenerate_report(airlabs: AirLabsData, now: datetime):
+    """
+    Clean the flights of the day and generate its report, as api_job.py does
+
+    :param airlabs: (AirLabsData) the manager of the daemon
+    :param now: (datetime) the current time
+    :return: None
+    """
+    # The reports need pandas, matplotlib and PIL, they are imported at the first change only
+    from data_analysis.pillow_reports import generate_report
+
+    airlabs.clean_sql_table(now)
+    generate_report(now, airlabs)
+
+
+class IngestDaemon:
+    """
+    Fetch, archive and ingest the schedules in a loop
+
+    :param airlabs: (AirLabsData) the manager, its client and connection are kept between the fetches
+    :param clock: (SystemClock, optional) the clock. Default is None, which uses the system clock.
+    :param on_change: (callable, optional) called with the manager and the time after an ingest that added or changed flights. Default is regenerate_report.
+    """
+
+    def __init__(self, airlabs: AirLabsData, clock=None, on_change=regenerate_report):
+        self.airlabs = airlabs
+        self.clock = SystemClock() if clock is None else clock
+        self.on_change = on_change
+        self.stopping = threading.Event()
+
+    def stop(self, signum=None, frame=None):
+        """
+        Stop the daemon after the current fetch, it is the handler of STOP_SIGNALS
+        """
+        print(f"Stopping the ingest daemon{f' on signal {signum}' if signum else ''}")
+        self.stopping.set()
+
+    def tick(self) -> dict:
+        """
+        Fetch, archive and ingest the schedules, then regenerate the report if flights were added or changed
+
+        :return: (dict) the number of new, changed and unchanged flights
+        """
+        now = self.clock.now()
+        self.airlabs.datetime_query = now
+        churn = dict.fromkeys(["new", "changed", "unchanged"], 0)
+        for json_flight in self.airlabs.execute_force_update(True, now.timestamp()).values():
+            for name, count in self.airlabs.ingest_flights(json_flight.get("response", [])).items():
+                churn[name] += count
+        if churn["new"] or churn["changed"]:
+            self.on_change(self.airlabs, now)
+        return churn
+
+    def run(self, max_ticks=None) -> int:
+        """
+        Run until stopped, the stop signals are handled when it runs in the main thread
+
+        :param max_ticks: (int, optional) stop after this number of fetches. Default is None, run until stopped.
+        :return: (int) the number of fetches
+        """
+        handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            handlers = {signum: signal.signal(signum, self.stop) for signum in STOP_SIGNALS}
+        ticks = 0
+        try:
+            while not self.stopping.is_set():
+                try:
+                    self.tick()
+                except Exception:
+                    # A failed fetch or report must not stop the daemon, the next tick retries
+                    traceback.print_exc()
+                ticks += 1
+                if max_ticks is not None and ticks >= max_ticks:
+                    break
+                interval = poll_interval(busy_flights(self.airlabs, self.clock.now()))
+                print(f"Next fetch in {interval / 60:.0f} min")
+                self.clock.wait(self.stopping, interval)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        return ticks
+
+
+def main():  # pragma: no cover
+    """
+    Main function
+    """
+    with AirLabsData(datetime.now()) as airlabs:
+        IngestDaemon(airlabs).run()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
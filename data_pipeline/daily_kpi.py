@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+"""
+Daily KPI rollup of the flights
+One row per departure date, airline and type of flight (DEPARTURE or ARRIVAL) with the counts per status
+and the count, MIN, MAX and AVG of the delays, so the report reads indexed rows instead of scanning the flights.
+The rows of a date are recomputed whenever a flight of that date is upserted or cleaned.
+
+python -m data_pipeline.daily_kpi rebuild|check [--db path]
+"""
+from src.const import DAILY_KPI_COLUMNS, DAILY_KPI_TABLE, DAILY_KPI_TABLE_NAME, FLIGHT_STATUS, SQL_PARAMETERS_PER_QUERY, SQL_TABLE_NAME, TYPE_FLIGHTS
+
+
+def kpi_select(type_flight: str, condition=""):
+    """
+    Build the grouped query computing the rollup rows of a type of flight from the flights.
+    A delay counts when it is positive and the flight is not cancelled.
+
+    :param type_flight: (str) DEPARTURE or ARRIVAL
+    :param condition: (str, optional) An optional SQL WHERE clause to filter the flights. Default is an empty string.
+    :return: (str) the SQL query, its columns are DAILY_KPI_COLUMNS
+    """
+    assert type_flight in TYPE_FLIGHTS, "type_flight must be either 'DEPARTURE' or 'ARRIVAL'"
+    delay = f"{type_flight}_DELAY"
+    delayed = f"(({delay} > 0) AND (FLIGHT_STATUS <> 'cancelled'))"
+    aggregates = [
+        "DEPARTURE_DATE",
+        "AIRLINE",
+        f"'{type_flight}'",
+        "COUNT(*)",
+        *[f"SUM(FLIGHT_STATUS = '{status}')" for status in FLIGHT_STATUS],
+        f"SUM({delayed})",
+        f"MIN(CASE WHEN {delayed} THEN {delay} END)",
+        f"MAX(CASE WHEN {delayed} THEN {delay} END)",
+        f"AVG(CASE WHEN {delayed} THEN {delay} END)",
+    ]
+    select = ",\n        ".join(f"{aggregate} AS {column}" for aggregate, column in zip(aggregates, DAILY_KPI_COLUMNS))
+    return f"""
+    SELECT
+        {select}
+    FROM {SQL_TABLE_NAME}
+    {condition}
+    GROUP BY DEPARTURE_DATE, AIRLINE
+    """
+
+
+def create_daily_kpi(conn):
+    """
+    Create the rollup table and fill it from the existing flights
+
+    :param conn: (sqlite3.Connection) the connection of the database
+    :return: None
+    """
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {DAILY_KPI_TABLE_NAME} {DAILY_KPI_TABLE}")
+    rebuild_daily_kpi(conn)
+
+
+def refresh_daily_kpi(conn, dates):
+    """
+    Recompute the rollup rows of some departure dates
+
+    :param conn: (sqlite3.Connection) the connection of the database, the caller handles the transaction
+    :param dates: (iterable(str)) the departure dates to recompute
+    :return: None
+    """
+    dates = sorted({kpi_date for kpi_date in dates if kpi_date is not None})
+    for index in range(0, len(dates), SQL_PARAMETERS_PER_QUERY):
+        chunk = dates[index : index + SQL_PARAMETERS_PER_QUERY]
+        placeholders = ", ".join("?" * len(chunk))
+        conn.execute(f"DELETE FROM {DAILY_KPI_TABLE_NAME} WHERE KPI_DATE IN ({placeholders})", chunk)
+        for type_flight in TYPE_FLIGHTS:
+            conn.execute(
+                f"INSERT INTO {DAILY_KPI_TABLE_NAME} {kpi_select(type_flight, f'WHERE DEPARTURE_DATE IN ({placeholders})')}",
+                chunk,
+            )
+
+
+def rebuild_daily_kpi(conn):
+    """
+    Recompute the whole rollup from the flights
+
+    :param conn: (sqlite3.Connection) the connection of the database, the caller handles the transaction
+    :return: (int) the number of rollup rows
+    """
+    conn.execute(f"DELETE FROM {DAILY_KPI_TABLE_NAME}")
+    for type_flight in TYPE_FLIGHTS:
+        conn.execute(f"INSERT INTO {DAILY_KPI_TABLE_NAME} {kpi_select(type_flight, 'WHERE DEPARTURE_DATE IS NOT NULL')}")
+    return conn.execute(f"SELECT COUNT(*) FROM {DAILY_KPI_TABLE_NAME}").fetchone()[0]
+
+
+def check_daily_kpi(conn):
+    """
+    Compare the rollup with a full recompute from the flights
+
+    :param conn: (sqlite3.Connection) the connection of the database
+    :return: (list(tuple)) the (KPI_DATE, AIRLINE, FLIGHT_TYPE) keys that differ, empty if the rollup is consistent
+    """
+    recompute = " UNION ALL ".join(kpi_select(type_flight, "WHERE DEPARTURE_DATE IS NOT NULL") for type_flight in TYPE_FLIGHTS)
+    recompute = f"SELECT * FROM ({recompute})"
+    rollup = f"SELECT {', '.join(DAILY_KPI_COLUMNS)} FROM {DAILY_KPI_TABLE_NAME}"
+    mismatches = conn.execute(
+        f"""
+        SELECT KPI_DATE, AIRLINE, FLIGHT_TYPE FROM ({recompute} EXCEPT {rollup})
+        UNION
+        SELECT KPI_DATE, AIRLINE, FLIGHT_TYPE FROM ({rollup} EXCEPT {recompute})
+        ORDER BY 1, 2, 3
+        """
+    ).fetchall()
+    return mismatches
+
+
+def get_daily_kpi(conn, kpi_date: str, airline: str):
+    """
+    Get the rollup rows of a date and an airline
+
+    :param conn: (sqlite3.Connection) the connection of the database
+    :param kpi_date: (str) the departure date
+    :param airline: (str) the IATA code of the airline
+    :return: (dict) the row as a dict for each type of flight, the counts are 0 and the delays None if there is no flight
+    """
+    rows = conn.execute(
+        f"""
+        SELECT {', '.join(DAILY_KPI_COLUMNS)}
+        FROM {DAILY_KPI_TABLE_NAME}
+        WHERE (KPI_DATE = ?) AND (AIRLINE = ?)
+        """,
+        (kpi_date, airline),
+    ).fetchall()
+    daily_kpi = {type_flight: {**dict.fromkeys(DAILY_KPI_COLUMNS[3:9], 0), **dict.fromkeys(DAILY_KPI_COLUMNS[9:])} for type_flight in TYPE_FLIGHTS}
+    for row in rows:
+        daily_kpi[row[2]] = dict(zip(DAILY_KPI_COLUMNS, row))
+    return daily_kpi
+
+
+def main():  # pragma: no cover
+    """
+    Main function
+    """
+    from argparse import ArgumentParser
+
+    from data_pipeline.sql_functions import SqlManager
+
+    parser = ArgumentParser("Daily KPI rollup")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("--db", default=None, help="path of the database, default is file_name of the .env file")
+    args = parser.parse_args()
+
+    with SqlManager(args.db) as sql_table:
+        if args.command == "rebuild":
+            with sql_table.transaction():
+                print(f"{rebuild_daily_kpi(sql_table.conn)} rollup rows rebuilt")
+        else:
+            mismatches = check_daily_kpi(sql_table.conn)
+            for mismatch in mismatches:
+                print("mismatch", *mismatch)
+            print("rollup is consistent" if not mismatches else f"{len(mismatches)} rollup rows differ")
+            raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+"""
+Module to download the SQLite database from the FTP server
+The download is skipped when the remote SIZE and MDTM did not change since the last sync.
+It is written to a .part file next to the database, resumed with REST after a dropped transfer,
+verified and only then renamed over the database, so the database is never left truncated.
+The database is renamed over only while no other connection uses it, under an exclusive lock.
+"""
+import hashlib
+import io
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+
+# Suffixes of the files kept next to the local database
+STATE_SUFFIX = ".ftp.json"
+PARTIAL_SUFFIX = ".part"
+CHECKSUM_SUFFIX = ".sha256"
+
+
+class FtpSyncError(Exception):
+    """
+    The downloaded database failed a verification, or the local database is in use
+    """
+
+
+def remote_stamp(ftp, remote_name: str) -> dict:
+    """
+    Get the size and the modification time of a remote file
+
+    :param ftp: (ftplib.FTP) the logged in FTP connection
+    :param remote_name: (str) the name of the file in the current directory
+    :return: (dict) the size in bytes and the MDTM timestamp of the file
+    """
+    ftp.voidcmd("TYPE I")
+    size = ftp.size(remote_name)
+    mdtm = ftp.sendcmd(f"MDTM {remote_name}").split()[-1]
+    return {"size": size, "mdtm": mdtm}
+
+
+def remote_checksum(ftp, remote_name: str):
+    """
+    Get the published SHA-256 of a remote file, from the `<name>.sha256` file next to it
+
+    :param ftp: (ftplib.FTP) the logged in FTP connection
+    :param remote_name: (str) the name of the file in the current directory
+    :return: (str) the hexadecimal digest, None if the server does not publish one
+    """
+    import ftplib
+
+    buffer = io.BytesIO()
+    try:
+        ftp.retrbinary(f"RETR {remote_name}{CHECKSUM_SUFFIX}", buffer.write)
+    except ftplib.error_perm:
+        return None
+    return buffer.getvalue().decode("ascii").split()[0].lower()
+
+
+def file_sha256(path: str) -> str:
+    """
+    Compute the SHA-256 of a file
+
+    :param path: (str) the path of the file
+    :return: (str) the hexadecimal digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def check_integrity(path: str):
+    """
+    Run PRAGMA integrity_check on a SQLite file
+
+    :param path: (str) the path of the database
+    :raises FtpSyncError: if the file is not a sound SQLite database
+    """
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            result = conn.execute("PRAGMA integrity_check").fetchall()
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as error:
+        raise FtpSyncError(f"{path} is not a SQLite database: {error}") from error
+    if result != [("ok",)]:
+        raise FtpSyncError(f"integrity check of {path} failed: {result[:5]}")
+
+
+@contextmanager
+def exclusive_access(path: str):
+    """
+    Context manager holding the local database alone while it is replaced.
+    Leaving WAL mode needs the only connection to the database, it checkpoints the WAL and removes the -wal and -shm files,
+    then an exclusive lock keeps the other connections out until the block ends.
+
+    :param path: (str) the path of the database
+    :raises FtpSyncError: if another connection uses the database
+    """
+    if not os.path.exists(path):
+        yield
+        return
+    conn = sqlite3.connect(path, timeout=0, isolation_level=None)
+    try:
+        try:
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.execute("BEGIN EXCLUSIVE")
+        except sqlite3.OperationalError as error:
+            raise FtpSyncError(f"{path} is used by another connection, close it before the sync: {error}") from error
+        except sqlite3.DatabaseError:
+            # Not a database, nothing can be reading it
+            pass
+        yield
+    finally:
+        conn.close()
+
+
+def read_state(local_path: str) -> dict:
+    """
+    Read the state of the last sync, saved next to the local database
+
+    :param local_path: (str) the path of the local database
+    :return: (dict) the state, empty if there was no sync
+    """
+    try:
+        with open(local_path + STATE_SUFFIX, encoding="UTF-8") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_state(local_path: str, state: dict):
+    """
+    Save the state of the sync next to the local database
+
+    :param local_path: (str) the path of the local database
+    :param state: (dict) the state to save
+    """
+    with open(local_path + STATE_SUFFIX, "w", encoding="UTF-8") as file:
+        json.dump(state, file)
+
+
+def sync_ftp_file(ftp, remote_name: str, local_path: str) -> bool:
+    """
+    Download a remote SQLite database over the local one if it changed
+
+    :param ftp: (ftplib.FTP) the logged in FTP connection, in the directory of the file
+    :param remote_name: (str) the name of the remote file
+    :param local_path: (str) the path of the local database, its connections must be closed
+    :raises FtpSyncError: if the downloaded file is incomplete, has the wrong checksum or is not a sound database,
+        or if another connection uses the local database
+    :return: (bool) True if the database was replaced, False if it was already up to date
+    """
+    assert isinstance(remote_name, str), "Wrong Type: remote_name must be a string"
+    assert isinstance(local_path, str), "Wrong Type: local_path must be a string"
+
+    stamp = remote_stamp(ftp, remote_name)
+    state = read_state(local_path)
+    if os.path.exists(local_path) and state.get("remote") == stamp:
+        print(f"{remote_name} is unchanged on the FTP server")
+        return False
+
+    # A partial download is resumed only if it comes from the same remote file
+    partial_path = local_path + PARTIAL_SUFFIX
+    offset = 0
+    if os.path.exists(partial_path):
+        if state.get("partial") == stamp and os.path.getsize(partial_path) <= stamp["size"]:
+            offset = os.path.getsize(partial_path)
+        else:
+            os.remove(partial_path)
+    write_state(local_path, {**state, "partial": stamp})
+
+    with open(partial_path, "ab") as file:
+        if offset < stamp["size"]:
+            ftp.retrbinary(f"RETR {remote_name}", file.write, rest=offset or None)
+    if os.path.getsize(partial_path) != stamp["size"]:
+        raise FtpSyncError(f"{partial_path} has {os.path.getsize(partial_path)} bytes instead of {stamp['size']}")
+
+    sha256 = file_sha256(partial_path)
+    expected = remote_checksum(ftp, remote_name)
+    try:
+        if expected is not None and expected != sha256:
+            raise FtpSyncError(f"SHA-256 of {partial_path} is {sha256} instead of {expected}")
+        check_integrity(partial_path)
+    except FtpSyncError:
+        os.remove(partial_path)
+        write_state(local_path, {key: value for key, value in state.items() if key != "partial"})
+        raise
+
+    with exclusive_access(local_path):
+        # A WAL left by the old database must not be replayed on the new one
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(local_path + suffix):
+                os.remove(local_path + suffix)
+        os.replace(partial_path, local_path)
+    write_state(local_path, {"remote": stamp, "sha256": sha256})
+    return True
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+"""
+Incremental parsing of the JSON payloads
+The items of one array of the top-level object are decoded one at a time from a file or an HTTP body,
+so the memory used does not depend on the size of the payload.
+"""
+import codecs
+import json
+
+JSON_WHITESPACE = " \t\n\r"
+# Characters that can follow a complete value
+JSON_DELIMITERS = JSON_WHITESPACE + ",:]}"
+
+
+class JsonStreamReader:
+    """
+    Buffer over a text or binary stream, refilled by chunks as the values are decoded
+
+    :param stream: (file object) the stream, opened in text or binary mode
+    :param chunk_size: (int, optional) number of characters read at a time. Defaults to 65536
+    """
+
+    def __init__(self, stream, chunk_size=1 << 16):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("UTF-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """
+        Read the next chunk, the characters already consumed are dropped
+
+        :return: (bool) False if the stream is exhausted
+        """
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if isinstance(chunk, bytes):
+            # The chunk can end in the middle of a multibyte character
+            data = chunk
+            chunk = self.utf8.decode(data, final=not data)
+            while data and not chunk:
+                data = self.stream.read(self.chunk_size)
+                chunk = self.utf8.decode(data, final=not data)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        :return: (str) the next character that is not a whitespace, empty at the end of the stream
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in JSON_WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos : self.pos + 1]
+
+    def expect(self, characters: str) -> str:
+        """
+        Consume the next character that is not a whitespace
+
+        :param characters: (str) the characters allowed
+        :raises ValueError: if the next character is not one of them
+        :return: (str) the character consumed
+        """
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError(f"Wrong Value: expected one of {characters!r} at {self.pos}, got {character!r}")
+        self.pos += 1
+        return character
+
+    def value(self):
+        """
+        Decode the next JSON value, more chunks are read until it is complete
+
+        :raises json.JSONDecodeError: if the stream ends before the value is complete
+        :return: (any) the value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number or a literal can be cut by the end of a chunk, "-0" of "-0.5e-3" is a valid value
+            if (end == len(self.buffer) or self.buffer[end] not in JSON_DELIMITERS) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_array(stream, key: str, chunk_size=1 << 16):
+    """
+    Yield the items of the array `key` of the top-level JSON object of a stream
+
+    :param stream: (file object) the stream, opened in text or binary mode, e.g. a file or `requests.Response.raw`
+    :param key: (str) the key of the array in the top-level object
+    :param chunk_size: (int, optional) number of characters read at a time. Defaults to 65536
+    :raises ValueError: if the document is not an object or `key` is not an array
+    :return: (generator) the items, nothing if the key does not exist
+    """
+    assert isinstance(key, str), "Wrong Type: key must be a string"
+
+    reader = JsonStreamReader(stream, chunk_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        name = reader.value()
+        reader.expect(":")
+        if name != key:
+            # The other members are small (request, terms...), they are decoded and dropped
+            reader.value()
+        else:
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(",]") == "]":
+                        break
+        if reader.expect(",}") == "}":
+            return
@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+"""
+Versioned schema migrations of the SQLite database
+Each migration is applied once, in order, in its own transaction together with its version number.
+To change the schema, append a new function to MIGRATIONS, never edit one that was already released.
+New databases are created with DEFAULT_TABLE and then go through every migration, so a migration
+must leave a table that already has the latest schema unchanged.
+
+python -m data_pipeline.migrations [--db path]
+"""
+from datetime import datetime
+
+from data_pipeline.daily_kpi import create_daily_kpi, rebuild_daily_kpi
+from src.const import SCHEMA_VERSION_TABLE_NAME, SQL_TABLE_NAME
+
+
+class SchemaVersionError(Exception):
+    """
+    The database was migrated by a newer version of the code
+    """
+
+
+def add_report_indexes(conn):
+    """
+    Composite indexes of the report queries
+    The departure index covers the KPI queries: date and airline equality, then status and delays.
+
+    :param conn: (sqlite3.Connection) the connection to migrate
+    """
+    conn.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS IDX_{SQL_TABLE_NAME}_DEPARTURE
+        ON {SQL_TABLE_NAME} (DEPARTURE_DATE, AIRLINE, FLIGHT_STATUS, DEPARTURE_DELAY, ARRIVAL_DELAY)
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS IDX_{SQL_TABLE_NAME}_ARRIVAL
+        ON {SQL_TABLE_NAME} (ARRIVAL_DATE, FLIGHT_STATUS)
+        """
+    )
+
+
+# Flights table of the version 3, the delays are INTEGER and the hours TEXT
+TYPED_FLIGHT_TABLE = """
+(
+"ID_FLIGHT" TEXT NOT NULL,
+"DEPARTURE_DATE" TEXT,
+"ARRIVAL_DATE" TEXT,
+"FLIGHT_NUMBER"	TEXT NOT NULL,
+"FLIGHT_STATUS"	TEXT,
+"DEPARTURE_IATA" TEXT,
+"DEPARTURE_AIRPORT" TEXT,
+"ARRIVAL_IATA" TEXT,
+"ARRIVAL_AIRPORT" TEXT,
+"DEPARTURE_SCHEDULED" TEXT,
+"DEPARTURE_HOUR" TEXT,
+"ARRIVAL_SCHEDULED" TEXT,
+"ARRIVAL_HOUR" TEXT,
+"DEPARTURE_ESTIMATED" TEXT,
+"ARRIVAL_ESTIMATED" TEXT,
+"DEPARTURE_ACTUAL" TEXT,
+"ARRIVAL_ACTUAL" TEXT,
+"DEPARTURE_DELAY" INTEGER NOT NULL DEFAULT 0,
+"ARRIVAL_DELAY" INTEGER NOT NULL DEFAULT 0,
+"AIRLINE" TEXT,
+"ARRIVAL_COUNTRY" TEXT,
+"DEPARTURE_COUNTRY" TEXT,
+PRIMARY KEY("ID_FLIGHT")
+)
+"""
+TYPED_FLIGHT_COLUMNS = [line.split('"')[1] for line in TYPED_FLIGHT_TABLE.splitlines() if line.startswith('"')]
+
+
+def iso_date(column: str) -> str:
+    """
+    SQL expression converting a DD/MM/YYYY date to YYYY-MM-DD, other values are kept
+
+    :param column: (str) the column to convert
+    :return: (str) the SQL expression
+    """
+    return f"CASE WHEN {column} LIKE '__/__/____' THEN substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-' || substr({column}, 1, 2) ELSE {column} END"
+
+
+def integer_minutes(column: str) -> str:
+    """
+    SQL expression converting a delay stored as text or real to whole minutes, blanks are 0
+
+    :param column: (str) the column to convert
+    :return: (str) the SQL expression
+    """
+    return f"CASE WHEN {column} IS NULL OR trim({column}) = '' THEN 0 ELSE CAST(ROUND({column}) AS INTEGER) END"
+
+
+def typed_flights(conn):
+    """
+    Store the delays as INTEGER minutes and the dates as sortable YYYY-MM-DD.
+    SQLite cannot change the type of a column, so the table is rebuilt when its declared types differ.
+
+    :param conn: (sqlite3.Connection) the connection to migrate
+    """
+    declared = {column[1].upper(): column[2].upper() for column in conn.execute(f"PRAGMA table_info({SQL_TABLE_NAME})")}
+    if (declared["DEPARTURE_DELAY"], declared["ARRIVAL_DELAY"], declared["DEPARTURE_HOUR"]) != ("INTEGER", "INTEGER", "TEXT"):
+        columns = ", ".join(TYPED_FLIGHT_COLUMNS)
+        delays = {"DEPARTURE_DELAY": integer_minutes("DEPARTURE_DELAY"), "ARRIVAL_DELAY": integer_minutes("ARRIVAL_DELAY")}
+        conn.execute(f"CREATE TABLE {SQL_TABLE_NAME}_TYPED {TYPED_FLIGHT_TABLE}")
+        conn.execute(
+            f"""
+            INSERT INTO {SQL_TABLE_NAME}_TYPED ({columns})
+            SELECT {", ".join(delays.get(column, column) for column in TYPED_FLIGHT_COLUMNS)}
+            FROM {SQL_TABLE_NAME}
+            """
+        )
+        conn.execute(f"DROP TABLE {SQL_TABLE_NAME}")
+        conn.execute(f"ALTER TABLE {SQL_TABLE_NAME}_TYPED RENAME TO {SQL_TABLE_NAME}")
+        add_report_indexes(conn)
+
+    conn.execute(
+        f"""
+        UPDATE {SQL_TABLE_NAME}
+        SET DEPARTURE_DATE = {iso_date("DEPARTURE_DATE")}, ARRIVAL_DATE = {iso_date("ARRIVAL_DATE")}
+        WHERE (DEPARTURE_DATE LIKE '__/__/____') OR (ARRIVAL_DATE LIKE '__/__/____')
+        """
+    )
+    rebuild_daily_kpi(conn)
+
+
+def add_fingerprint(conn):
+    """
+    Fingerprint of the API record of each flight, the ingest skips the flights that did not change
+
+    :param conn: (sqlite3.Connection) the connection to migrate
+    """
+    columns = {column[1].upper() for column in conn.execute(f"PRAGMA table_info({SQL_TABLE_NAME})")}
+    if "FINGERPRINT" not in columns:
+        conn.execute(f'ALTER TABLE {SQL_TABLE_NAME} ADD COLUMN "FINGERPRINT" TEXT')
+
+
+# (version, description, function applying the migration on a connection)
+MIGRATIONS = [
+    (1, "indexes of the report queries", add_report_indexes),
+    (2, "daily KPI rollup", create_daily_kpi),
+    (3, "INTEGER delays and YYYY-MM-DD dates", typed_flights),
+    (4, "fingerprint of the API records", add_fingerprint),
+]
+
+
+def schema_version(sql_table):
+    """
+    Get the version of the database schema
+
+    :param sql_table: (SqlManager) the manager of the database
+    :return: (int) the last applied version, 0 if no migration was applied
+    """
+    sql_table.conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE_NAME} (
+            "VERSION" INTEGER NOT NULL,
+            "DESCRIPTION" TEXT,
+            "APPLIED_AT" TEXT,
+            PRIMARY KEY("VERSION")
+        )
+        """
+    )
+    return sql_table.conn.execute(f"SELECT COALESCE(MAX(VERSION), 0) FROM {SCHEMA_VERSION_TABLE_NAME}").fetchone()[0]
+
+
+def migrate(sql_table, migrations=None):
+    """
+    Apply the pending migrations, in order.
+    The version is read again inside each write transaction, so concurrent jobs apply a migration only once.
+
+    :param sql_table: (SqlManager) the manager of the database
+    :param migrations: (list(tuple), optional) the migrations to apply. Default is None, which uses MIGRATIONS
+    :raises SchemaVersionError: if the database is more recent than the migrations
+    :return: (list(int)) the versions applied
+    """
+    if migrations is None:
+        migrations = MIGRATIONS
+    latest = migrations[-1][0] if migrations else 0
+    current = schema_version(sql_table)
+    if current > latest:
+        raise SchemaVersionError(f"database schema version {current} is more recent than the code version {latest}")
+
+    applied = []
+    for version, description, apply_migration in migrations:
+        if version <= current:
+            continue
+        with sql_table.transaction(immediate=True):
+            if schema_version(sql_table) >= version:
+                continue
+            apply_migration(sql_table.conn)
+            sql_table.conn.execute(
+                f"INSERT INTO {SCHEMA_VERSION_TABLE_NAME} (VERSION, DESCRIPTION, APPLIED_AT) VALUES (?, ?, ?)",
+                (version, description, datetime.now().isoformat(timespec="seconds")),
+            )
+        applied.append(version)
+    return applied
+
+
+def main():  # pragma: no cover
+    """
+    Main function, migrate a database in place
+    """
+    from argparse import ArgumentParser
+
+    from data_pipeline.sql_functions import SqlManager
+
+    parser = ArgumentParser("Migrate the database to the latest schema")
+    parser.add_argument("--db", default=None, help="path of the database, default is file_name of the .env file")
+    args = parser.parse_args()
+
+    # SqlManager applies the pending migrations when it opens the database
+    with SqlManager(args.db) as sql_table:
+        print(f"{sql_table.path_sql_db} is at schema version {schema_version(sql_table)}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
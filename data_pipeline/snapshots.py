@@ -0,0 +1,307 @@
+#!/usr/bin/python3
+"""
+Append-only archive of the raw AirLabs payloads
+Every fetch is appended to the archive of its airport, type of flight and month as one compact JSON
+document compressed in its own gzip member, so a record is read without decompressing the others.
+A fixed-width index of (timestamp, offset, length) next to the archive gives the random access.
+
+json_data/snapshots/<YYYY_MM>/<AIRPORT>_<type>.json.gz
+json_data/snapshots/<YYYY_MM>/<AIRPORT>_<type>.json.gz.idx
+
+The json files of the previous layout, one per day overwritten by each fetch, are imported once with
+python -m data_pipeline.snapshots import-legacy [--legacy-dir json_data] [--dir json_data/snapshots]
+"""
+import gzip
+import io
+import json
+import os
+import re
+import struct
+import time
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from typing import NamedTuple
+
+from src.const import AIRPORTS_IATA, TYPE_FLIGHTS
+from src.utils import PYTZ_TN
+
+LEGACY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "json_data")
+SNAPSHOT_DIR = os.path.join(LEGACY_DIR, "snapshots")
+# Json files of the previous layout: <LEGACY_DIR>/<type>s/<MM>/<dd_mm_yyyy>_[<AIRPORT>_]<type>_flights.json,
+# the files without an airport are the ones of Tunis-Carthage, the only airport fetched then
+LEGACY_FILE = re.compile(r"^(?P<day>\d{2}_\d{2}_\d{4})_(?:(?P<airport>[A-Z]{3})_)?(?P<type>arrival|departure)_flights\.json$")
+LEGACY_AIRPORT_IATA = AIRPORTS_IATA[0]
+INDEX_ENTRY = struct.Struct("<dQI")
+COMPRESS_LEVEL = 6
+
+
+class Snapshot(NamedTuple):
+    """
+    Index entry of a payload in an archive
+    """
+
+    timestamp: float
+    offset: int
+    length: int
+
+
+class LegacyFile(NamedTuple):
+    """
+    A json file of the previous layout, the last payload fetched during a day
+    """
+
+    day: date
+    airport_iata: str
+    type_flight: str
+    path: str
+
+
+def legacy_files(legacy_dir=LEGACY_DIR):
+    """
+    Find the json files of the previous layout
+
+    :param legacy_dir: (str, optional) the directory holding the arrivals and departures directories. Default is LEGACY_DIR.
+    :return: (generator(LegacyFile)) the files, by type of flight, month and name
+    """
+    for type_flight in TYPE_FLIGHTS:
+        type_dir = os.path.join(legacy_dir, f"{type_flight.lower()}s")
+        if not os.path.isdir(type_dir):
+            continue
+        for month in sorted(os.listdir(type_dir)):
+            month_dir = os.path.join(type_dir, month)
+            if not os.path.isdir(month_dir):
+                continue
+            for name in sorted(os.listdir(month_dir)):
+                match = LEGACY_FILE.match(name)
+                if match is None or match["type"] != type_flight.lower():
+                    continue
+                day = datetime.strptime(match["day"], "%d_%m_%Y").date()
+                yield LegacyFile(day, match["airport"] or LEGACY_AIRPORT_IATA, type_flight, os.path.join(month_dir, name))
+
+
+class SnapshotArchive:
+    """
+    One archive file and its index
+
+    :param path: (str) path of the archive, the index is the same path with an .idx suffix
+    """
+
+    def __init__(self, path: str):
+        assert isinstance(path, str), "Wrong Type: path must be a string"
+        self.path = path
+        self.path_index = f"{path}.idx"
+
+    def index(self) -> list:
+        """
+        Read the index, a torn last entry is ignored
+
+        :return: (list(Snapshot)) the snapshots in the order they were appended
+        """
+        try:
+            with open(self.path_index, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return []
+        size = len(data) - len(data) % INDEX_ENTRY.size
+        return [Snapshot(*entry) for entry in INDEX_ENTRY.iter_unpack(data[:size])]
+
+    def append(self, payload: dict, timestamp=None) -> Snapshot:
+        """
+        Append a payload, the data is written and flushed before its index entry
+
+        :param payload: (dict) the JSON payload
+        :param timestamp: (float, optional) epoch of the fetch. Default is None, which uses the current time.
+        :return: (Snapshot) the index entry of the payload
+        """
+        assert isinstance(payload, dict), "Wrong Type: payload must be a dictionary"
+        if timestamp is None:
+            timestamp = time.time()
+
+        index = self.index()
+        end = index[-1].offset + index[-1].length if index else 0
+        record = gzip.compress(json.dumps(payload, separators=(",", ":")).encode("UTF-8"), COMPRESS_LEVEL, mtime=0)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as file:
+            # Drop the tail of a write interrupted before its index entry
+            if file.tell() != end:
+                file.truncate(end)
+                file.seek(end)
+            file.write(record)
+            file.flush()
+            os.fsync(file.fileno())
+        snapshot = Snapshot(timestamp, end, len(record))
+        with open(self.path_index, "ab") as file:
+            file.truncate(len(index) * INDEX_ENTRY.size)
+            file.write(INDEX_ENTRY.pack(*snapshot))
+        return snapshot
+
+    def at(self, timestamp: float):
+        """
+        Snapshot in force at a time: the last one fetched at or before it
+
+        :param timestamp: (float) the epoch
+        :return: (Snapshot) the snapshot, None if there is none before the timestamp
+        """
+        index = sorted(self.index())
+        position = bisect_right([snapshot.timestamp for snapshot in index], timestamp)
+        return index[position - 1] if position else None
+
+    def open(self, snapshot: Snapshot):
+        """
+        Open the payload of a snapshot as a binary stream, it is decompressed as it is read
+
+        :param snapshot: (Snapshot) the index entry
+        :return: (gzip.GzipFile) the JSON document
+        """
+        with open(self.path, "rb") as file:
+            file.seek(snapshot.offset)
+            record = file.read(snapshot.length)
+        return gzip.GzipFile(fileobj=io.BytesIO(record), mode="rb")
+
+    def read(self, snapshot: Snapshot) -> dict:
+        """
+        :param snapshot: (Snapshot) the index entry
+        :return: (dict) the payload
+        """
+        with self.open(snapshot) as stream:
+            return json.load(stream)
+
+    def replay(self, start=None, end=None):
+        """
+        Read the payloads in the order of their timestamps
+
+        :param start: (float, optional) first epoch included. Default is None, from the first snapshot.
+        :param end: (float, optional) last epoch excluded. Default is None, up to the last snapshot.
+        :return: (generator(tuple(float, dict))) the timestamp and the payload of each snapshot
+        """
+        for snapshot in sorted(self.index()):
+            if (start is None or snapshot.timestamp >= start) and (end is None or snapshot.timestamp < end):
+                yield snapshot.timestamp, self.read(snapshot)
+
+
+class SnapshotStore:
+    """
+    Snapshots of every airport and type of flight, with one archive per month
+
+    :param directory: (str, optional) root directory of the archives. Default is SNAPSHOT_DIR.
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR):
+        self.directory = directory
+        self.tz = PYTZ_TN
+
+    def archive(self, airport_iata: str, type_flight: str, day) -> SnapshotArchive:
+        """
+        :param airport_iata: (str) the IATA code of the airport
+        :param type_flight: (str) "DEPARTURE" or "ARRIVAL"
+        :param day: (datetime) a time of the month of the archive
+        :return: (SnapshotArchive) the archive
+        """
+        assert type_flight in TYPE_FLIGHTS, "Wrong Value: type_flight must be either 'DEPARTURE' or 'ARRIVAL'"
+        month = day.astimezone(self.tz).strftime("%Y_%m")
+        return SnapshotArchive(os.path.join(self.directory, month, f"{airport_iata}_{type_flight.lower()}.json.gz"))
+
+    def append(self, airport_iata: str, type_flight: str, payload: dict, timestamp=None) -> Snapshot:
+        """
+        Archive a payload of the API
+
+        :param airport_iata: (str) the IATA code of the airport
+        :param type_flight: (str) "DEPARTURE" or "ARRIVAL"
+        :param payload: (dict) the JSON payload
+        :param timestamp: (float, optional) epoch of the fetch. Default is None, which uses the current time.
+        :return: (Snapshot) the index entry of the payload
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        archive = self.archive(airport_iata, type_flight, datetime.fromtimestamp(timestamp, self.tz))
+        return archive.append(payload, timestamp)
+
+    def day_bounds(self, day):
+        """
+        :param day: (datetime or date) a time of the day, or the day
+        :return: (tuple(datetime, datetime)) the midnight starting the day and the next one, in the Tunisian time
+        """
+        if isinstance(day, datetime):
+            day = day.astimezone(self.tz).date()
+        start = self.tz.localize(datetime.combine(day, datetime.min.time()))
+        end = self.tz.localize(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+        return start, end
+
+    def latest(self, airport_iata: str, type_flight: str, day: datetime):
+        """
+        Open the last payload fetched during a day, in the Tunisian time
+
+        :param airport_iata: (str) the IATA code of the airport
+        :param type_flight: (str) "DEPARTURE" or "ARRIVAL"
+        :param day: (datetime) a time of the day
+        :return: (gzip.GzipFile) the JSON document, None if nothing was fetched that day
+        """
+        start, end = self.day_bounds(day)
+        archive = self.archive(airport_iata, type_flight, start)
+        snapshot = archive.at(end.timestamp() - 1e-6)
+        if snapshot is None or snapshot.timestamp < start.timestamp():
+            return None
+        return archive.open(snapshot)
+
+    def replay(self, airport_iata: str, type_flight: str, start: datetime, end: datetime):
+        """
+        Read the payloads of an airport and type of flight fetched in a period, across the monthly archives
+
+        :param airport_iata: (str) the IATA code of the airport
+        :param type_flight: (str) "DEPARTURE" or "ARRIVAL"
+        :param start: (datetime) first time included
+        :param end: (datetime) last time excluded
+        :return: (generator(tuple(float, dict))) the timestamp and the payload of each snapshot
+        """
+        year, month = start.astimezone(self.tz).year, start.astimezone(self.tz).month
+        while self.tz.localize(datetime(year, month, 1)) < end:
+            archive = self.archive(airport_iata, type_flight, self.tz.localize(datetime(year, month, 1)))
+            yield from archive.replay(start.timestamp(), end.timestamp())
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    def import_legacy(self, legacy_dir=LEGACY_DIR) -> int:
+        """
+        Append the json files of the previous layout to the archives, once.
+        A file is dated by its last modification, the time of the last fetch of its day, kept within the day.
+        The files already imported, with a snapshot at the same time, and the empty or invalid ones are skipped.
+
+        :param legacy_dir: (str, optional) the directory holding the arrivals and departures directories. Default is LEGACY_DIR.
+        :return: (int) the number of files imported
+        """
+        imported = 0
+        for legacy_file in legacy_files(legacy_dir):
+            start, end = self.day_bounds(legacy_file.day)
+            timestamp = min(max(os.path.getmtime(legacy_file.path), start.timestamp()), end.timestamp() - 1)
+            archive = self.archive(legacy_file.airport_iata, legacy_file.type_flight, start)
+            if any(snapshot.timestamp == timestamp for snapshot in archive.index()):
+                continue
+            try:
+                with open(legacy_file.path, "r", encoding="UTF-8") as file:
+                    payload = json.load(file)
+            except ValueError:
+                payload = None
+            if not isinstance(payload, dict):
+                print(f"Skipped {legacy_file.path}: not a JSON payload")
+                continue
+            archive.append(payload, timestamp)
+            imported += 1
+        return imported
+
+
+def main():  # pragma: no cover
+    """
+    Main function
+    """
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser("Snapshots of the API payloads")
+    parser.add_argument("command", choices=["import-legacy"])
+    parser.add_argument("--legacy-dir", default=LEGACY_DIR, help="directory of the arrivals and departures json files")
+    parser.add_argument("--dir", default=SNAPSHOT_DIR, help="directory of the snapshots")
+    args = parser.parse_args()
+    imported = SnapshotStore(args.dir).import_legacy(args.legacy_dir)
+    print(f"{imported} json files imported into {args.dir}")
+
+
+if __name__ == "__main__":
+    main()
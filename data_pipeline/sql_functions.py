@@ -2,28 +2,139 @@
 """
 Module to manage the SQL queries
 """
-import ftplib
+import os
 import sqlite3
-import time
-
-from src.const import DEFAULT_TABLE, FLIGHT_TABLE_COLUMNS, SQL_TABLE_NAME
-from src.utils import FileFolderManager, TimeAttribute, correct_datetime_info, get_env
+from contextlib import contextmanager
+
+from data_pipeline.daily_kpi import refresh_daily_kpi
+from data_pipeline.ftp_sync import sync_ftp_file
+from data_pipeline.migrations import migrate
+from src.const import DEFAULT_TABLE, FLIGHT_TABLE_COLUMNS, SQL_PARAMETERS_PER_QUERY, SQL_TABLE_NAME
+from src.settings import get_settings
+from src.tracing import span
+from src.utils import FileFolderManager, TimeAttribute, correct_datetime_info_batch
+
+# Columns read by clean_sql_table to recompute the time information of a flight
+CLEAN_COLUMNS = (
+    "ID_FLIGHT",
+    "FLIGHT_STATUS",
+    "DEPARTURE_ACTUAL",
+    "DEPARTURE_ESTIMATED",
+    "DEPARTURE_SCHEDULED",
+    "DEPARTURE_DELAY",
+    "ARRIVAL_ACTUAL",
+    "ARRIVAL_ESTIMATED",
+    "ARRIVAL_SCHEDULED",
+    "ARRIVAL_DELAY",
+)
+
+# Insert a flight or update every column of the existing row with the same ID_FLIGHT, then its FINGERPRINT
+UPSERT_FLIGHT = f"""
+    INSERT INTO {SQL_TABLE_NAME} ({", ".join(FLIGHT_TABLE_COLUMNS)}, FINGERPRINT)
+    VALUES ({", ".join("?" * (len(FLIGHT_TABLE_COLUMNS) + 1))})
+    ON CONFLICT(ID_FLIGHT) DO UPDATE SET
+    {", ".join(f"{col} = excluded.{col}" for col in FLIGHT_TABLE_COLUMNS[1:] + ("FINGERPRINT",))}
+    """
 
 
 class SqlManager:
     """
     SQL Manager class
+    The manager owns one long-lived connection, opened on first use in WAL mode.
+    Use it as a context manager so the connection is closed once the job is done:
+
+        with SqlManager() as sql_table:
+            with sql_table.transaction():
+                ...
+
+    :param path_sql_db: (str, optional) path of the SQLite database. Default is None, which uses `file_name` from the settings.
+    :param settings: (Settings, optional) the settings. Default is None, which uses get_settings() when a setting is needed.
     """
 
-    def __init__(self):
-        self.filename = get_env("file_name")
-        self.path_sql_db = FileFolderManager(directory="data_pipeline/", name_file=self.filename).file_dir
+    # Number of sqlite connections opened by all the managers of the process
+    connection_count = 0
+
+    def __init__(self, path_sql_db=None, settings=None):
+        self._settings = settings
+        if path_sql_db is None:
+            self.filename = self.settings.require("file_name").file_name
+            self.path_sql_db = FileFolderManager(directory="data_pipeline/", name_file=self.filename).file_dir
+        else:
+            self.filename = os.path.basename(path_sql_db)
+            self.path_sql_db = path_sql_db
+        self._conn = None
+        self._transaction_depth = 0
         self.execution = self.execute_sql(
             f"""
             CREATE TABLE  if not exists {SQL_TABLE_NAME}
             {DEFAULT_TABLE}
             """
         )
+        migrate(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def settings(self):
+        """
+        :return: (Settings) the settings of the manager, the ones of the process if none were given
+        """
+        if self._settings is None:
+            self._settings = get_settings()
+        return self._settings
+
+    @property
+    def conn(self):
+        """
+        The connection of the manager, opened on first access.
+        The connection is in autocommit mode: statements outside of `transaction()` are committed right away.
+
+        :return: (sqlite3.Connection) the opened connection
+        """
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path_sql_db, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            SqlManager.connection_count += 1
+        return self._conn
+
+    def close(self):
+        """
+        Close the connection if it is opened. It will be reopened by the next query.
+
+        :return: None
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self._transaction_depth = 0
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """
+        Context manager grouping all the queries of the block in one transaction.
+        Nested blocks join the outer transaction, only the outermost block commits or rolls back.
+
+        :param immediate: (bool, optional) take the write lock when the transaction begins. Default is False.
+        :return: (sqlite3.Connection) the connection used by the transaction
+        """
+        if self._transaction_depth == 0:
+            self.conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        self._transaction_depth += 1
+        try:
+            yield self.conn
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.conn.execute("ROLLBACK")
+            raise
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            self.conn.execute("COMMIT")
 
     def execute_sql(self, sql=None, fetchmethod=None):
         """
@@ -34,54 +145,103 @@ class SqlManager:
         :return: (list) The query results.
         """
 
-        conn = sqlite3.connect(self.path_sql_db)
-        cursor = conn.cursor()
-        sql_execute = cursor.execute(sql)
+        sql_execute = self.conn.execute(sql)
         fetch_sql = sql_execute
         if fetchmethod == "fetchone":
             fetch_sql = sql_execute.fetchone()
         elif fetchmethod == "fetchall":
             fetch_sql = sql_execute.fetchall()
-        conn.commit()
-        conn.close()
         return fetch_sql
 
     def insert_in_table(self, values: tuple):
         """
         Insert a new item into the SQL table.
+        The rollup rows of its departure date are recomputed in the same transaction.
 
         :param values: (tuple) A tuple of values to be inserted into the table.
         :return: None
         """
-        self.execute_sql(
-            f"""
-            INSERT INTO {SQL_TABLE_NAME}
-            {str(FLIGHT_TABLE_COLUMNS)} VALUES {values}
-            """
-        )
+        with self.transaction():
+            self.conn.execute(
+                f"""
+                INSERT INTO {SQL_TABLE_NAME}
+                ({", ".join(FLIGHT_TABLE_COLUMNS)}) VALUES ({", ".join("?" * len(FLIGHT_TABLE_COLUMNS))})
+                """,
+                values,
+            )
+            refresh_daily_kpi(self.conn, {values[FLIGHT_TABLE_COLUMNS.index("DEPARTURE_DATE")]})
 
     def update_table(self, key: str, values: tuple):
         """
         Update an item in the SQL table.
         If the item does not exist, it will be inserted instead.
 
-        :param key: (str) The key (ID) of the item to be updated.
+        :param key: (str) The key (ID) of the item to be updated, it must be the first value of values.
         :param values: (tuple) A tuple of values to update the item with.
         :return: None
         """
-        if self.check_key(key):
-            cross_col = ""
-            for index, col in enumerate(FLIGHT_TABLE_COLUMNS):
-                cross_col = cross_col + col + '="' + str(values[index]) + '", '
-            self.execute_sql(
-                f"""
-                UPDATE {SQL_TABLE_NAME}
-                SET {cross_col[:-2]}
-                WHERE ID_FLIGHT="{key}"
-                """
+        assert values[0] == key, "Wrong Value: key must be the ID_FLIGHT of values"
+        self.upsert_flights([values])
+
+    def upsert_flights(self, flights, fingerprints=None):
+        """
+        Insert or update a batch of flights in one transaction.
+        The values are bound as parameters, in the order of FLIGHT_TABLE_COLUMNS.
+        The daily KPI of the previous and new departure dates of the flights are recomputed.
+
+        :param flights: (list(tuple)) the flights to write, the first value of each tuple is the ID_FLIGHT.
+        :param fingerprints: (list(str), optional) the fingerprints of the API records of the flights. Default is None, which resets them.
+        :return: (int) the number of flights written
+        """
+        flights = list(flights)
+        if fingerprints is None:
+            fingerprints = [None] * len(flights)
+        assert len(fingerprints) == len(flights), "Wrong Value: one fingerprint per flight"
+        date_index = FLIGHT_TABLE_COLUMNS.index("DEPARTURE_DATE")
+        with self.transaction():
+            kpi_dates = self.departure_dates([flight[0] for flight in flights])
+            kpi_dates.update(flight[date_index] for flight in flights)
+            self.conn.executemany(UPSERT_FLIGHT, [(*flight, fingerprint) for flight, fingerprint in zip(flights, fingerprints)])
+            refresh_daily_kpi(self.conn, kpi_dates)
+        return len(flights)
+
+    def saved_states(self, keys):
+        """
+        Get the fingerprints saved by the last ingest of some flights, and their status
+
+        :param keys: (list(str)) the keys (ID) of the flights
+        :return: (dict) the (fingerprint, status) by key of the flights found in the table, the fingerprint is None if the row was not written by an ingest
+        """
+        states = {}
+        for index in range(0, len(keys), SQL_PARAMETERS_PER_QUERY):
+            chunk = keys[index : index + SQL_PARAMETERS_PER_QUERY]
+            states.update(
+                (key, (fingerprint, status))
+                for key, fingerprint, status in self.conn.execute(
+                    f"SELECT ID_FLIGHT, FINGERPRINT, FLIGHT_STATUS FROM {SQL_TABLE_NAME} WHERE ID_FLIGHT IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
             )
-        else:
-            self.insert_in_table(values)
+        return states
+
+    def departure_dates(self, keys):
+        """
+        Get the departure dates of some flights
+
+        :param keys: (list(str)) the keys (ID) of the flights
+        :return: (set(str)) the departure dates of the flights found in the table
+        """
+        dates = set()
+        for index in range(0, len(keys), SQL_PARAMETERS_PER_QUERY):
+            chunk = keys[index : index + SQL_PARAMETERS_PER_QUERY]
+            dates.update(
+                row[0]
+                for row in self.conn.execute(
+                    f"SELECT DISTINCT DEPARTURE_DATE FROM {SQL_TABLE_NAME} WHERE ID_FLIGHT IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+            )
+        return dates
 
     def check_key(self, key: str):
         """
@@ -90,14 +250,14 @@ class SqlManager:
         :param key: (str) The key (ID) of the item to check for.
         :return: (bool) True if the key exists in the table, False otherwise.
         """
-        check = self.execute_sql(
+        check = self.conn.execute(
             f"""
             SELECT 1
             FROM {SQL_TABLE_NAME}
-            WHERE (ID_FLIGHT = "{key}")
+            WHERE (ID_FLIGHT = ?)
             """,
-            "fetchone",
-        )
+            (key,),
+        ).fetchone()
 
         return check is not None
 
@@ -119,108 +279,162 @@ class SqlManager:
 
         return [key[0] for key in fetch_all]
 
-    def modify_column(self, col_name_input: str, col_name_output: str, func):
+    def register_function(self, name: str, func, nb_args=1):
+        """
+        Register a Python function so it can be called from the SQL queries of the manager.
+
+        :param name: (str) The name of the function in SQL.
+        :param func: (function) The Python function, it must return the same output for the same inputs.
+        :param nb_args: (int, optional) The number of arguments of the function. Default is 1.
+        :return: None
+        """
+        self.conn.create_function(name, nb_args, func, deterministic=True)
+
+    def modify_column(self, col_name_input: str, col_name_output: str, func, condition=""):
         """
         Modify the values of a column by applying a function to the values of another column.
+        The function is registered in SQLite and applied by a single UPDATE in one transaction,
+        the rollup rows of the departure dates of the rows before and after the UPDATE are recomputed in it.
 
         :param col_name_input: (str) The name of the column to extract values from.
         :param col_name_output: (str) The name of the column to modify.
         :param func: (function) A function to apply on the values of col_name_input and output in col_name_output.
-        :return: None
+        :param condition: (str, optional) An optional SQL WHERE clause to filter the rows to modify. Default is an empty string.
+        :return: (int) The number of rows modified.
         """
-        keys = self.id_keys()
-        for key in keys:
-            values = self.execute_sql(
+        self.register_function("MODIFY_COLUMN", func)
+        with self.transaction():
+            kpi_dates = {row[0] for row in self.conn.execute(f"SELECT DISTINCT DEPARTURE_DATE FROM {SQL_TABLE_NAME} {condition}")}
+            modified = self.conn.execute(
                 f"""
-                SELECT {col_name_input}
-                FROM {SQL_TABLE_NAME}
-                WHERE (ID_FLIGHT = "{key}")
-                """,
-                "fetchone",
-            )[0]
-            output = func(values)
-            self.execute_sql(f'UPDATE {SQL_TABLE_NAME} SET {col_name_output}="{output}" WHERE ID_FLIGHT="{key}"')
+                UPDATE {SQL_TABLE_NAME}
+                SET {col_name_output} = MODIFY_COLUMN({col_name_input})
+                {condition}
+                RETURNING DEPARTURE_DATE
+                """
+            ).fetchall()
+            kpi_dates.update(row[0] for row in modified)
+            refresh_daily_kpi(self.conn, kpi_dates)
+        return len(modified)
 
     def clean_sql_table(self, datetime_query):
         """
         Function to clean SQL table and re adjust all the time information
         dep_hour, departure_date, flight_status, departure_delay
         arr_hour, arrival_date, flight_status, arrival_delay
+        The rows of the day are read with one query and written back with one executemany.
 
         :param datetime_query: (str) datetime of query
 
         :returns: None
         """
 
-        time.sleep(1)
-        query_date = TimeAttribute(datetime_query).dateformat
-        keys = self.id_keys(f'WHERE (DEPARTURE_DATE = "{query_date}")')
-        pragma = self.execute_sql(f"PRAGMA table_info({SQL_TABLE_NAME})", "fetchall")
-        cols = [column[1] for column in pragma]
+        query_date = TimeAttribute(datetime_query).isodate
+        with span("clean", date=query_date) as clean_span:
+            self._clean_date(query_date, clean_span)
+        print("cleaning completed")
 
-        def column_index(col_name):
-            """
-            Get the index of a column in a table
+    def _clean_date(self, query_date: str, clean_span):
+        """
+        Recompute the time information of the flights of a departure date, see clean_sql_table
 
-            :param col_name: (str) the name of the column
-            :return: (int) the index of the column in the table
-            """
-            return cols.index(col_name)
-
-        for key in keys:
-            values = list(
-                self.execute_sql(
-                    f"""
-                    SELECT *
-                    FROM {SQL_TABLE_NAME}
-                    WHERE (ID_FLIGHT = "{key}")
-                    """,
-                    "fetchone",
-                )
-            )
-            key = values[column_index("ID_FLIGHT")]
-
-            # datetime_actual, datetime_estimated, datetime_scheduled, flight_status, datetime_delay, text
-            # dep_hour, departure_date, flight_status, departure_delay
-            (values[column_index("DEPARTURE_HOUR")], values[column_index("DEPARTURE_DATE")], values[column_index("FLIGHT_STATUS")], values[column_index("DEPARTURE_DELAY")],) = correct_datetime_info(
-                datetime_actual=values[column_index("DEPARTURE_ACTUAL")],
-                datetime_estimated=values[column_index("DEPARTURE_ESTIMATED")],
-                datetime_scheduled=values[column_index("DEPARTURE_SCHEDULED")],
-                flight_status=values[column_index("FLIGHT_STATUS")],
-                datetime_delay=values[column_index("DEPARTURE_DELAY")],
-                text="active",
-            )
+        :param query_date: (str) the departure date, YYYY-MM-DD
+        :param clean_span: (Span) the span of the cleaning, the number of rows is added to it
+        :return: None
+        """
+        rows = self.conn.execute(
+            f"""
+            SELECT {", ".join(CLEAN_COLUMNS)}
+            FROM {SQL_TABLE_NAME}
+            WHERE (DEPARTURE_DATE = ?)
+            """,
+            (query_date,),
+        ).fetchall()
+
+        clean_span.set(rows=len(rows))
+        if not rows:
+            return
+        (
+            keys,
+            flight_status,
+            departure_actual,
+            departure_estimated,
+            departure_scheduled,
+            departure_delay,
+            arrival_actual,
+            arrival_estimated,
+            arrival_scheduled,
+            arrival_delay,
+        ) = zip(*rows)
+
+        # dep_hour, departure_date, flight_status, departure_delay
+        (dep_hour, departure_date, flight_status, departure_delay,) = correct_datetime_info_batch(
+            datetime_actual=departure_actual,
+            datetime_estimated=departure_estimated,
+            datetime_scheduled=departure_scheduled,
+            flight_status=flight_status,
+            datetime_delay=departure_delay,
+            text="active",
+        )
+        # arr_hour, arrival_date, flight_status, arrival_delay
+        (arr_hour, arrival_date, flight_status, arrival_delay,) = correct_datetime_info_batch(
+            datetime_actual=arrival_actual,
+            datetime_estimated=arrival_estimated,
+            datetime_scheduled=arrival_scheduled,
+            flight_status=flight_status,
+            datetime_delay=arrival_delay,
+            text="landed",
+        )
+        cleaned_rows = zip(
+            dep_hour.tolist(),
+            departure_date.tolist(),
+            flight_status.tolist(),
+            departure_delay.tolist(),
+            arr_hour.tolist(),
+            arrival_date.tolist(),
+            arrival_delay.tolist(),
+            keys,
+        )
 
-            # arr_hour, arrival_date, flight_status, arrival_delay
-            (values[column_index("ARRIVAL_HOUR")], values[column_index("ARRIVAL_DATE")], values[column_index("FLIGHT_STATUS")], values[column_index("ARRIVAL_DELAY")],) = correct_datetime_info(
-                datetime_actual=values[column_index("ARRIVAL_ACTUAL")],
-                datetime_estimated=values[column_index("ARRIVAL_ESTIMATED")],
-                datetime_scheduled=values[column_index("ARRIVAL_SCHEDULED")],
-                flight_status=values[column_index("FLIGHT_STATUS")],
-                datetime_delay=values[column_index("ARRIVAL_DELAY")],
-                text="landed",
+        with self.transaction():
+            self.conn.executemany(
+                f"""
+                UPDATE {SQL_TABLE_NAME}
+                SET DEPARTURE_HOUR = ?, DEPARTURE_DATE = ?, FLIGHT_STATUS = ?, DEPARTURE_DELAY = ?,
+                    ARRIVAL_HOUR = ?, ARRIVAL_DATE = ?, ARRIVAL_DELAY = ?
+                WHERE ID_FLIGHT = ?
+                """,
+                cleaned_rows,
             )
-            values = tuple(values)
-
-            self.update_table(key, values)
-
-        print("cleaning completed")
-        time.sleep(1)
+            # A flight can leave the queried date once cleaned
+            refresh_daily_kpi(self.conn, {query_date, *departure_date.tolist()})
 
     def import_ftp_sqldb(self):
         """
-        This method connects to the FTP server using the credentials saved in the credentials/ftp.json file.
-        It then changes the working directory to the specified path, retrieves the SQLite database file with the specified filename, and writes it to the specified path on the local machine.
+        This method connects to the FTP server using the credentials saved in the .env file.
+        It then changes the working directory to the specified path and syncs the SQLite database file with the specified filename to the local machine.
+        The file is downloaded only if it changed, see data_pipeline.ftp_sync.
 
         :param: None
 
-        :returns: None
+        :returns: (bool) True if the database was replaced, False if it was already up to date
         """
-        path = get_env("path")
-        ftp = ftplib.FTP(get_env("ip_adress"))
-        ftp.login(get_env("login"), get_env("password"))
-        ftp.cwd(path)
-        ftp.retrbinary(f"RETR {self.filename}", open(self.path_sql_db, "wb").write)
-        ftp.quit()
-
-        print("FTP DB imported")
+        # ftplib pulls ssl, only this method needs it
+        import ftplib
+
+        # Checkpoint and release the WAL of the current database before replacing it
+        self.close()
+        settings = self.settings.require("path", "ip_adress", "login", "password")
+        ftp = ftplib.FTP(settings.ip_adress)
+        try:
+            ftp.login(settings.login, settings.password)
+            ftp.cwd(settings.path)
+            imported = sync_ftp_file(ftp, self.filename, self.path_sql_db)
+        finally:
+            ftp.close()
+        # The imported database may come from an older version of the code
+        migrate(self)
+
+        if imported:
+            print("FTP DB imported")
+        return imported
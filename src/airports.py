@@ -2,10 +2,12 @@
 Module to generate and handle the Airports Metadata
 """
 #!/usr/bin/python3
-import json
+import mmap
 import os
-from argparse import ArgumentParser
+import struct
+from bisect import bisect_left
 from collections import namedtuple
+from functools import lru_cache
 from string import ascii_uppercase
 
 ASCII_UPPERCASE = set(ascii_uppercase)
@@ -46,16 +48,21 @@ Other = namedtuple(
 # Note: Rules for daylight savings time change from year to year and from country to country. The current data is an
 # approximation for 2009, built on a country level. Most airports in DST-less regions in countries that generally
 # observe DST (eg. AL, HI in the USA, NT, QL in Australia, parts of Canada) are marked incorrectly.
-airport_list = os.path.join(
-    os.path.abspath(os.curdir), "data_pipeline/json_data/airport_list.json"
-)
-other_list = os.path.join(
-    os.path.abspath(os.curdir), "data_pipeline/json_data/other_list.json"
-)
-with open(airport_list, "r", encoding="UTF-8") as f:
-    AIRPORT_LIST = json.load(f)
-with open(other_list, "r", encoding="UTF-8") as f:
-    OTHER_LIST = json.load(f)
+# The JSON sources are compiled into a sorted binary store, memory-mapped on the first lookup
+JSON_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data_pipeline", "json_data")
+AIRPORT_LIST_PATH = os.path.join(JSON_DATA_DIR, "airport_list.json")
+OTHER_LIST_PATH = os.path.join(JSON_DATA_DIR, "other_list.json")
+AIRPORT_STORE_PATH = os.path.join(JSON_DATA_DIR, "airports.bin")
+
+# Store layout, little endian:
+#   header  magic, number of airports, number of others
+#   index   one (IATA, offset, length) entry per airport sorted by IATA, then one per other
+#   records the fields of each row separated by FIELD_SEPARATOR, None is NULL_FIELD
+STORE_MAGIC = b"AIRPORT1"
+STORE_HEADER = struct.Struct("<8sII")
+STORE_ENTRY = struct.Struct("<3sII")
+FIELD_SEPARATOR = "\x1f"
+NULL_FIELD = "\x00"
 
 
 class AirportNotFoundException(Exception):
@@ -64,16 +71,142 @@ class AirportNotFoundException(Exception):
     """
 
 
+def build_airport_store(path_store=AIRPORT_STORE_PATH, airport_list=AIRPORT_LIST_PATH, other_list=OTHER_LIST_PATH):
+    """
+    Compile the JSON airport lists into the binary store read by Airports
+
+    :param path_store: (str, optional) path of the store to write. Defaults to AIRPORT_STORE_PATH
+    :param airport_list: (str, optional) path of the airport list. Defaults to AIRPORT_LIST_PATH
+    :param other_list: (str, optional) path of the other list. Defaults to OTHER_LIST_PATH
+    :return: (tuple(int)) the number of airports and others in the store
+    """
+    import json
+
+    with open(airport_list, "r", encoding="UTF-8") as file:
+        airports = {row[3].upper(): row for row in json.load(file)}
+    with open(other_list, "r", encoding="UTF-8") as file:
+        others = {row[0].upper(): row for row in json.load(file)}
+
+    index, records, offset, sizes = [], [], 0, []
+    for table in (airports, others):
+        # Only three letters codes can be looked up, see Airports._validate
+        table = sorted((iata.encode("UTF-8"), row) for iata, row in table.items() if len(iata.encode("UTF-8")) == 3)
+        for iata, row in table:
+            fields = [NULL_FIELD if field is None else str(field) for field in row]
+            assert all(FIELD_SEPARATOR not in field for field in fields), f"Wrong Value: {FIELD_SEPARATOR!r} in {row}"
+            record = FIELD_SEPARATOR.join(fields).encode("UTF-8")
+            index.append(STORE_ENTRY.pack(iata, offset, len(record)))
+            records.append(record)
+            offset += len(record)
+        sizes.append(len(table))
+
+    path_tmp = f"{path_store}.tmp"
+    with open(path_tmp, "wb") as file:
+        file.write(STORE_HEADER.pack(STORE_MAGIC, *sizes))
+        file.writelines(index)
+        file.writelines(records)
+    os.replace(path_tmp, path_store)
+    return tuple(sizes)
+
+
+class AirportTable(object):
+    """
+    Read-only mapping of IATA codes to rows, over one sorted index of the store
+    """
+
+    def __init__(self, buffer, index_start, size, records_start, row_type):
+        self.buffer = buffer
+        self.index_start = index_start
+        self.size = size
+        self.records_start = records_start
+        self.row_type = row_type
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, position):
+        # IATA code of an index entry, so that bisect can search the index in place
+        start = self.index_start + position * STORE_ENTRY.size
+        return self.buffer[start : start + 3]
+
+    def __contains__(self, iata):
+        return self.find(iata) is not None
+
+    def find(self, iata):
+        """
+        Position of an IATA code in the index
+
+        :param iata: (str) the upper case IATA code
+        :return: (int) the position, None if the code is not in the table
+        """
+        key = iata.encode("UTF-8")
+        position = bisect_left(self, key)
+        if position < self.size and self[position] == key:
+            return position
+        return None
+
+    def get(self, iata, default=None):
+        """
+        Row of an IATA code
+
+        :param iata: (str) the upper case IATA code
+        :param default: (any, optional) value returned if the code is not in the table. Defaults to None
+        :return: (Airport or Other) the row
+        """
+        position = self.find(iata)
+        if position is None:
+            return default
+        _, offset, length = STORE_ENTRY.unpack_from(self.buffer, self.index_start + position * STORE_ENTRY.size)
+        start = self.records_start + offset
+        fields = self.buffer[start : start + length].decode("UTF-8").split(FIELD_SEPARATOR)
+        return self.row_type(*(None if field == NULL_FIELD else field for field in fields))
+
+
+@lru_cache(maxsize=None)
+def open_airport_store(path_store=AIRPORT_STORE_PATH):
+    """
+    Memory-map the airport store, it is built from the JSON lists if it does not exist
+
+    :param path_store: (str, optional) path of the store. Defaults to AIRPORT_STORE_PATH
+    :return: (tuple(AirportTable)) the airports and the others tables
+    """
+    if not os.path.exists(path_store):
+        print(f"Building the airport store {path_store}")
+        build_airport_store(path_store)
+    with open(path_store, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, nb_airports, nb_others = STORE_HEADER.unpack_from(buffer)
+    assert magic == STORE_MAGIC, f"Wrong Value: {path_store} is not an airport store"
+
+    index_start = STORE_HEADER.size
+    records_start = index_start + (nb_airports + nb_others) * STORE_ENTRY.size
+    airports = AirportTable(buffer, index_start, nb_airports, records_start, Airport)
+    others = AirportTable(buffer, index_start + nb_airports * STORE_ENTRY.size, nb_others, records_start, Other)
+    return airports, others
+
+
 class Airports(object):
     """
     Main Airport class
+    The tables are read from the airport store on the first lookup
     """
 
-    def __init__(self):
+    def __init__(self, path_store=AIRPORT_STORE_PATH):
+        self.path_store = path_store
 
-        self.airports = {_[3].upper(): Airport(*_) for _ in AIRPORT_LIST}
+    @property
+    def airports(self):
+        """
+        :return: (AirportTable) the airports by IATA code
+        """
+        return open_airport_store(self.path_store)[0]
 
-        self.other = {_[0].upper(): Other(*_) for _ in OTHER_LIST}
+    @property
+    def other(self):
+        """
+        :return: (AirportTable) the other locations by IATA code
+        """
+        return open_airport_store(self.path_store)[1]
 
     @staticmethod
     def _validate(iata):
@@ -138,15 +271,32 @@ class Airports(object):
         return table.get(iata)
 
 
+@lru_cache(maxsize=None)
+def get_airports():
+    """
+    Shared Airports index of the process, the store is mapped on its first lookup
+
+    :return: (Airports) the airport index
+    """
+    return Airports()
+
+
 def main():  # pragma: no cover
     """
     Main function
     """
+    from argparse import ArgumentParser
 
     parser = ArgumentParser("Airport lookup by IATA code")
-    parser.add_argument("iata", action="store")
+    parser.add_argument("iata", action="store", nargs="?")
+    parser.add_argument("--build", action="store_true", help="rebuild the airport store from the JSON lists")
     args = parser.parse_args()
-    airports = Airports()
+    if args.build:
+        nb_airports, nb_others = build_airport_store()
+        print(f"{AIRPORT_STORE_PATH}: {nb_airports} airports, {nb_others} others")
+    if args.iata is None:
+        return
+    airports = get_airports()
     try:
         print(airports.lookup(args.iata))
     except AirportNotFoundException:
@@ -10,12 +10,45 @@ AIRLINE_NAMES = {
     "HV": "TRANSAVIA",
 }
 FLIGHT_STATUS = ["scheduled", "cancelled", "active", "landed"]
+# Statuses that no longer move with the time, the other ones are corrected again at every ingest
+FINAL_FLIGHT_STATUS = ("cancelled", "landed")
 TYPE_FLIGHTS = ["DEPARTURE", "ARRIVAL"]
+# Schedules pulled from AirLabs, for every airport and direction
+AIRLABS_API_URL = "https://airlabs.co/api/v9/schedules"
+AIRPORTS_IATA = ["TUN", "DJE", "MIR", "NBE", "SFA"]
+AIRLINES_IATA = ["TU", "BJ", "AF", "TO"]
+# Maximum number of AirLabs requests in flight at the same time
+API_MAX_CONCURRENCY = 4
+# Retries of a failed AirLabs request, and seconds during which a cached response is used without a request
+API_RETRIES = 5
+API_CACHE_MAX_AGE = 15 * 60
+# Adaptive polling of the ingest daemon: seconds between two fetches, from POLL_INTERVAL_MAX when no flight is
+# in the air or due within POLL_LOOKAHEAD seconds down to POLL_INTERVAL_MIN, halfway at POLL_BUSY_FLIGHTS flights
+POLL_INTERVAL_MIN = API_CACHE_MAX_AGE
+POLL_INTERVAL_MAX = 60 * 60
+POLL_LOOKAHEAD = 2 * 60 * 60
+POLL_BUSY_FLIGHTS = 10
+# JSON lines of the spans of the jobs, next to the database, rotated to TRACE_FILE_NAME.1 beyond TRACE_FILE_MAX_BYTES
+TRACE_FILE_NAME = "traces.jsonl"
+TRACE_FILE_MAX_BYTES = 10 * 1024 * 1024
+# Number of distinct timestamp strings kept parsed, about two months of schedules at minute resolution
+TIMESTAMP_CACHE_SIZE = 1 << 16
+# Milliseconds allowed to import data_pipeline.api_requests, the hourly cron pays them on every run, and the
+# modules it must not import, they are only needed by the report and the Twitter job
+STARTUP_IMPORT_BUDGET_MS = 120
+STARTUP_DEFERRED_MODULES = ("pandas", "numpy", "matplotlib", "PIL", "tweepy", "requests", "ftplib", "dotenv")
+# Number of flights corrected and upserted together by the ingest
+FLIGHT_BATCH_SIZE = 1000
 SQL_OPERATORS = ["MIN", "MAX", "AVG"]
 FONT_SIZE = 20
 
 # SQL Table
 SQL_TABLE_NAME = "TUN_FLIGHTS"
+SCHEMA_VERSION_TABLE_NAME = "SCHEMA_VERSION"
+DAILY_KPI_TABLE_NAME = "DAILY_KPI"
+BACKFILL_TABLE_NAME = "BACKFILL_CHECKPOINT"
+# Maximum number of values bound in one IN (...) clause
+SQL_PARAMETERS_PER_QUERY = 500
 
 FLIGHT_TABLE_COLUMNS = (
     "ID_FLIGHT",
@@ -41,7 +74,19 @@ FLIGHT_TABLE_COLUMNS = (
     "ARRIVAL_COUNTRY",
     "DEPARTURE_COUNTRY",
 )
+# Columns of the flights holding a timestamp, the analysis DataFrames convert them to the time of Tunisia
+FLIGHT_TIMESTAMP_COLUMNS = (
+    "DEPARTURE_SCHEDULED",
+    "ARRIVAL_SCHEDULED",
+    "DEPARTURE_ESTIMATED",
+    "ARRIVAL_ESTIMATED",
+    "DEPARTURE_ACTUAL",
+    "ARRIVAL_ACTUAL",
+)
 
+# The dates are ISO-8601 YYYY-MM-DD, the scheduled, estimated and actual times are the
+# ISO-8601 local times of AirLabs, the delays are whole minutes
+# FINGERPRINT is the hash of the API record of the last ingest, NULL if the row was written otherwise
 DEFAULT_TABLE = """
 (
 "ID_FLIGHT" TEXT NOT NULL,
@@ -54,18 +99,62 @@ DEFAULT_TABLE = """
 "ARRIVAL_IATA" TEXT,
 "ARRIVAL_AIRPORT" TEXT,
 "DEPARTURE_SCHEDULED" TEXT,
-"DEPARTURE_HOUR" INT,
+"DEPARTURE_HOUR" TEXT,
 "ARRIVAL_SCHEDULED" TEXT,
-"ARRIVAL_HOUR" INT,
+"ARRIVAL_HOUR" TEXT,
 "DEPARTURE_ESTIMATED" TEXT,
 "ARRIVAL_ESTIMATED" TEXT,
 "DEPARTURE_ACTUAL" TEXT,
 "ARRIVAL_ACTUAL" TEXT,
-"DEPARTURE_DELAY" INT,
-"ARRIVAL_DELAY" INT,
+"DEPARTURE_DELAY" INTEGER NOT NULL DEFAULT 0,
+"ARRIVAL_DELAY" INTEGER NOT NULL DEFAULT 0,
 "AIRLINE" TEXT,
-"ARRIVAl_COUNTRY" TEXT,
+"ARRIVAL_COUNTRY" TEXT,
 "DEPARTURE_COUNTRY" TEXT,
+"FINGERPRINT" TEXT,
 PRIMARY KEY("ID_FLIGHT")
 )
 """
+
+# Daily KPI rollup, one row per departure date, airline and type of flight
+DAILY_KPI_COLUMNS = (
+    "KPI_DATE",
+    "AIRLINE",
+    "FLIGHT_TYPE",
+    "NB_FLIGHTS",
+    "NB_SCHEDULED",
+    "NB_CANCELLED",
+    "NB_ACTIVE",
+    "NB_LANDED",
+    "NB_DELAYED",
+    "MIN_DELAY",
+    "MAX_DELAY",
+    "AVG_DELAY",
+)
+
+DAILY_KPI_TABLE = """
+(
+"KPI_DATE" TEXT NOT NULL,
+"AIRLINE" TEXT NOT NULL,
+"FLIGHT_TYPE" TEXT NOT NULL,
+"NB_FLIGHTS" INT,
+"NB_SCHEDULED" INT,
+"NB_CANCELLED" INT,
+"NB_ACTIVE" INT,
+"NB_LANDED" INT,
+"NB_DELAYED" INT,
+"MIN_DELAY" INT,
+"MAX_DELAY" INT,
+"AVG_DELAY" REAL,
+PRIMARY KEY("KPI_DATE", "AIRLINE", "FLIGHT_TYPE")
+)
+"""
+
+BACKFILL_TABLE = """
+(
+"UNIT" TEXT NOT NULL PRIMARY KEY,
+"NB_PAYLOADS" INT,
+"NB_FLIGHTS" INT,
+"COMPLETED_AT" TEXT
+)
+"""
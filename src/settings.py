@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+"""
+Settings of the jobs
+The .env file is read once per process, a variable of the environment with the same name overrides the file.
+The managers take a Settings object, so the tests and the jobs can inject their own.
+
+    settings = get_settings().require("token_airlab")
+    settings.token_airlab
+"""
+import os
+from functools import lru_cache
+from typing import NamedTuple
+
+ENV_PATH = os.path.join(os.path.abspath(os.curdir), ".env")
+
+
+class SettingsError(Exception):
+    """
+    A setting needed by a job is missing or empty
+    """
+
+
+class Settings(NamedTuple):
+    """
+    The values of the .env file, see README.md
+    """
+
+    consumer_key: str = ""
+    consumer_secret: str = ""
+    access_token: str = ""
+    access_token_secret: str = ""
+    path: str = ""
+    file_name: str = ""
+    ip_adress: str = ""
+    login: str = ""
+    password: str = ""
+    token_airlab: str = ""
+
+    def require(self, *keys: str) -> "Settings":
+        """
+        Check that settings are set, before they are used
+
+        :param keys: (str) the names of the settings
+        :raises SettingsError: naming every missing or empty setting
+        :return: (Settings) the settings
+        """
+        missing = [key for key in keys if not getattr(self, key).strip()]
+        if missing:
+            raise SettingsError(f"Wrong Value: {', '.join(missing)} must be set in the .env file or in the environment")
+        return self
+
+
+# Values of a new .env file
+ENV_TEMPLATE = {**Settings()._asdict(), "file_name": "tunisair_delay.db", "path": os.path.join(os.path.abspath(os.curdir), "datasets/SQLtable/")}
+
+
+def read_env_file(path_env: str) -> dict:
+    """
+    Read a .env file, a template is written if it does not exist
+
+    :param path_env: (str) the path of the file
+    :return: (dict) the values of the file
+    """
+    from dotenv import dotenv_values, set_key
+
+    if not os.path.exists(path_env):
+        with open(path_env, "w+", encoding="UTF-8"):
+            pass
+        for key, value in ENV_TEMPLATE.items():
+            set_key(path_env, key_to_set=key, value_to_set=value)
+    return dotenv_values(path_env)
+
+
+def load_settings(path_env=None, environ=None) -> Settings:
+    """
+    Build the settings from a .env file and the environment
+
+    :param path_env: (str, optional) the path of the .env file. Default is None, which uses ENV_PATH.
+    :param environ: (dict, optional) the variables overriding the file. Default is None, which uses os.environ.
+    :return: (Settings) the settings
+    """
+    values = read_env_file(ENV_PATH if path_env is None else path_env)
+    environ = os.environ if environ is None else environ
+    return Settings(*[environ.get(key, values.get(key) or "") for key in Settings._fields])
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """
+    Shared settings of the process, loaded on the first call, get_settings.cache_clear() reloads them
+
+    :return: (Settings) the settings
+    """
+    return load_settings()
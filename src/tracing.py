@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+"""
+Lightweight tracing of the stages of the jobs
+A span times a block and carries counts, e.g. the rows written. While a job is traced, each span is written
+as one JSON line and the spans are summarized at the end of the job. Otherwise span() returns a shared
+no-op object, so the stages can stay instrumented at no cost.
+
+    with span("upsert", rows=len(rows)):
+        ...
+"""
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from src.const import TRACE_FILE_MAX_BYTES
+
+
+class Span:
+    """
+    A timed block, use it as a context manager
+
+    :param tracer: (Tracer) the tracer recording the span
+    :param name: (str) the name of the stage
+    :param attributes: (dict) the counts and labels of the span
+    """
+
+    __slots__ = ("tracer", "name", "attributes", "id", "parent", "started_at", "start")
+
+    def __init__(self, tracer, name: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.id = next(tracer.ids)
+        self.parent = None
+
+    def set(self, **attributes):
+        """
+        Add attributes known at the end of the block, e.g. the number of rows read
+        """
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        self.parent = stack[-1] if stack else None
+        stack.append(self.id)
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start
+        self.tracer.stack().pop()
+        self.tracer.record(self, duration, exc_type)
+
+
+class NoSpan:
+    """
+    Span of a disabled tracer, it does nothing
+    """
+
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+
+class Tracer:
+    """
+    Collect the spans of a job, disabled until start() is called
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.job = None
+        self.output = None
+        self.records = []
+        self.ids = itertools.count(1)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def stack(self) -> list:
+        """
+        :return: (list(int)) the ids of the spans opened by the current thread
+        """
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def start(self, job: str, output=None):
+        """
+        Enable the tracer
+
+        :param job: (str) the name of the job, added to every span
+        :param output: (file object, optional) text stream receiving one JSON line per span. Default is None, the spans are only summarized.
+        """
+        self.job = job
+        self.output = output
+        self.records = []
+        self.enabled = True
+
+    def stop(self) -> list:
+        """
+        Disable the tracer
+
+        :return: (list(dict)) the spans recorded since start()
+        """
+        self.enabled = False
+        self.output = None
+        return self.records
+
+    def span(self, name: str, **attributes):
+        """
+        :param name: (str) the name of the stage
+        :param attributes: the counts and labels of the span
+        :return: (Span) the span to enter, a no-op when the tracer is disabled
+        """
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name, attributes)
+
+    def iterate(self, name: str, items):
+        """
+        Time the production of each item of an iterable, e.g. each batch of a generator pipeline
+
+        :param name: (str) the name of the stage
+        :param items: (iterable) the items, their len() is the rows of the spans
+        :return: (iterable) the items
+        """
+        if not self.enabled:
+            return items
+        return self._iterate(name, iter(items))
+
+    def _iterate(self, name: str, items):
+        while True:
+            with self.span(name) as span:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    span.set(rows=0)
+                    return
+                span.set(rows=len(item))
+            yield item
+
+    def record(self, span: Span, duration: float, exc_type=None):
+        """
+        Save a span that ended and write its JSON line
+        """
+        record = {
+            "job": self.job,
+            "span": span.name,
+            "id": span.id,
+            "parent": span.parent,
+            "thread": threading.current_thread().name,
+            "start": round(span.started_at, 6),
+            "duration_ms": round(duration * 1e3, 3),
+            **span.attributes,
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        with self._lock:
+            self.records.append(record)
+            if self.output is not None:
+                self.output.write(json.dumps(record, default=str) + "\n")
+
+    def summary(self) -> dict:
+        """
+        :return: (dict) the number of spans, the total duration in ms and the total rows by stage, in the order of the first span
+        """
+        stages = {}
+        for record in self.records:
+            stage = stages.setdefault(record["span"], {"count": 0, "duration_ms": 0.0, "rows": 0})
+            stage["count"] += 1
+            stage["duration_ms"] += record["duration_ms"]
+            stage["rows"] += record.get("rows", 0)
+        return stages
+
+    def print_summary(self):
+        """
+        Print one line per stage
+        """
+        print(f"Trace summary of {self.job}")
+        for name, stage in self.summary().items():
+            print(f"{name:<12} {stage['count']:>6} spans {stage['duration_ms']:>10.1f} ms {stage['rows']:>8} rows")
+
+
+TRACER = Tracer()
+span = TRACER.span
+iterate = TRACER.iterate
+
+
+def rotate(path: str, max_bytes=None):
+    """
+    Rename a file to `<path>.1` once it reaches a size, the previous `<path>.1` is replaced
+
+    :param path: (str) the path of the file
+    :param max_bytes: (int, optional) the size of the rotation. Default is None, which uses TRACE_FILE_MAX_BYTES.
+    :return: (bool) True if the file was rotated
+    """
+    if max_bytes is None:
+        max_bytes = TRACE_FILE_MAX_BYTES
+    try:
+        if os.path.getsize(path) < max_bytes:
+            return False
+    except FileNotFoundError:
+        return False
+    os.replace(path, f"{path}.1")
+    return True
+
+
+@contextmanager
+def trace_job(job: str, path=None):
+    """
+    Trace a job: a root span around the block, the JSON lines appended to a file and the summary printed at the end.
+    The file is rotated before the job when it reached TRACE_FILE_MAX_BYTES, at most twice that size is kept.
+
+    :param job: (str) the name of the job
+    :param path: (str, optional) the JSON lines file. Default is None, the spans are only summarized.
+    :return: (Tracer) the tracer, its records are kept after the block
+    """
+    if path is not None:
+        rotate(path)
+    output = open(path, "a", encoding="UTF-8") if path is not None else None
+    TRACER.start(job, output)
+    try:
+        with span(job):
+            yield TRACER
+    finally:
+        TRACER.stop()
+        if output is not None:
+            output.close()
+        TRACER.print_summary()
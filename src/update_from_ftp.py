@@ -14,11 +14,11 @@ if __name__ == "__main__":
     TODAY_DATE = date_attr.today
     YESTERDAY_DATE = date_attr.yesterday
 
-    sql_table = SqlManager()
+    with SqlManager() as sql_table:
 
-    sql_table.import_ftp_sqldb()
-    sql_table.clean_sql_table(TODAY_DATE)
-    sql_table.clean_sql_table(YESTERDAY_DATE)
+        sql_table.import_ftp_sqldb()
+        sql_table.clean_sql_table(TODAY_DATE)
+        sql_table.clean_sql_table(YESTERDAY_DATE)
 
-    generate_report(TODAY_DATE)
-    generate_report(YESTERDAY_DATE)
+        generate_report(TODAY_DATE, sql_table)
+        generate_report(YESTERDAY_DATE, sql_table)
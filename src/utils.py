@@ -5,16 +5,26 @@ All Modules utilities
 import json
 import os
 import re
+from collections import namedtuple
 from datetime import datetime, timedelta
+from functools import lru_cache, partial
 from pathlib import Path
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 import pytz
-import tweepy
-from dotenv import load_dotenv, set_key
 
-from src.airports import AirportNotFoundException, Airports
+from src.airports import AirportNotFoundException, get_airports
+from src.const import TIMESTAMP_CACHE_SIZE
+from src.settings import Settings, get_settings
 
 TUNISIA_TZ = "Africa/Tunis"
+# pytz builds its timezones lazily, the one of Tunisia is shared by all the helpers
+PYTZ_TN = pytz.timezone(TUNISIA_TZ)
+# The same timezone with zoneinfo, for the conversions of whole columns, see localize_timestamps
+ZONEINFO_TN = ZoneInfo(TUNISIA_TZ)
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+MICROSECOND = timedelta(microseconds=1)
+AirportInfo = namedtuple("AirportInfo", ["name", "country"])
 
 
 def path_dir(sub_path):
@@ -35,7 +45,7 @@ GLYPH_AIRPORT = path_dir("src/fonts/GlyphyxOneNF.ttf")
 
 def get_env(env_token):
     """
-    Get the environment variable from the .env file
+    Get a setting, the .env file is read once per process, see src.settings
 
     :param env_token: (str) the environment variable to fetch
     :return: (str) the value of the environment variable
@@ -45,38 +55,11 @@ def get_env(env_token):
     """
     assert isinstance(env_token, str), "Wrong Type: env_token must be a string"
     assert env_token.strip() != "", "Wrong Value: env_token must not be empty"
+    assert env_token in Settings._fields, f"Wrong Value: {env_token} do not exist"
 
-    path_env = path_dir(".env")
-    if not Path(path_env).exists():
-        with open(path_env, "w+", encoding="UTF-8"):
-            set_key(
-                path_env,
-                key_to_set="file_name",
-                value_to_set="tunisair_delay.db",
-            )
-            set_key(
-                path_env,
-                key_to_set="path",
-                value_to_set=path_dir("datasets/SQLtable/"),
-            )
-            for key in [
-                "consumer_key",
-                "consumer_secret",
-                "access_token",
-                "access_token_secret",
-                "ip_adress",
-                "login",
-                "password",
-                "token_airlab",
-            ]:
-                set_key(path_env, key_to_set=key, value_to_set="")
-
-    load_dotenv(path_env)
-
-    assert os.getenv(env_token) is not None, f"Wrong Value: {env_token} do not exist"
-    assert os.getenv(env_token).strip() != "", f"Wrong Value: {env_token} must not be empty"
-
-    return os.getenv(env_token)
+    value = getattr(get_settings(), env_token)
+    assert value.strip() != "", f"Wrong Value: {env_token} must not be empty"
+    return value
 
 
 class FileFolderManager:
@@ -106,8 +89,8 @@ class FileFolderManager:
         self.dir = directory
         self.local_dir = path_dir(directory)
 
-        if not Path(self.dir).is_dir():
-            os.mkdir(self.local_dir)
+        if not Path(self.local_dir).is_dir():
+            os.makedirs(self.local_dir, exist_ok=True)
 
         if name_file:
             self.file_dir = os.path.join(self.local_dir, name_file)
@@ -144,40 +127,189 @@ class FileFolderManager:
             json.dump(dict_f, file_json, indent=4)
 
 
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
+def parse_timestamp(time_str: str) -> datetime:
+    """
+    Parse an ISO timestamp and convert it to the time of Tunisia, memoized by the raw string.
+    The timestamps of the API repeat across the flights and the hourly runs, the least recently used are dropped
+    beyond TIMESTAMP_CACHE_SIZE; parse_timestamp.cache_info() gives the hits and misses.
+    Naive strings follow the local timezone of the host, as datetime.astimezone does.
+
+    :param time_str: (str) the timestamp, e.g. "2023-01-10 10:00"
+    :return: (datetime) the aware datetime, shared by the callers, datetimes are immutable
+    """
+    return datetime.fromisoformat(time_str).astimezone(PYTZ_TN)
+
+
+# An ISO timestamp ends with an UTC offset when it is aware, e.g. "2023-01-10 10:00+01:00" or "2023-01-10T09:00Z"
+AWARE_TIMESTAMP = r"[T ]\d{2}(?::?\d{2}){0,2}(?:[.,]\d+)?(?:Z|[+-]\d{2}(?::?\d{2}){0,2}(?:\.\d+)?)$"
+
+
+@lru_cache(maxsize=None)
+def _host_zone(tz_variable):
+    """
+    The timezone of the host as a zoneinfo timezone, the one datetime.astimezone applies to naive datetimes
+
+    :param tz_variable: (str) the TZ variable of the environment, empty when it is not set
+    :return: (ZoneInfo) the timezone, None when it is not a zoneinfo timezone, e.g. a POSIX TZ string or Windows
+    """
+    try:
+        if tz_variable:
+            return ZoneInfo(tz_variable.lstrip(":"))
+        with open("/etc/localtime", "rb") as localtime:
+            return ZoneInfo.from_file(localtime)
+    except (OSError, ValueError, ZoneInfoNotFoundError):
+        return None
+
+
+def _naive_epochs(parsed):
+    """
+    Localize naive datetimes in the timezone of the host, as datetime.astimezone does:
+    a repeated wall time takes its first occurrence, a wall time skipped by a DST change takes the offset after it.
+
+    :param parsed: (pandas.DatetimeIndex) the naive datetimes
+    :return: (numpy.ndarray) the instants in epoch nanoseconds, NaT when unknown
+    """
+    import numpy as np
+
+    zone = _host_zone(os.environ.get("TZ", ""))
+    if zone is None:
+        epochs, redo = parsed.asi8.copy(), parsed.notna()
+        convert = datetime.astimezone
+    else:
+        localized = parsed.tz_localize(zone, ambiguous=np.ones(len(parsed), dtype=bool), nonexistent="NaT")
+        epochs = localized.asi8.copy()
+        # A skipped wall time does not come back from its instant
+        redo = parsed.notna() & (localized.tz_localize(None) != parsed)
+        convert = partial(datetime.replace, tzinfo=zone, fold=1)
+    # The skipped wall times, or all of them when the timezone of the host is not a zoneinfo one, are converted one by one
+    epochs[redo] = [(convert(value) - EPOCH) // MICROSECOND * 1000 for value in parsed[redo].to_pydatetime()]
+    return epochs
+
+
+def localize_timestamps(values):
+    """
+    Vectorized parse_timestamp: convert a whole column of timestamps to the time of Tunisia in one call.
+    Aware timestamps keep their instant, naive ones follow the local timezone of the host, as parse_timestamp does.
+
+    :param values: (array-like) ISO strings, blank or None when unknown, or a NumPy or pandas datetime64 array
+    :return: (pandas.DatetimeIndex) the aware datetimes with ZONEINFO_TN, NaT when unknown
+    """
+    import numpy as np
+    import pandas as pd
+
+    if pd.api.types.is_datetime64_any_dtype(getattr(values, "dtype", None)):
+        parsed = pd.DatetimeIndex(values)
+        if parsed.tz is not None:
+            return parsed.tz_convert(ZONEINFO_TN)
+        return pd.to_datetime(_naive_epochs(parsed), unit="ns", utc=True).tz_convert(ZONEINFO_TN)
+
+    strings = pd.Series(values, dtype="object")
+    known = (strings.notna() & (strings != "")).to_numpy()
+    aware = known & strings.astype(str).str.contains(AWARE_TIMESTAMP).to_numpy()
+    naive = known & ~aware
+    epochs = np.full(len(strings), pd.NaT.value, dtype="int64")
+    epochs[aware] = pd.to_datetime(strings[aware].to_numpy(), utc=True).asi8
+    epochs[naive] = _naive_epochs(pd.to_datetime(strings[naive].to_numpy()))
+    return pd.to_datetime(epochs, unit="ns", utc=True).tz_convert(ZONEINFO_TN)
+
+
+class _TimeFormat:
+    """
+    Formatted field of TimeAttribute, computed on first access and kept in a slot of the instance
+
+    :param fmt: (str) the strftime format
+    """
+
+    __slots__ = ("fmt", "slot")
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self.slot = None
+
+    def __set_name__(self, owner, name):
+        self.slot = f"_{name}"
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        try:
+            return getattr(instance, self.slot)
+        except AttributeError:
+            value = instance.datetime.strftime(self.fmt)
+            setattr(instance, self.slot, value)
+            return value
+
+
 class TimeAttribute:
     """
     class for manipulating and extracting date and time information,
     with the appropriate timezone.
+    The formatted fields, today and yesterday are computed on first access.
 
     :param time_str: (str, optional) the time in string format, defaults to None.
+    :param clock: (callable, optional) returns the current datetime for today and yesterday, defaults to None which uses datetime.now.
     """
 
-    def __init__(self, time_str=None):
+    __slots__ = (
+        "datetime",
+        "_clock",
+        "_today",
+        "_dateformat",
+        "_isodate",
+        "_full_hour",
+        "_full_day",
+        "_hour",
+        "_month",
+        "_full_under_score",
+        "_short_under_score",
+    )
+
+    pytz_tn = PYTZ_TN
+
+    dateformat = _TimeFormat("%d/%m/%Y")
+    isodate = _TimeFormat("%Y-%m-%d")
+    full_hour = _TimeFormat("%H:%M")
+    full_day = _TimeFormat("%a %d %b %Y")
+    hour = _TimeFormat("%H")
+    month = _TimeFormat("%m")
+    full_under_score = _TimeFormat("%d_%m_%Y_%H_%M")
+    short_under_score = _TimeFormat("%d_%m_%Y")
+
+    def __init__(self, time_str=None, clock=None):
         """
         Initialize the class and set the timezone.
 
         :param time_str: (str, optional) the time in string format, defaults to None.
+        :param clock: (callable, optional) returns the current datetime, defaults to None which uses datetime.now.
         """
 
-        self.pytz_tn = pytz.timezone(TUNISIA_TZ)
-
-        self.today = datetime.now().astimezone(self.pytz_tn)
-
-        self.yesterday = (datetime.now() - timedelta(days=1)).astimezone(self.pytz_tn)
+        self._clock = clock
 
         if time_str:
             assert isinstance(time_str, (str, datetime)), "Wrong Type: time_str must be a string or datetime"
             if isinstance(time_str, str):
-                self.datetime = datetime.fromisoformat(time_str).astimezone(self.pytz_tn)
+                self.datetime = parse_timestamp(time_str)
             else:
-                self.datetime = time_str.astimezone(self.pytz_tn)
-            self.dateformat = self.datetime.strftime("%d/%m/%Y")
-            self.full_hour = self.datetime.strftime("%H:%M")
-            self.full_day = self.datetime.strftime("%a %d %b %Y")
-            self.hour = self.datetime.strftime("%H")
-            self.month = self.datetime.strftime("%m")
-            self.full_under_score = self.datetime.strftime("%d_%m_%Y_%H_%M")
-            self.short_under_score = self.datetime.strftime("%d_%m_%Y")
+                self.datetime = time_str.astimezone(PYTZ_TN)
+
+    @property
+    def today(self) -> datetime:
+        """
+        :return: (datetime) the current datetime in Tunisia, read once from the clock
+        """
+        try:
+            return self._today
+        except AttributeError:
+            self._today = (self._clock or datetime.now)().astimezone(PYTZ_TN)
+            return self._today
+
+    @property
+    def yesterday(self) -> datetime:
+        """
+        :return: (datetime) the same time the day before today, in Tunisia
+        """
+        return PYTZ_TN.normalize(self.today - timedelta(days=1))
 
     def get_mins_between(self, end_date):
         """
@@ -240,6 +372,33 @@ def remove_non_alphanumeric(str_to_change):
     return re.sub("[^A-Za-z0-9 ]", "", str_to_change)
 
 
+@lru_cache(maxsize=None)
+def _airport_info(airport_iata: str) -> tuple:
+    """
+    Memoized lookup of airport_info, airport_iata is already stripped and upper case
+    """
+    try:
+        airport = get_airports().lookup(airport_iata)
+    except AirportNotFoundException:
+        return AirportInfo("UNKNOWN", "UNKNOWN")
+    return AirportInfo(remove_non_alphanumeric(airport.name.upper()), remove_non_alphanumeric(airport.country.upper()))
+
+
+def airport_info(airport_iata: str) -> tuple:
+    """
+    Data enrichment, name and country of an airport in one lookup
+    The airport index is shared by the process and the cleaned result is memoized per IATA code.
+    Code from https://github.com/NICTA/pyairports
+    I will handle errors if TUNISAIR made some unknown connections
+
+    :param airport_iata: (str), AIRPORT iata code
+    :returns: (AirportInfo), the cleaned airport name and country, UNKNOWN if the airport is not found
+    """
+    assert isinstance(airport_iata, str), "Wrong Type: airport_iata must be a string"
+
+    return _airport_info(airport_iata.strip().upper())
+
+
 def get_airport_country(airport_iata: str) -> str:
     """
     Adding Airlines
@@ -255,10 +414,7 @@ def get_airport_country(airport_iata: str) -> str:
 
     assert isinstance(airport_iata, str), "Wrong Type: airport_iata must be a string"
 
-    try:
-        return remove_non_alphanumeric(Airports().lookup(airport_iata).country.upper())
-    except AirportNotFoundException:
-        return "UNKNOWN"
+    return airport_info(airport_iata).country
 
 
 def get_airport_name(airport_iata: str) -> str:
@@ -275,10 +431,7 @@ def get_airport_name(airport_iata: str) -> str:
     """
     assert isinstance(airport_iata, str), "Wrong Type: airport_iata must be a string"
 
-    try:
-        return remove_non_alphanumeric(Airports().lookup(airport_iata).name.upper())
-    except AirportNotFoundException:
-        return "UNKNOWN"
+    return airport_info(airport_iata).name
 
 
 def convert_hex_to_rgb(value: str) -> tuple:
@@ -304,6 +457,7 @@ def correct_datetime_info(
     flight_status: str,
     datetime_delay: int,
     text: str,
+    now=None,
 ):
     """
     To correct the dates depending on the data
@@ -314,8 +468,9 @@ def correct_datetime_info(
     :param flight_status: (str), 'scheduled', 'cancelled', 'active', 'landed'
     :param datetime_delay: (str), datetime delays
     :param text: (str), the text to put once datetime is compared to actual date
+    :param now: (datetime, optional), the current datetime. Default is None, which uses datetime.now()
 
-    :returns: (tuple), (datetime_hour, real_datetime, actual_flight_status, real_delay)
+    :returns: (tuple), (datetime_hour, real_datetime, actual_flight_status, real_delay), the date is YYYY-MM-DD and the delay in whole minutes
     """
 
     assert isinstance(datetime_actual, str), "Wrong Type datetime_actual must be a str"
@@ -326,24 +481,92 @@ def correct_datetime_info(
     assert isinstance(text, str), "Wrong Type text must be a str"
 
     datetime_datetime_scheduled = TimeAttribute(datetime_scheduled)
-    today_datetime = datetime_datetime_scheduled.today
+    today_datetime = (datetime.now() if now is None else now).astimezone(PYTZ_TN)
     effective_date = datetime_datetime_scheduled
     datetime_delay = 0 if is_blank(datetime_delay) else datetime_delay
     for date_check in [datetime_estimated, datetime_actual]:
         if not is_blank(date_check):
             effective_date = TimeAttribute(date_check)
     if effective_date.datetime > datetime_datetime_scheduled.datetime:
-        datetime_delay = datetime_datetime_scheduled.get_mins_between(effective_date.datetime)
+        datetime_delay = round(datetime_datetime_scheduled.get_mins_between(effective_date.datetime))
     if (today_datetime > effective_date.datetime) & (flight_status != "cancelled"):
         flight_status = text
     return (
         f"{effective_date.hour}h",
-        effective_date.dateformat,
+        effective_date.isodate,
         flight_status,
         datetime_delay,
     )
 
 
+def correct_datetime_info_batch(
+    datetime_actual,
+    datetime_estimated,
+    datetime_scheduled,
+    flight_status,
+    datetime_delay,
+    text: str,
+    now=None,
+):
+    """
+    Batch version of correct_datetime_info, computing many flight legs at once with NumPy and pandas.
+    The strings are factorized so each distinct timestamp is converted once by localize_timestamps, the rest is done on arrays.
+
+    :param datetime_actual: (array-like(str)), actual datetimes, blank or None when unknown
+    :param datetime_estimated: (array-like(str)), estimated datetimes, blank or None when unknown
+    :param datetime_scheduled: (array-like(str)), scheduled datetimes
+    :param flight_status: (array-like(str)), 'scheduled', 'cancelled', 'active', 'landed'
+    :param datetime_delay: (array-like(int)), datetime delays
+    :param text: (str), the status to put once datetime is compared to actual date
+    :param now: (datetime, optional), the current datetime. Default is None, which uses datetime.now()
+
+    :returns: (tuple), numpy arrays (datetime_hour, real_datetime, actual_flight_status, real_delay), see correct_datetime_info
+    """
+    import numpy as np
+    import pandas as pd
+
+    assert isinstance(text, str), "Wrong Type text must be a str"
+
+    datetime_scheduled = pd.Series(datetime_scheduled, dtype="object")
+    nb_legs = len(datetime_scheduled)
+    columns = [pd.Series(column, dtype="object").fillna("").astype(str).str.strip() for column in (datetime_actual, datetime_estimated, datetime_scheduled)]
+    assert all(len(column) == nb_legs for column in columns), "Wrong Value: all the columns must have the same length"
+    assert not (columns[2] == "").any(), "Wrong Value: datetime_scheduled must not be blank"
+
+    # Convert the distinct timestamps at once, the blanks are never selected and are left at the epoch
+    codes, uniques = pd.factorize(pd.concat(columns, ignore_index=True))
+    codes = codes.reshape(3, nb_legs)
+    localized = localize_timestamps(uniques)
+    unique_epochs = np.where(localized.isna(), 0, localized.asi8 // 1000)
+    unique_datetimes = localized.tz_localize(None)
+    unique_hours = (unique_datetimes.strftime("%H") + "h").to_numpy(dtype="object")
+    unique_dates = unique_datetimes.strftime("%Y-%m-%d").to_numpy(dtype="object")
+
+    # The actual datetime prevails over the estimated one, which prevails over the scheduled one
+    actual_codes, estimated_codes, scheduled_codes = codes
+    effective_codes = np.where(columns[1].to_numpy() != "", estimated_codes, scheduled_codes)
+    effective_codes = np.where(columns[0].to_numpy() != "", actual_codes, effective_codes)
+    effective_epochs = unique_epochs[effective_codes]
+    scheduled_epochs = unique_epochs[scheduled_codes]
+
+    real_delay = pd.Series(datetime_delay, dtype="object").fillna(0).to_numpy(dtype="int64")
+    is_late = effective_epochs > scheduled_epochs
+    real_delay = np.where(is_late, np.round((effective_epochs - scheduled_epochs) / 60e6), real_delay).astype("int64")
+
+    now = datetime.now() if now is None else now
+    now_epoch = (now.astimezone(PYTZ_TN) - EPOCH) // MICROSECOND
+    flight_status = pd.Series(flight_status, dtype="object").to_numpy()
+    is_past = (now_epoch > effective_epochs) & (flight_status != "cancelled")
+    actual_flight_status = np.where(is_past, text, flight_status).astype("object")
+
+    return (
+        unique_hours[effective_codes],
+        unique_dates[effective_codes],
+        actual_flight_status,
+        real_delay,
+    )
+
+
 def get_flight_key(flight_number: str, departure_scheduled: str) -> str:
     """
     To generate the flight key from flight_number & departure_scheduled
@@ -357,20 +580,26 @@ def get_flight_key(flight_number: str, departure_scheduled: str) -> str:
     return f"{flight_number}_{departure_scheduled.full_under_score}"
 
 
-def post_tweet_with_pic(tweet_msg, picture_loc=None):
+def post_tweet_with_pic(tweet_msg, picture_loc=None, settings=None):
     """
     To post a tweet with a picture or not.
 
     :param tweet_msg: (str), The tweet message to be posted
     :param picture_loc: (str), the path of the picture. Default is None
+    :param settings: (Settings), the Twitter credentials. Default is None, which uses get_settings()
     :returns: None
     """
+    if settings is None:
+        settings = get_settings()
+    settings.require("consumer_key", "consumer_secret", "access_token", "access_token_secret")
+    # tweepy is only needed by the Twitter job, the ingest does not pay for its import
+    import tweepy
 
     auth = tweepy.OAuthHandler(
-        consumer_key=get_env("consumer_key"),
-        consumer_secret=get_env("consumer_secret"),
-        access_token=get_env("access_token"),
-        access_token_secret=get_env("access_token_secret"),
+        consumer_key=settings.consumer_key,
+        consumer_secret=settings.consumer_secret,
+        access_token=settings.access_token,
+        access_token_secret=settings.access_token_secret,
     )
 
     api = tweepy.API(auth)
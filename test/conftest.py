@@ -0,0 +1,91 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+import pytz
+
+from benchmarks.payloads import fake_schedule
+from data_pipeline.sql_functions import SqlManager
+
+
+def make_flight_row(key="TU0001_10_01_2023_10_00", airport="TUNIS CARTHAGE", status="scheduled", delay=0, departure_actual=""):
+    return (
+        key,
+        "2023-01-10",
+        "2023-01-10",
+        "TU0001",
+        status,
+        "TUN",
+        airport,
+        "CDG",
+        "CHARLES DE GAULLE",
+        "2023-01-10 10:00",
+        "10h",
+        "2023-01-10 12:00",
+        "12h",
+        "",
+        "",
+        departure_actual,
+        "",
+        delay,
+        delay,
+        "TU",
+        "FRANCE",
+        "TUNISIA",
+    )
+
+
+@pytest.fixture
+def flight_row():
+    """
+    Build a row of the flights table in FLIGHT_TABLE_COLUMNS order
+    """
+    return make_flight_row
+
+
+@pytest.fixture
+def sql_table(tmp_path):
+    with SqlManager(str(tmp_path / "test.db")) as manager:
+        yield manager
+
+
+@pytest.fixture
+def kpi_table(sql_table, flight_row):
+    """
+    The flights of a day with every status, two of them delayed
+    """
+    sql_table.upsert_flights(
+        [
+            flight_row("TU1_10_01_2023_10_00", status="landed", delay=20),
+            flight_row("TU2_10_01_2023_11_00", airport="MONASTIR", status="landed", delay=47),
+            flight_row("TU3_10_01_2023_12_00", status="cancelled", delay=90),
+            flight_row("TU4_10_01_2023_13_00", status="scheduled"),
+        ]
+    )
+    return sql_table
+
+
+@pytest.fixture
+def legacy_dir(tmp_path):
+    """
+    json_data directory of the previous layout: one file per day, with or without the airport in the name
+    """
+    tz = pytz.timezone("Africa/Tunis")
+    legacy_dir = tmp_path / "json_data"
+    files = [
+        # Only Tunis-Carthage was fetched when the name had no airport
+        ("arrivals/01/10_01_2023_arrival_flights.json", fake_schedule(20, datetime(2023, 1, 10), seed=1), datetime(2023, 1, 10, 18)),
+        # Copied after its day
+        ("departures/01/10_01_2023_DJE_departure_flights.json", fake_schedule(20, datetime(2023, 1, 10), seed=2), datetime(2023, 1, 12, 9)),
+        ("departures/01/11_01_2023_TUN_departure_flights.json", fake_schedule(20, datetime(2023, 1, 11), seed=3), datetime(2023, 1, 11, 23)),
+    ]
+    for name, payload, modified in files:
+        path = legacy_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(payload, indent=4), encoding="UTF-8")
+        os.utime(path, (tz.localize(modified).timestamp(),) * 2)
+    # Interrupted write and unrelated file
+    (legacy_dir / "departures/01/12_01_2023_TUN_departure_flights.json").write_text("", encoding="UTF-8")
+    (legacy_dir / "departures/01/notes.txt").write_text("", encoding="UTF-8")
+    return legacy_dir
@@ -0,0 +1,119 @@
+import gzip
+import json
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from benchmarks.payloads import fake_schedule
+from data_pipeline.airlabs_client import AirLabsClient
+
+PAYLOAD = json.dumps(fake_schedule(50, datetime(2023, 1, 10), seed=0)).encode()
+
+
+class ConditionalHandler(BaseHTTPRequestHandler):
+    """
+    Schedules endpoint with an ETag, a Last-Modified date and gzip bodies
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if server.statuses:
+            self.send_response(server.statuses.pop(0))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if server.etag and self.headers.get("If-None-Match") == server.etag:
+            self.send_response(304)
+            self.send_header("ETag", server.etag)
+            self.end_headers()
+            return
+
+        body = server.payload
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if server.etag:
+            self.send_header("ETag", server.etag)
+            self.send_header("Last-Modified", "Tue, 10 Jan 2023 10:00:00 GMT")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ConditionalHandler)
+    server.requests, server.statuses, server.connections = [], [], 0
+    server.payload, server.etag = PAYLOAD, '"v1"'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/api/v9/schedules"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+PARAMS = [("dep_iata", "TUN"), ("airline_iata", "TU"), ("api_key", "secret")]
+
+
+def test_fresh_cache_skips_the_network(server, tmp_path):
+    with AirLabsClient(server.url, cache_dir=str(tmp_path), max_age=60) as client:
+        assert client.get_json(PARAMS) == json.loads(PAYLOAD)
+        assert client.get_json(PARAMS[:2] + [("api_key", "other secret")]) == json.loads(PAYLOAD)
+    assert len(server.requests) == 1
+    assert client.stats["misses"] == 1 and client.stats["hits"] == 1
+    assert client.stats["bytes_cached"] == len(PAYLOAD)
+
+
+def test_stale_cache_is_revalidated(server, tmp_path):
+    with AirLabsClient(server.url, cache_dir=str(tmp_path), max_age=0) as client:
+        client.get_json(PARAMS)
+        assert client.get_json(PARAMS) == json.loads(PAYLOAD)
+        server.etag = '"v2"'
+        server.payload = b'{"response": []}'
+        assert client.get_json(PARAMS) == {"response": []}
+    assert server.requests[1]["If-None-Match"] == '"v1"'
+    assert server.requests[1]["If-Modified-Since"] == "Tue, 10 Jan 2023 10:00:00 GMT"
+    assert (client.stats["misses"], client.stats["revalidated"], client.stats["hits"]) == (2, 1, 0)
+
+
+def test_gzip_and_keep_alive(server):
+    server.etag = None
+    with AirLabsClient(server.url, cache_dir=None) as client:
+        for _ in range(3):
+            client.get_json(PARAMS)
+    assert all("gzip" in request["Accept-Encoding"] for request in server.requests)
+    assert server.connections == 1
+    assert client.stats["bytes_decoded"] == 3 * len(PAYLOAD)
+    assert client.stats["bytes_received"] < client.stats["bytes_decoded"] / 2
+
+
+def test_server_errors_are_retried(server):
+    server.statuses = [503, 502]
+    with AirLabsClient(server.url, cache_dir=None, retries=2) as client:
+        assert client.get_json(PARAMS) == json.loads(PAYLOAD)
+    assert len(server.requests) == 3
+
+
+def test_client_error_is_raised(server, tmp_path):
+    server.statuses = [401]
+    with AirLabsClient(server.url, cache_dir=str(tmp_path)) as client:
+        with pytest.raises(requests.exceptions.HTTPError):
+            client.get_json(PARAMS)
+    assert len(server.requests) == 1
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,73 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from src.airports import (
+    AIRPORT_LIST_PATH,
+    AIRPORT_STORE_PATH,
+    OTHER_LIST_PATH,
+    Airport,
+    AirportNotFoundException,
+    Airports,
+    Other,
+    build_airport_store,
+)
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_store_is_up_to_date(tmp_path):
+    path_store = str(tmp_path / "airports.bin")
+    build_airport_store(path_store)
+    with open(path_store, "rb") as built, open(AIRPORT_STORE_PATH, "rb") as shipped:
+        assert built.read() == shipped.read(), "run python -m src.airports --build"
+
+
+def test_lookup_matches_json_lists():
+    with open(AIRPORT_LIST_PATH, "r", encoding="UTF-8") as file:
+        airports = {row[3].upper(): Airport(*row) for row in json.load(file)}
+    with open(OTHER_LIST_PATH, "r", encoding="UTF-8") as file:
+        others = {row[0].upper(): Other(*row) for row in json.load(file)}
+
+    store = Airports()
+    for iata in ["TUN", "CDG", "JFK", "DJE", "AUH", "AAN"]:
+        assert store.lookup(iata) == (airports.get(iata) or others.get(iata))
+    assert store.other_iata("AAN") == others["AAN"]
+    assert store.other_iata("AAN").lat is None
+    assert len(store.airports) == sum(len(iata) == 3 for iata in airports)
+    with pytest.raises(AirportNotFoundException):
+        store.lookup("XXX")
+    with pytest.raises(ValueError):
+        store.lookup("XXXX")
+
+
+def test_missing_store_is_built(tmp_path):
+    path_store = str(tmp_path / "airports.bin")
+    assert Airports(path_store).lookup("tun ").city == "Tunis"
+    assert os.path.exists(path_store)
+
+
+def test_import_is_lazy_from_another_directory(tmp_path):
+    code = "import src.airports as A; assert A.open_airport_store.cache_info().currsize == 0; print(A.Airports().lookup('TUN').name)"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": PACKAGE_DIR},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "Carthage"
+    import_time = next(int(line.split("|")[0].split(":")[1]) for line in result.stderr.splitlines() if line.endswith("| src.airports"))
+
+    start = time.perf_counter()
+    for path in (AIRPORT_LIST_PATH, OTHER_LIST_PATH):
+        with open(path, "r", encoding="UTF-8") as file:
+            json.load(file)
+    json_time = (time.perf_counter() - start) * 1e6
+    print(f"import {import_time} us, JSON parse {json_time:.0f} us")
+    assert import_time < json_time
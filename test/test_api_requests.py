@@ -0,0 +1,166 @@
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import data_pipeline.api_requests
+from benchmarks.payloads import fake_schedule
+from data_pipeline.airlabs_client import AirLabsClient
+from data_pipeline.api_requests import AirLabsData
+from data_pipeline.snapshots import SnapshotStore
+from src.const import AIRPORTS_IATA, FLIGHT_TABLE_COLUMNS, SQL_TABLE_NAME, TYPE_FLIGHTS
+from src.settings import Settings
+
+
+class ScheduleHandler(BaseHTTPRequestHandler):
+    """
+    AirLabs /schedules stand-in, serves a canned payload after `latency` seconds
+    """
+
+    def do_GET(self):
+        server = self.server
+        query = parse_qs(urlparse(self.path).query)
+        key = (query.get("dep_iata") or query.get("arr_iata"))[0], "DEPARTURE" if "dep_iata" in query else "ARRIVAL"
+        with server.lock:
+            server.requests.append((key, query.get("airline_iata")))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            status = server.failures.get(key, [200]).pop(0) if server.failures.get(key) else 200
+        time.sleep(server.latency)
+        with server.lock:
+            server.in_flight -= 1
+
+        body = json.dumps({"response": [{"dep_iata": key[0]}]} if status == 200 else {"error": status}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def airlabs_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ScheduleHandler)
+    server.lock = threading.Lock()
+    server.requests, server.failures = [], {}
+    server.in_flight, server.max_in_flight, server.latency = 0, 0, 0.2
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(AirLabsData, "api_url", f"http://127.0.0.1:{server.server_address[1]}/api/v9/schedules")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def airlabs(tmp_path):
+    client = AirLabsClient(AirLabsData.api_url, cache_dir=None)
+    snapshots = SnapshotStore(str(tmp_path / "snapshots"))
+    settings = Settings(token_airlab="token")
+    with AirLabsData(datetime(2023, 1, 10), path_sql_db=str(tmp_path / "test.db"), client=client, snapshots=snapshots, settings=settings) as manager:
+        yield manager
+
+
+def test_fetch_schedules_in_parallel(airlabs_server, airlabs):
+    start = time.perf_counter()
+    schedules = airlabs.fetch_schedules(max_workers=4)
+    elapsed = time.perf_counter() - start
+
+    keys = [(airport_iata, type_flight) for airport_iata in AIRPORTS_IATA for type_flight in TYPE_FLIGHTS]
+    assert sorted(schedules) == sorted(keys)
+    assert schedules[("DJE", "ARRIVAL")] == {"response": [{"dep_iata": "DJE"}]}
+    assert all(airlines == ["TU", "BJ", "AF", "TO"] for _, airlines in airlabs_server.requests)
+    # 10 requests of 0.2 s, 3 rounds of at most 4 requests
+    assert airlabs_server.max_in_flight == 4
+    assert elapsed < len(keys) * airlabs_server.latency / 2
+
+
+def test_concurrency_cap(airlabs_server, airlabs):
+    airlabs_server.latency = 0.05
+    assert len(airlabs.fetch_schedules(max_workers=1)) == len(AIRPORTS_IATA) * len(TYPE_FLIGHTS)
+    assert airlabs_server.max_in_flight == 1
+
+
+def test_server_error_is_retried(airlabs_server, airlabs):
+    airlabs_server.latency = 0
+    airlabs_server.failures[("MIR", "DEPARTURE")] = [503]
+    schedules = airlabs.fetch_schedules(["MIR"])
+    assert schedules[("MIR", "DEPARTURE")] == {"response": [{"dep_iata": "MIR"}]}
+    assert [key for key, _ in airlabs_server.requests].count(("MIR", "DEPARTURE")) == 2
+
+
+def test_client_error_is_left_out(airlabs_server, airlabs):
+    airlabs_server.latency = 0
+    airlabs_server.failures[("NBE", "ARRIVAL")] = [401]
+    schedules = airlabs.fetch_schedules(["NBE"])
+    assert list(schedules) == [("NBE", "DEPARTURE")]
+    assert [key for key, _ in airlabs_server.requests].count(("NBE", "ARRIVAL")) == 1
+
+
+def test_force_update_archives_every_airport(tmp_path, monkeypatch):
+    payloads = [fake_schedule(3, datetime(2023, 1, 10), seed=seed) for seed in range(2)]
+    monkeypatch.setattr(AirLabsData, "fetch_schedules", lambda self: {("SFA", "ARRIVAL"): payloads.pop(0)})
+    snapshots = SnapshotStore(str(tmp_path / "snapshots"))
+    client = AirLabsClient(cache_dir=None)
+    with AirLabsData(datetime.now(), force_update=True, path_sql_db=str(tmp_path / "test.db"), client=client, snapshots=snapshots) as airlabs:
+        airlabs.execute_force_update(True)
+        assert len(airlabs.snapshots.archive("SFA", "ARRIVAL", datetime.now()).index()) == 2
+        airlabs.get_arrivals()
+        assert len(airlabs.id_keys()) == 3
+
+
+def test_unchanged_flights_are_skipped(tmp_path, monkeypatch):
+    payload = fake_schedule(20, datetime(2023, 1, 10), seed=0)["response"]
+    with AirLabsData(datetime(2023, 1, 10), path_sql_db=str(tmp_path / "test.db"), client=AirLabsClient(cache_dir=None)) as airlabs:
+        churn = airlabs.ingest_flights(payload)
+        nb_flights = len(airlabs.id_keys())
+        assert churn == {"new": nb_flights, "changed": 0, "unchanged": len(payload) - nb_flights}
+
+        corrections = []
+        monkeypatch.setattr(data_pipeline.api_requests, "correct_datetime_info_batch", lambda *args: corrections.append(args))
+        total_changes = airlabs.conn.total_changes
+        assert airlabs.ingest_flights(payload) == {"new": 0, "changed": 0, "unchanged": len(payload)}
+        assert airlabs.conn.total_changes == total_changes
+        assert corrections == []
+        monkeypatch.undo()
+
+        payload[0] = {**payload[0], "status": "cancelled"}
+        assert airlabs.ingest_flights(payload)["changed"] == 1
+        key = airlabs.id_keys()[0]
+        airlabs.update_table(key, airlabs.execute_sql(f"SELECT {', '.join(FLIGHT_TABLE_COLUMNS)} FROM {SQL_TABLE_NAME} WHERE ID_FLIGHT = '{key}'", "fetchone"))
+        assert airlabs.ingest_flights(payload)["changed"] == 1
+
+
+def test_status_of_unchanged_flights_moves_with_the_time(tmp_path, monkeypatch):
+    payload = fake_schedule(20, datetime(2099, 1, 10), seed=0)["response"]
+    with AirLabsData(datetime(2099, 1, 10), path_sql_db=str(tmp_path / "test.db"), client=AirLabsClient(cache_dir=None)) as airlabs:
+        airlabs.ingest_flights(payload)
+        statuses = dict(airlabs.execute_sql(f"SELECT ID_FLIGHT, FLIGHT_STATUS FROM {SQL_TABLE_NAME}", "fetchall"))
+        moving = {key for key, status in statuses.items() if status not in ("cancelled", "landed")}
+        assert moving
+
+        total_changes = airlabs.conn.total_changes
+        assert airlabs.ingest_flights(payload) == {"new": 0, "changed": 0, "unchanged": len(payload)}
+        assert airlabs.conn.total_changes == total_changes
+
+        # The day of the flights is over
+        correct_datetime_info_batch = data_pipeline.api_requests.correct_datetime_info_batch
+        monkeypatch.setattr(data_pipeline.api_requests, "correct_datetime_info_batch", lambda *args: correct_datetime_info_batch(*args, now=datetime(2099, 1, 12)))
+        churn = airlabs.ingest_flights(payload)
+        assert churn["changed"] >= len(moving) and churn["new"] == 0
+        statuses = dict(airlabs.execute_sql(f"SELECT ID_FLIGHT, FLIGHT_STATUS FROM {SQL_TABLE_NAME}", "fetchall"))
+        assert {statuses[key] for key in moving} == {"landed"}
+
+
+def test_imported_legacy_files_are_ingested(airlabs, legacy_dir):
+    assert airlabs.snapshots.import_legacy(str(legacy_dir)) == 3
+    airlabs.get_saved_flights("ARRIVAL")
+    airlabs.get_saved_flights("DEPARTURE")
+    assert airlabs.execute_sql(f"SELECT COUNT(*) FROM {SQL_TABLE_NAME}", "fetchone")[0] == 40
@@ -0,0 +1,95 @@
+from datetime import date, datetime
+
+import pytest
+import pytz
+
+from benchmarks.payloads import fake_schedule
+from data_pipeline.api_requests import AirLabsData
+from data_pipeline.backfill import backfill, backfill_units
+from data_pipeline.daily_kpi import check_daily_kpi
+from data_pipeline.snapshots import SnapshotStore
+from data_pipeline.sql_functions import SqlManager
+from src.const import SQL_TABLE_NAME
+
+TZ = pytz.timezone("Africa/Tunis")
+START, END = date(2023, 1, 10), date(2023, 1, 11)
+
+
+@pytest.fixture
+def snapshot_dir(tmp_path):
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    for unit_index, unit in enumerate(backfill_units(START, END)):
+        if unit.airport_iata == "SFA":
+            continue
+        day = datetime.combine(unit.day, datetime.min.time())
+        for hour in (8, 14, 20):
+            payload = fake_schedule(20, day, seed=unit_index * 24 + hour)
+            store.append(unit.airport_iata, unit.type_flight, payload, TZ.localize(day.replace(hour=hour)).timestamp())
+    return store.directory
+
+
+def flights(path_sql_db):
+    with SqlManager(path_sql_db) as sql_table:
+        return sql_table.execute_sql(f"SELECT * FROM {SQL_TABLE_NAME} ORDER BY ID_FLIGHT", "fetchall")
+
+
+def test_backfill_matches_the_ingest(tmp_path, snapshot_dir):
+    stats = backfill(START, END, str(tmp_path / "backfill.db"), snapshot_dir, workers=2)
+    assert (stats["units"], stats["payloads"]) == (20, 48)
+
+    # The same payloads ingested one by one, in the order of the units
+    store = SnapshotStore(snapshot_dir)
+    with AirLabsData(datetime(2023, 1, 10), path_sql_db=str(tmp_path / "ingest.db"), snapshots=store) as airlabs:
+        for unit in backfill_units(START, END):
+            for _, payload in store.replay(unit.airport_iata, unit.type_flight, *store.day_bounds(unit.day)):
+                airlabs.get_flights(payload)
+
+    backfilled = flights(str(tmp_path / "backfill.db"))
+    assert len(backfilled) > 0
+    assert backfilled == flights(str(tmp_path / "ingest.db"))
+    with SqlManager(str(tmp_path / "backfill.db")) as sql_table:
+        assert check_daily_kpi(sql_table.conn) == []
+
+
+def test_interrupted_backfill_resumes(tmp_path, snapshot_dir, monkeypatch):
+    path_sql_db = str(tmp_path / "backfill.db")
+    upsert_flights = SqlManager.upsert_flights
+    calls = []
+
+    def failing_upsert(self, *args):
+        calls.append(1)
+        if len(calls) == 5:
+            raise KeyboardInterrupt
+        return upsert_flights(self, *args)
+
+    monkeypatch.setattr(SqlManager, "upsert_flights", failing_upsert)
+    with pytest.raises(KeyboardInterrupt):
+        backfill(START, END, path_sql_db, snapshot_dir, workers=2)
+    monkeypatch.setattr(SqlManager, "upsert_flights", upsert_flights)
+
+    stats = backfill(START, END, path_sql_db, snapshot_dir, workers=2)
+    assert stats["units"] == 20 - 4
+    backfill(START, END, str(tmp_path / "full.db"), snapshot_dir, workers=2)
+    assert flights(path_sql_db) == flights(str(tmp_path / "full.db"))
+
+
+def test_backfill_refuses_a_live_database(tmp_path, snapshot_dir, flight_row):
+    path_sql_db = str(tmp_path / "live.db")
+    with SqlManager(path_sql_db) as sql_table:
+        sql_table.upsert_flights([flight_row("TU1_10_01_2023_10_00")])
+    with pytest.raises(ValueError):
+        backfill(START, END, path_sql_db, snapshot_dir, workers=1)
+
+
+def test_backfill_of_the_legacy_files(tmp_path, legacy_dir):
+    snapshot_dir = str(tmp_path / "snapshots")
+    path_sql_db = str(tmp_path / "backfill.db")
+    stats = backfill(START, END, path_sql_db, snapshot_dir, workers=2, legacy_dir=str(legacy_dir))
+    assert (stats["units"], stats["payloads"], stats["flights"]) == (20, 3, 60)
+
+    # The files already imported are not replayed twice
+    stats = backfill(START, END, str(tmp_path / "again.db"), snapshot_dir, workers=2, legacy_dir=str(legacy_dir))
+    assert stats["payloads"] == 3
+    assert flights(path_sql_db) == flights(str(tmp_path / "again.db"))
+    with SqlManager(path_sql_db) as sql_table:
+        assert check_daily_kpi(sql_table.conn) == []
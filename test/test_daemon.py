@@ -0,0 +1,95 @@
+import os
+import signal
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from benchmarks.payloads import fake_schedule
+from data_pipeline.airlabs_client import AirLabsClient
+from data_pipeline.api_requests import AirLabsData
+from data_pipeline.daemon import IngestDaemon, busy_flights, poll_interval
+from data_pipeline.snapshots import SnapshotStore
+from src.const import POLL_INTERVAL_MAX, POLL_INTERVAL_MIN
+
+TZ = pytz.timezone("Africa/Tunis")
+
+
+class FakeClock:
+    """
+    Clock whose waits return at once and move the time forward
+    """
+
+    def __init__(self, now, on_wait=None):
+        self.current = now
+        self.waits = []
+        self.on_wait = on_wait
+
+    def now(self):
+        return self.current
+
+    def wait(self, event, seconds):
+        self.waits.append(seconds)
+        self.current += timedelta(seconds=seconds)
+        if self.on_wait is not None:
+            self.on_wait(len(self.waits))
+        return event.is_set()
+
+
+@pytest.fixture
+def airlabs(tmp_path):
+    client = AirLabsClient(cache_dir=None)
+    snapshots = SnapshotStore(str(tmp_path / "snapshots"))
+    with AirLabsData(datetime(2023, 1, 10), path_sql_db=str(tmp_path / "test.db"), client=client, snapshots=snapshots) as manager:
+        yield manager
+
+
+def test_poll_interval_adapts():
+    intervals = [poll_interval(busy) for busy in (0, 1, 10, 100, 10_000)]
+    assert intervals[0] == POLL_INTERVAL_MAX
+    assert intervals == sorted(intervals, reverse=True)
+    assert POLL_INTERVAL_MIN < intervals[-1] < POLL_INTERVAL_MIN + 60
+
+
+def test_busy_flights(airlabs, flight_row):
+    airlabs.upsert_flights([flight_row("TU1_10_01_2023_10_00"), flight_row("TU2_10_01_2023_10_00", status="active")])
+    assert busy_flights(airlabs, TZ.localize(datetime(2023, 1, 10, 9))) == 2
+    assert busy_flights(airlabs, TZ.localize(datetime(2023, 1, 10, 13))) == 1
+    assert busy_flights(airlabs, TZ.localize(datetime(2023, 1, 12, 3))) == 0
+
+
+def test_report_is_regenerated_on_change_only(airlabs, monkeypatch):
+    day = datetime(2023, 1, 10)
+    payloads = [fake_schedule(30, day, seed=0), fake_schedule(30, day, seed=0), fake_schedule(30, day, seed=1)]
+    monkeypatch.setattr(AirLabsData, "fetch_schedules", lambda self: {("TUN", "DEPARTURE"): payloads.pop(0)})
+    reports = []
+    clock = FakeClock(TZ.localize(day.replace(hour=12)))
+
+    daemon = IngestDaemon(airlabs, clock, on_change=lambda manager, now: reports.append(now))
+    assert daemon.run(max_ticks=3) == 3
+    assert reports == [TZ.localize(day.replace(hour=12)), clock.current]
+    assert len(clock.waits) == 2
+    # Flights are due around noon, the next fetch comes sooner than overnight
+    assert all(POLL_INTERVAL_MIN <= wait < POLL_INTERVAL_MAX for wait in clock.waits)
+    assert len(airlabs.snapshots.archive("TUN", "DEPARTURE", day).index()) == 3
+
+
+def test_failed_tick_does_not_stop_the_daemon(airlabs, monkeypatch):
+    def fetch_schedules(self):
+        raise RuntimeError("API down")
+
+    monkeypatch.setattr(AirLabsData, "fetch_schedules", fetch_schedules)
+    daemon = IngestDaemon(airlabs, FakeClock(TZ.localize(datetime(2023, 1, 10, 3))), on_change=None)
+    assert daemon.run(max_ticks=2) == 2
+    assert daemon.clock.waits == [POLL_INTERVAL_MAX]
+
+
+def test_sigterm_stops_after_the_current_fetch(airlabs, monkeypatch):
+    monkeypatch.setattr(AirLabsData, "fetch_schedules", lambda self: {})
+    previous_handler = signal.getsignal(signal.SIGTERM)
+    clock = FakeClock(TZ.localize(datetime(2023, 1, 10, 3)), on_wait=lambda _: os.kill(os.getpid(), signal.SIGTERM))
+
+    daemon = IngestDaemon(airlabs, clock, on_change=None)
+    assert daemon.run() == 1
+    assert daemon.stopping.is_set()
+    assert signal.getsignal(signal.SIGTERM) == previous_handler
@@ -0,0 +1,62 @@
+from datetime import datetime
+
+from data_pipeline.daily_kpi import check_daily_kpi, get_daily_kpi, rebuild_daily_kpi
+from src.const import SQL_TABLE_NAME
+
+
+def test_upsert_maintains_rollup(kpi_table):
+    kpi = get_daily_kpi(kpi_table.conn, "2023-01-10", "TU")
+    assert kpi["DEPARTURE"]["NB_FLIGHTS"] == 4
+    assert (kpi["DEPARTURE"]["NB_LANDED"], kpi["DEPARTURE"]["NB_CANCELLED"], kpi["DEPARTURE"]["NB_SCHEDULED"]) == (2, 1, 1)
+    assert kpi["ARRIVAL"]["NB_DELAYED"] == 2
+    assert (kpi["ARRIVAL"]["MIN_DELAY"], kpi["ARRIVAL"]["MAX_DELAY"], kpi["ARRIVAL"]["AVG_DELAY"]) == (20, 47, 33.5)
+    assert check_daily_kpi(kpi_table.conn) == []
+
+
+def test_rollup_matches_report_queries(kpi_table):
+    kpi = get_daily_kpi(kpi_table.conn, "2023-01-10", "TU")
+    for type_f in ["DEPARTURE", "ARRIVAL"]:
+        for column, sql_op in [("NB_DELAYED", "COUNT"), ("MIN_DELAY", "MIN"), ("MAX_DELAY", "MAX"), ("AVG_DELAY", "AVG")]:
+            expected = kpi_table.execute_sql(
+                f"""
+                SELECT {sql_op}({type_f}_DELAY)
+                FROM {SQL_TABLE_NAME}
+                WHERE (
+                    (DEPARTURE_DATE = "2023-01-10") AND
+                    (AIRLINE = "TU") AND
+                    ({type_f}_DELAY > 0) AND
+                    (FLIGHT_STATUS <> "cancelled")
+                )
+                """,
+                "fetchone",
+            )[0]
+            assert kpi[type_f][column] == expected
+
+
+def test_moved_flight_refreshes_both_dates(kpi_table, flight_row):
+    moved = list(flight_row("TU2_10_01_2023_11_00", airport="MONASTIR", status="landed", delay=47))
+    moved[1] = "2023-01-11"
+    kpi_table.upsert_flights([tuple(moved)])
+    assert get_daily_kpi(kpi_table.conn, "2023-01-10", "TU")["DEPARTURE"]["NB_FLIGHTS"] == 3
+    assert get_daily_kpi(kpi_table.conn, "2023-01-11", "TU")["DEPARTURE"]["NB_FLIGHTS"] == 1
+    assert check_daily_kpi(kpi_table.conn) == []
+
+
+def test_clean_maintains_rollup(kpi_table):
+    kpi_table.clean_sql_table(datetime(2023, 1, 10, 12))
+    assert check_daily_kpi(kpi_table.conn) == []
+    assert get_daily_kpi(kpi_table.conn, "2023-01-10", "TU")["DEPARTURE"]["NB_SCHEDULED"] == 0
+
+
+def test_check_and_rebuild(kpi_table):
+    kpi_table.execute_sql(f'DELETE FROM {SQL_TABLE_NAME} WHERE ID_FLIGHT = "TU1_10_01_2023_10_00"')
+    assert check_daily_kpi(kpi_table.conn) == [("2023-01-10", "TU", "ARRIVAL"), ("2023-01-10", "TU", "DEPARTURE")]
+    with kpi_table.transaction():
+        assert rebuild_daily_kpi(kpi_table.conn) == 2
+    assert check_daily_kpi(kpi_table.conn) == []
+
+
+def test_missing_day(kpi_table):
+    kpi = get_daily_kpi(kpi_table.conn, "2000-01-01", "TU")
+    assert kpi["ARRIVAL"]["NB_DELAYED"] == 0
+    assert kpi["ARRIVAL"]["MAX_DELAY"] is None
@@ -0,0 +1,213 @@
+import ftplib
+import hashlib
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+
+import pytest
+
+from data_pipeline.ftp_sync import FtpSyncError, read_state, sync_ftp_file
+from data_pipeline.sql_functions import SqlManager
+from src.const import SQL_TABLE_NAME
+from src.settings import Settings
+
+
+class FtpHandler(socketserver.StreamRequestHandler):
+    """
+    Passive mode FTP commands used by ftplib: USER, PASS, CWD, TYPE, SIZE, MDTM, PASV, REST, RETR, QUIT
+    """
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        rest, listener = 0, None
+        self.reply("220 stand-in FTP server")
+        for line in self.rfile:
+            command, _, argument = line.decode().strip().partition(" ")
+            command = command.upper()
+            if command == "USER":
+                self.reply("331 password required")
+            elif command == "PASS":
+                self.reply("230 logged in")
+            elif command in ("CWD", "TYPE"):
+                self.reply("250 ok" if command == "CWD" else "200 ok")
+            elif command in ("SIZE", "MDTM"):
+                if argument not in server.files:
+                    self.reply("550 no such file")
+                elif command == "SIZE":
+                    self.reply(f"213 {len(server.files[argument])}")
+                else:
+                    self.reply(f"213 {server.mdtm}")
+            elif command == "PASV":
+                listener = socket.create_server(("127.0.0.1", 0))
+                port = listener.getsockname()[1]
+                self.reply(f"227 Entering Passive Mode (127,0,0,1,{port >> 8},{port & 255})")
+            elif command == "REST":
+                rest = int(argument)
+                self.reply("350 restarting")
+            elif command == "RETR":
+                if argument not in server.files:
+                    self.reply("550 no such file")
+                    listener.close()
+                    continue
+                self.reply("150 opening data connection")
+                data = server.files[argument][rest:]
+                if server.drop_after is not None:
+                    data, server.drop_after = data[: server.drop_after], None
+                    complete = False
+                else:
+                    complete = True
+                connection, _ = listener.accept()
+                connection.sendall(data)
+                connection.close()
+                listener.close()
+                server.retr.append((argument, rest, len(data)))
+                rest = 0
+                self.reply("226 transfer complete" if complete else "426 connection closed, transfer aborted")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+@pytest.fixture
+def ftp_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FtpHandler)
+    server.daemon_threads = True
+    server.files, server.mdtm, server.drop_after, server.retr = {}, "20230110100000", None, []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def ftp(ftp_server):
+    client = ftplib.FTP()
+    client.connect("127.0.0.1", ftp_server.server_address[1])
+    client.login("user", "password")
+    yield client
+    client.close()
+
+
+def database_bytes(tmp_path, rows):
+    path = str(tmp_path / "remote.db")
+    with SqlManager(path) as sql_table:
+        sql_table.upsert_flights(rows)
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def flight_keys(path):
+    conn = sqlite3.connect(path)
+    try:
+        return [row[0] for row in conn.execute(f"SELECT ID_FLIGHT FROM {SQL_TABLE_NAME} ORDER BY ID_FLIGHT")]
+    finally:
+        conn.close()
+
+
+def test_download_then_skip_unchanged(tmp_path, ftp_server, ftp, flight_row):
+    ftp_server.files["tunisair_delay.db"] = database_bytes(tmp_path, [flight_row("TU1"), flight_row("TU2")])
+    local_path = str(tmp_path / "local.db")
+
+    assert sync_ftp_file(ftp, "tunisair_delay.db", local_path)
+    assert flight_keys(local_path) == ["TU1", "TU2"]
+    assert not os.path.exists(local_path + ".part")
+    assert sync_ftp_file(ftp, "tunisair_delay.db", local_path) is False
+    assert len(ftp_server.retr) == 1
+
+    ftp_server.files["tunisair_delay.db"] = database_bytes(tmp_path, [flight_row("TU3")])
+    ftp_server.mdtm = "20230111100000"
+    assert sync_ftp_file(ftp, "tunisair_delay.db", local_path)
+    assert flight_keys(local_path) == ["TU1", "TU2", "TU3"]
+
+
+def test_dropped_transfer_is_resumed(tmp_path, ftp_server, ftp, flight_row):
+    remote = database_bytes(tmp_path, [flight_row("TU1")])
+    ftp_server.files["tunisair_delay.db"] = remote
+    ftp_server.drop_after = 1000
+    local_path = str(tmp_path / "local.db")
+    with open(local_path, "wb") as file:
+        file.write(b"previous database")
+
+    with pytest.raises(ftplib.error_temp):
+        sync_ftp_file(ftp, "tunisair_delay.db", local_path)
+    with open(local_path, "rb") as file:
+        assert file.read() == b"previous database"
+    assert os.path.getsize(local_path + ".part") == 1000
+
+    assert sync_ftp_file(ftp, "tunisair_delay.db", local_path)
+    assert ftp_server.retr[-1] == ("tunisair_delay.db", 1000, len(remote) - 1000)
+    assert read_state(local_path)["sha256"] == hashlib.sha256(remote).hexdigest()
+    assert flight_keys(local_path) == ["TU1"]
+
+
+def test_partial_of_another_version_is_restarted(tmp_path, ftp_server, ftp, flight_row):
+    ftp_server.files["tunisair_delay.db"] = database_bytes(tmp_path, [flight_row("TU1")])
+    ftp_server.drop_after = 1000
+    local_path = str(tmp_path / "local.db")
+    with pytest.raises(ftplib.error_temp):
+        sync_ftp_file(ftp, "tunisair_delay.db", local_path)
+
+    ftp_server.mdtm = "20230111100000"
+    assert sync_ftp_file(ftp, "tunisair_delay.db", local_path)
+    assert ftp_server.retr[-1][1] == 0
+
+
+def test_wrong_checksum_keeps_the_database(tmp_path, ftp_server, ftp, flight_row):
+    ftp_server.files["tunisair_delay.db"] = database_bytes(tmp_path, [flight_row("TU1")])
+    ftp_server.files["tunisair_delay.db.sha256"] = b"0" * 64 + b"  tunisair_delay.db\n"
+    local_path = str(tmp_path / "local.db")
+    with open(local_path, "wb") as file:
+        file.write(b"previous database")
+
+    with pytest.raises(FtpSyncError):
+        sync_ftp_file(ftp, "tunisair_delay.db", local_path)
+    with open(local_path, "rb") as file:
+        assert file.read() == b"previous database"
+    assert not os.path.exists(local_path + ".part")
+
+
+def test_corrupted_database_is_refused(tmp_path, ftp_server, ftp):
+    ftp_server.files["tunisair_delay.db"] = b"SQLite format 3\x00" + b"\xff" * 4080
+    local_path = str(tmp_path / "local.db")
+
+    with pytest.raises(FtpSyncError):
+        sync_ftp_file(ftp, "tunisair_delay.db", local_path)
+    assert not os.path.exists(local_path)
+
+
+def test_database_in_use_is_not_replaced(tmp_path, ftp_server, ftp, flight_row):
+    ftp_server.files["tunisair_delay.db"] = database_bytes(tmp_path, [flight_row("TU1")])
+    local_path = str(tmp_path / "local.db")
+    with SqlManager(local_path) as daemon:
+        daemon.upsert_flights([flight_row("TU9")])
+        with pytest.raises(FtpSyncError):
+            sync_ftp_file(ftp, "tunisair_delay.db", local_path)
+        assert daemon.id_keys() == ["TU9"]
+        assert os.path.exists(local_path + "-wal")
+
+    # The verified download is kept for the next sync
+    assert sync_ftp_file(ftp, "tunisair_delay.db", local_path)
+    assert len(ftp_server.retr) == 1
+    assert flight_keys(local_path) == ["TU1"]
+
+
+def test_import_ftp_sqldb(tmp_path, ftp_server, monkeypatch, flight_row):
+    remote = database_bytes(tmp_path, [flight_row("TU1")])
+    ftp_server.files["local.db"] = remote
+    ftp_server.files["local.db.sha256"] = hashlib.sha256(remote).hexdigest().encode()
+    settings = Settings(path="/", ip_adress="127.0.0.1", login="user", password="password")
+    monkeypatch.setattr(ftplib.FTP, "port", ftp_server.server_address[1])
+
+    with SqlManager(str(tmp_path / "local.db"), settings) as sql_table:
+        sql_table.upsert_flights([flight_row("TU9")])
+        assert sql_table.import_ftp_sqldb()
+        assert sql_table.id_keys() == ["TU1"]
+        assert sql_table.import_ftp_sqldb() is False
@@ -0,0 +1,73 @@
+import io
+import json
+import tracemalloc
+from datetime import datetime
+
+import pytest
+
+from benchmarks.payloads import fake_schedule
+from data_pipeline.airlabs_client import AirLabsClient
+from data_pipeline.api_requests import AirLabsData
+from data_pipeline.json_stream import iter_json_array
+
+PAYLOAD = {
+    "request": {"params": {"dep_iata": "TUN"}, "note": '"response": [1, 2]'},
+    "response": [{"flight_iata": "TU712", "delayed": 15, "dep_time": "2023-01-10 10:00"}, 12345, -0.5e-3, "Tunis–Carthage é", [], {}, None, True],
+    "terms": "Unauthorized access is prohibited",
+}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 1 << 16])
+def test_items_match_json_load(chunk_size):
+    text = json.dumps(PAYLOAD, indent=4, ensure_ascii=False)
+    assert list(iter_json_array(io.StringIO(text), "response", chunk_size)) == PAYLOAD["response"]
+    assert list(iter_json_array(io.BytesIO(text.encode()), "response", chunk_size)) == PAYLOAD["response"]
+
+
+def test_missing_and_empty_arrays():
+    assert list(iter_json_array(io.StringIO('{"error": {"code": "unknown_api_key"}}'), "response")) == []
+    assert list(iter_json_array(io.StringIO("{}"), "response")) == []
+    assert list(iter_json_array(io.StringIO('{"response": [ ]}'), "response")) == []
+
+
+def test_malformed_payloads():
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('{"response": {"a": 1}}'), "response"))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('{"response": [{"a": 1}, {"b": '), "response", 4))
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO("[1, 2]"), "response"))
+
+
+def ingest_peak(airlabs, path, batch_size=None):
+    tracemalloc.start()
+    try:
+        with open(path, "r", encoding="UTF-8") as file:
+            if batch_size is None:
+                airlabs.get_flights(json.load(file))
+            else:
+                airlabs.ingest_flights(iter_json_array(file, "response"), batch_size)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_streaming_ingest_memory_is_bounded(tmp_path):
+    paths = {}
+    for nb_flights in (400, 1600):
+        paths[nb_flights] = tmp_path / f"{nb_flights}_flights.json"
+        with open(paths[nb_flights], "w", encoding="UTF-8") as file:
+            json.dump(fake_schedule(nb_flights, datetime(2023, 1, 10), seed=nb_flights), file, indent=4)
+
+    client = AirLabsClient(cache_dir=None)
+    with AirLabsData(datetime(2023, 1, 10), path_sql_db=str(tmp_path / "test.db"), client=client) as airlabs:
+        # Lazy imports and caches of the first ingest are not part of the measure
+        airlabs.ingest_flights(fake_schedule(10, datetime(2023, 1, 9), seed=0)["response"])
+        small = ingest_peak(airlabs, paths[400], batch_size=100)
+        large = ingest_peak(airlabs, paths[1600], batch_size=100)
+        eager = ingest_peak(airlabs, paths[1600])
+        assert len(airlabs.id_keys()) > 1600
+
+    print(f"streaming peak {small} B for 400 flights, {large} B for 1600 flights, eager {eager} B")
+    assert large < 2 * small
+    assert large < eager / 2
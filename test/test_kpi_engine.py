@@ -0,0 +1,37 @@
+from data_analysis.kpi_engine import DailyKpi, WorstFlight, compute_daily_kpi
+
+
+def test_compute_daily_kpi(kpi_table):
+    kpi = compute_daily_kpi(kpi_table, "2023-01-10")
+    assert kpi == DailyKpi(
+        nb_scheduled=1,
+        nb_cancelled=1,
+        nb_active=0,
+        nb_landed=2,
+        nb_delays_dep=2,
+        min_delay_dep=20,
+        max_delay_dep=47,
+        avg_delay_dep=33,
+        nb_delays_arr=2,
+        min_delay_arr=20,
+        max_delay_arr=47,
+        avg_delay_arr=33,
+        worst_flight=WorstFlight("MONASTIR", "CHARLES DE GAULLE", "TU0001", "TU"),
+    )
+    assert kpi.count_status("landed") == 2
+    assert kpi.nb_delays("ARRIVAL") == 2
+    assert kpi.delay("MAX", "DEPARTURE") == 47
+
+
+def test_one_query(kpi_table):
+    statements = []
+    kpi_table.conn.set_trace_callback(statements.append)
+    compute_daily_kpi(kpi_table, "2023-01-10")
+    kpi_table.conn.set_trace_callback(None)
+    assert len(statements) == 1
+
+
+def test_day_without_flights(kpi_table):
+    kpi = compute_daily_kpi(kpi_table, "2000-01-01")
+    assert kpi.worst_flight is None
+    assert set(kpi[:-1]) == {0}
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from data_analysis.pillow_reports import generate_report
+from data_pipeline.daily_kpi import check_daily_kpi, get_daily_kpi
+from data_pipeline.migrations import MIGRATIONS, TYPED_FLIGHT_TABLE, SchemaVersionError, migrate, schema_version
+from data_pipeline.sql_functions import SqlManager
+from src.const import DAILY_KPI_TABLE_NAME, SCHEMA_VERSION_TABLE_NAME, SQL_TABLE_NAME
+
+
+def test_fresh_database_is_migrated(sql_table):
+    assert schema_version(sql_table) == MIGRATIONS[-1][0]
+    assert migrate(sql_table) == []
+
+
+def test_pending_migrations_are_applied_in_order(sql_table):
+    calls = []
+    migrations = MIGRATIONS + [
+        (MIGRATIONS[-1][0] + 1, "first", lambda conn: calls.append("first")),
+        (MIGRATIONS[-1][0] + 2, "second", lambda conn: calls.append("second")),
+    ]
+    assert migrate(sql_table, migrations) == [MIGRATIONS[-1][0] + 1, MIGRATIONS[-1][0] + 2]
+    assert migrate(sql_table, migrations) == []
+    assert calls == ["first", "second"]
+
+
+def test_failed_migration_is_rolled_back(sql_table):
+    def broken(conn):
+        conn.execute("CREATE TABLE BROKEN (ID TEXT)")
+        raise ValueError("broken migration")
+
+    version = MIGRATIONS[-1][0]
+    with pytest.raises(ValueError):
+        migrate(sql_table, MIGRATIONS + [(version + 1, "broken", broken)])
+    assert schema_version(sql_table) == version
+    assert sql_table.execute_sql("SELECT name FROM sqlite_master WHERE name = 'BROKEN'", "fetchone") is None
+
+
+def test_newer_database_is_refused(sql_table):
+    sql_table.execute_sql(f"INSERT INTO {SCHEMA_VERSION_TABLE_NAME} (VERSION) VALUES (999)")
+    with pytest.raises(SchemaVersionError):
+        migrate(sql_table)
+
+
+def test_legacy_database_is_converted(tmp_path, flight_row):
+    path = str(tmp_path / "legacy.db")
+    legacy_table = TYPED_FLIGHT_TABLE.replace("INTEGER NOT NULL DEFAULT 0", "INT").replace('_HOUR" TEXT', '_HOUR" INT')
+    conn = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE {SQL_TABLE_NAME} {legacy_table}")
+    rows = [
+        flight_row("TU1", "Paris", "landed", "12.6", "2023-01-10T10:12"),
+        flight_row("TU2", "Paris", "active", "", "2023-01-10T11:00"),
+        flight_row("TU3", "Rome", "cancelled", 30.0, ""),
+    ]
+    rows = [(row[0], "10/01/2023", "10/01/2023") + row[3:] for row in rows]
+    conn.executemany(f"INSERT INTO {SQL_TABLE_NAME} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+    conn.commit()
+    conn.close()
+
+    with SqlManager(path) as sql_table:
+        assert schema_version(sql_table) == MIGRATIONS[-1][0]
+        types = {column[1]: column[2] for column in sql_table.conn.execute(f"PRAGMA table_info({SQL_TABLE_NAME})")}
+        assert types["DEPARTURE_DELAY"] == types["ARRIVAL_DELAY"] == "INTEGER"
+        assert types["FINGERPRINT"] == "TEXT"
+        converted = sql_table.execute_sql(
+            f"SELECT ID_FLIGHT, DEPARTURE_DATE, ARRIVAL_DATE, typeof(DEPARTURE_DELAY), DEPARTURE_DELAY FROM {SQL_TABLE_NAME} ORDER BY ID_FLIGHT",
+            "fetchall",
+        )
+        assert converted == [
+            ("TU1", "2023-01-10", "2023-01-10", "integer", 13),
+            ("TU2", "2023-01-10", "2023-01-10", "integer", 0),
+            ("TU3", "2023-01-10", "2023-01-10", "integer", 30),
+        ]
+        assert check_daily_kpi(sql_table.conn) == []
+        assert get_daily_kpi(sql_table.conn, "2023-01-10", "TU")["DEPARTURE"]["NB_DELAYED"] == 1
+        assert sql_table.execute_sql(
+            f"SELECT name FROM sqlite_master WHERE name = 'IDX_{SQL_TABLE_NAME}_DEPARTURE'", "fetchone"
+        ) == (f"IDX_{SQL_TABLE_NAME}_DEPARTURE",)
+
+
+def reversed_row(row):
+    row = list(row)
+    row[5], row[6], row[7], row[8] = row[7], row[8], row[5], row[6]
+    row[20], row[21] = row[21], row[20]
+    return tuple(row)
+
+
+def test_report_queries_use_indexes(sql_table, flight_row):
+    sql_table.upsert_flights(
+        [
+            flight_row(delay=20),
+            reversed_row(flight_row("TU0002_10_01_2023_11_00", status="landed", delay=10)),
+        ]
+    )
+    statements = []
+    sql_table.conn.set_trace_callback(statements.append)
+    picture = generate_report(datetime(2023, 1, 10, 12), sql_table)[0]
+    sql_table.conn.set_trace_callback(None)
+    os.remove(picture)
+
+    report_queries = [sql for sql in statements if sql.lstrip().upper().startswith("SELECT")]
+    assert any(SQL_TABLE_NAME in sql for sql in report_queries)
+    assert any(DAILY_KPI_TABLE_NAME in sql for sql in report_queries)
+    for sql in report_queries:
+        plan = [row[3] for row in sql_table.execute_sql(f"EXPLAIN QUERY PLAN {sql}", "fetchall")]
+        assert any("USING" in step and "INDEX" in step for step in plan), (sql, plan)
+        assert not any(step.startswith((f"SCAN {SQL_TABLE_NAME}", f"SCAN {DAILY_KPI_TABLE_NAME}")) for step in plan), (sql, plan)
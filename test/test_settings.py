@@ -0,0 +1,81 @@
+import os
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+import pytz
+import tweepy
+
+import api_job
+import src.settings
+import twitter_job
+from benchmarks.payloads import fake_schedule
+from data_pipeline.snapshots import SnapshotStore
+from src.settings import Settings, SettingsError, get_settings, load_settings, read_env_file
+
+TZ = pytz.timezone("Africa/Tunis")
+
+
+def test_missing_settings_are_named():
+    settings = Settings(token_airlab="token", login=" ")
+    assert settings.require("token_airlab") is settings
+    with pytest.raises(SettingsError, match="login, password"):
+        settings.require("token_airlab", "login", "password")
+
+
+def test_environment_overrides_the_file(tmp_path):
+    path_env = tmp_path / ".env"
+    path_env.write_text("file_name=tunisair.db\ntoken_airlab=from file\n", encoding="UTF-8")
+    settings = load_settings(str(path_env), {"token_airlab": "from environment"})
+    assert (settings.file_name, settings.token_airlab, settings.login) == ("tunisair.db", "from environment", "")
+
+
+def test_template_is_written(tmp_path):
+    settings = load_settings(str(tmp_path / ".env"), {})
+    assert settings.file_name == "tunisair_delay.db"
+    assert set(read_env_file(str(tmp_path / ".env"))) == set(Settings._fields)
+
+
+def test_env_file_is_read_once_per_run(tmp_path, monkeypatch):
+    path_env = tmp_path / ".env"
+    path_env.write_text(
+        f"file_name={tmp_path / 'tunisair.db'}\ntoken_airlab=token\n"
+        "consumer_key=key\nconsumer_secret=secret\naccess_token=token\naccess_token_secret=token secret\n",
+        encoding="UTF-8",
+    )
+    reads = []
+    monkeypatch.setattr(src.settings, "ENV_PATH", str(path_env))
+    monkeypatch.setattr(src.settings, "read_env_file", lambda path: reads.append(path) or read_env_file(path))
+
+    tweets = []
+
+    class FakeTwitter:
+        def __init__(self, auth):
+            self.auth = auth
+            tweets.append(self)
+
+        def media_upload(self, picture):
+            self.picture = picture
+            return SimpleNamespace(media_id=1)
+
+        def update_status(self, status, media_ids=None):
+            self.status = status
+
+    monkeypatch.setattr(tweepy, "OAuthHandler", lambda **credentials: credentials)
+    monkeypatch.setattr(tweepy, "API", FakeTwitter)
+
+    snapshots = SnapshotStore(str(tmp_path / "snapshots"))
+    day = datetime(2023, 1, 10)
+    snapshots.append("TUN", "DEPARTURE", fake_schedule(30, day, seed=0), TZ.localize(day.replace(hour=9)).timestamp())
+
+    get_settings.cache_clear()
+    try:
+        os.remove(api_job.main(day.replace(hour=12), snapshots=snapshots, trace_path=str(tmp_path / "traces.jsonl"))[0])
+        twitter_job.main(datetime(2023, 1, 11, 9), trace_path=str(tmp_path / "traces.jsonl"))
+        os.remove(tweets[0].picture)
+    finally:
+        get_settings.cache_clear()
+
+    assert reads == [str(path_env)]
+    assert os.path.exists(tmp_path / "tunisair.db")
+    assert tweets[0].auth["consumer_key"] == "key"
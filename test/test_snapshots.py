@@ -0,0 +1,95 @@
+import json
+from datetime import datetime
+
+import pytz
+
+from benchmarks.payloads import fake_schedule
+from data_pipeline.json_stream import iter_json_array
+from data_pipeline.snapshots import INDEX_ENTRY, SnapshotArchive, SnapshotStore
+
+TZ = pytz.timezone("Africa/Tunis")
+
+
+def test_append_and_read(tmp_path):
+    archive = SnapshotArchive(str(tmp_path / "TUN_arrival.json.gz"))
+    payloads = [fake_schedule(5, datetime(2023, 1, 10), seed=seed) for seed in range(3)]
+    for timestamp, payload in enumerate(payloads):
+        archive.append(payload, 100.0 + timestamp)
+
+    index = archive.index()
+    assert [snapshot.timestamp for snapshot in index] == [100.0, 101.0, 102.0]
+    assert [archive.read(snapshot) for snapshot in index] == payloads
+    assert [payload for _, payload in archive.replay(101.0)] == payloads[1:]
+    assert [payload for _, payload in archive.replay(end=101.0)] == payloads[:1]
+
+
+def test_random_access(tmp_path):
+    archive = SnapshotArchive(str(tmp_path / "TUN_arrival.json.gz"))
+    for timestamp in (10.0, 20.0, 30.0):
+        archive.append({"response": [timestamp]}, timestamp)
+
+    assert archive.at(5.0) is None
+    assert archive.read(archive.at(10.0)) == {"response": [10.0]}
+    assert archive.read(archive.at(29.9)) == {"response": [20.0]}
+    with archive.open(archive.at(1e9)) as stream:
+        assert list(iter_json_array(stream, "response")) == [30.0]
+
+
+def test_torn_write_is_dropped(tmp_path):
+    archive = SnapshotArchive(str(tmp_path / "TUN_arrival.json.gz"))
+    archive.append({"response": [1]}, 1.0)
+    # A crash between the data and its index entry, then in the middle of an index entry
+    with open(archive.path, "ab") as file:
+        file.write(b"\x1f\x8b partial record")
+    with open(archive.path_index, "ab") as file:
+        file.write(INDEX_ENTRY.pack(2.0, 0, 0)[:7])
+
+    assert len(archive.index()) == 1
+    archive.append({"response": [3]}, 3.0)
+    assert [payload for _, payload in archive.replay()] == [{"response": [1]}, {"response": [3]}]
+
+
+def test_store_latest_of_the_day(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    day = TZ.localize(datetime(2023, 1, 10, 8))
+    store.append("TUN", "ARRIVAL", {"response": ["morning"]}, day.timestamp())
+    store.append("TUN", "ARRIVAL", {"response": ["evening"]}, TZ.localize(datetime(2023, 1, 10, 23, 30)).timestamp())
+    store.append("TUN", "ARRIVAL", {"response": ["next day"]}, TZ.localize(datetime(2023, 1, 11, 0, 30)).timestamp())
+
+    with store.latest("TUN", "ARRIVAL", day) as stream:
+        assert json.load(stream) == {"response": ["evening"]}
+    assert store.latest("TUN", "ARRIVAL", TZ.localize(datetime(2023, 1, 9))) is None
+    assert store.latest("TUN", "DEPARTURE", day) is None
+
+
+def test_store_replay_across_months(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    days = [TZ.localize(datetime(2023, month, 28)) for month in (1, 2, 3)]
+    for day in days:
+        store.append("DJE", "DEPARTURE", {"response": [day.month]}, day.timestamp())
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["2023_01", "2023_02", "2023_03"]
+    replay = store.replay("DJE", "DEPARTURE", days[0], days[2])
+    assert [payload["response"] for _, payload in replay] == [[1], [2]]
+
+
+def test_archive_is_smaller_than_the_json_files(tmp_path):
+    archive = SnapshotArchive(str(tmp_path / "TUN_arrival.json.gz"))
+    payload = fake_schedule(500, datetime(2023, 1, 10), seed=0)
+    snapshot = archive.append(payload)
+    assert snapshot.length < len(json.dumps(payload, indent=4)) / 5
+
+
+def test_import_legacy_files(tmp_path, legacy_dir):
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+    assert store.import_legacy(str(legacy_dir)) == 3
+    assert store.import_legacy(str(legacy_dir)) == 0
+
+    legacy_arrivals = json.loads((legacy_dir / "arrivals/01/10_01_2023_arrival_flights.json").read_text(encoding="UTF-8"))
+    with store.latest("TUN", "ARRIVAL", TZ.localize(datetime(2023, 1, 10, 12))) as stream:
+        assert json.load(stream) == legacy_arrivals
+    # The file modified after its day is kept in its day
+    replay = list(store.replay("DJE", "DEPARTURE", *store.day_bounds(datetime(2023, 1, 10).date())))
+    assert [timestamp for timestamp, _ in replay] == [TZ.localize(datetime(2023, 1, 11)).timestamp() - 1]
+    assert store.latest("TUN", "DEPARTURE", TZ.localize(datetime(2023, 1, 11, 12))) is not None
+    assert store.latest("TUN", "DEPARTURE", TZ.localize(datetime(2023, 1, 12, 12))) is None
@@ -0,0 +1,119 @@
+from datetime import datetime
+
+import pytest
+
+from data_pipeline.daily_kpi import check_daily_kpi
+from data_pipeline.sql_functions import SqlManager
+from src.const import SQL_TABLE_NAME
+from src.utils import correct_datetime_info
+
+
+class TestConnection:
+    def test_one_connection_for_all_queries(self, tmp_path):
+        count = SqlManager.connection_count
+        with SqlManager(str(tmp_path / "test.db")) as sql_table:
+            for _ in range(10):
+                sql_table.check_key("TU0001_10_01_2023_10_00")
+            sql_table.id_keys()
+        assert SqlManager.connection_count == count + 1
+
+    def test_wal_journal(self, sql_table):
+        assert sql_table.execute_sql("PRAGMA journal_mode", "fetchone")[0] == "wal"
+
+    def test_close_and_reopen(self, sql_table):
+        sql_table.close()
+        assert sql_table.id_keys() == []
+
+
+class TestTransaction:
+    def test_commit(self, sql_table):
+        with sql_table.transaction():
+            sql_table.execute_sql(f'INSERT INTO {SQL_TABLE_NAME} (ID_FLIGHT, FLIGHT_NUMBER) VALUES ("A", "TU1")')
+            with sql_table.transaction():
+                sql_table.execute_sql(f'INSERT INTO {SQL_TABLE_NAME} (ID_FLIGHT, FLIGHT_NUMBER) VALUES ("B", "TU2")')
+            assert sql_table.conn.in_transaction
+        assert not sql_table.conn.in_transaction
+        assert sorted(sql_table.id_keys()) == ["A", "B"]
+
+    def test_rollback(self, sql_table):
+        with pytest.raises(ValueError):
+            with sql_table.transaction():
+                sql_table.execute_sql(f'INSERT INTO {SQL_TABLE_NAME} (ID_FLIGHT, FLIGHT_NUMBER) VALUES ("A", "TU1")')
+                raise ValueError("abort")
+        assert sql_table.id_keys() == []
+
+
+class TestUpsert:
+    def test_insert_then_update(self, sql_table, flight_row):
+        assert sql_table.upsert_flights([flight_row(), flight_row("TU0002_10_01_2023_11_00")]) == 2
+        sql_table.upsert_flights([flight_row(status="landed", delay=25)])
+        rows = sql_table.execute_sql(f"SELECT ID_FLIGHT, FLIGHT_STATUS, DEPARTURE_DELAY FROM {SQL_TABLE_NAME} ORDER BY ID_FLIGHT", "fetchall")
+        assert rows == [("TU0001_10_01_2023_10_00", "landed", 25), ("TU0002_10_01_2023_11_00", "scheduled", 0)]
+
+    def test_quotes_in_values(self, sql_table, flight_row):
+        sql_table.update_table("TU0001_10_01_2023_10_00", flight_row(airport='L\'AQUILA "PRETURO"'))
+        assert sql_table.check_key("TU0001_10_01_2023_10_00")
+        assert sql_table.execute_sql(f"SELECT DEPARTURE_AIRPORT FROM {SQL_TABLE_NAME}", "fetchone")[0] == 'L\'AQUILA "PRETURO"'
+
+    def test_insert_refreshes_the_daily_kpi(self, sql_table, flight_row):
+        sql_table.insert_in_table(flight_row())
+        assert check_daily_kpi(sql_table.conn) == []
+        with pytest.raises(Exception):
+            sql_table.insert_in_table(flight_row())
+        assert check_daily_kpi(sql_table.conn) == []
+
+    def test_rollback_whole_batch(self, sql_table, flight_row):
+        with pytest.raises(Exception):
+            sql_table.upsert_flights([flight_row(), flight_row()[:-1]])
+        assert sql_table.id_keys() == []
+
+
+class TestCleanSqlTable:
+    def test_clean_day(self, sql_table, flight_row):
+        sql_table.upsert_flights(
+            [
+                flight_row(departure_actual="2023-01-10 10:30"),
+                flight_row("TU0002_10_01_2023_11_00", status="cancelled"),
+            ]
+        )
+        sql_table.clean_sql_table(datetime(2023, 1, 10, 12))
+
+        dep_hour, dep_date, status, dep_delay = correct_datetime_info("2023-01-10 10:30", "", "2023-01-10 10:00", "scheduled", 0, "active")
+        arr_hour, arr_date, status, arr_delay = correct_datetime_info("", "", "2023-01-10 12:00", status, 0, "landed")
+        rows = sql_table.execute_sql(
+            f"""
+            SELECT ID_FLIGHT, DEPARTURE_HOUR, DEPARTURE_DATE, FLIGHT_STATUS, DEPARTURE_DELAY, ARRIVAL_HOUR, ARRIVAL_DATE, ARRIVAL_DELAY
+            FROM {SQL_TABLE_NAME} ORDER BY ID_FLIGHT
+            """,
+            "fetchall",
+        )
+        assert rows[0] == ("TU0001_10_01_2023_10_00", dep_hour, dep_date, "landed", 30, arr_hour, arr_date, arr_delay)
+        assert rows[1][3] == "cancelled"
+
+
+class TestModifyColumn:
+    def test_whole_table(self, sql_table, flight_row):
+        sql_table.upsert_flights([flight_row(), flight_row("TU0002_10_01_2023_11_00")])
+        assert sql_table.modify_column("DEPARTURE_AIRPORT", "ARRIVAL_AIRPORT", str.lower) == 2
+        assert sql_table.execute_sql(f"SELECT DISTINCT ARRIVAL_AIRPORT FROM {SQL_TABLE_NAME}", "fetchall") == [("tunis carthage",)]
+
+    def test_with_condition(self, sql_table, flight_row):
+        sql_table.upsert_flights([flight_row(), flight_row("TU0002_10_01_2023_11_00")])
+        modified = sql_table.modify_column("DEPARTURE_DELAY", "ARRIVAL_DELAY", lambda delay: delay + 15, 'WHERE (ID_FLIGHT = "TU0002_10_01_2023_11_00")')
+        assert modified == 1
+        rows = sql_table.execute_sql(f"SELECT ID_FLIGHT, ARRIVAL_DELAY FROM {SQL_TABLE_NAME} ORDER BY ID_FLIGHT", "fetchall")
+        assert rows == [("TU0001_10_01_2023_10_00", 0), ("TU0002_10_01_2023_11_00", 15)]
+
+    def test_failure_rolls_back(self, sql_table, flight_row):
+        sql_table.upsert_flights([flight_row(), flight_row("TU0002_10_01_2023_11_00")])
+        with pytest.raises(Exception):
+            sql_table.modify_column("DEPARTURE_DELAY", "ARRIVAL_DELAY", lambda delay: 1 / 0)
+        assert sql_table.execute_sql(f"SELECT SUM(ARRIVAL_DELAY) FROM {SQL_TABLE_NAME}", "fetchone") == (0,)
+
+    def test_daily_kpi_is_refreshed(self, sql_table, flight_row):
+        sql_table.upsert_flights([flight_row(), flight_row("TU0002_10_01_2023_11_00")])
+        sql_table.modify_column("DEPARTURE_DELAY", "DEPARTURE_DELAY", lambda delay: delay + 20)
+        assert check_daily_kpi(sql_table.conn) == []
+        # The flight leaves the rollup rows of its previous date
+        sql_table.modify_column("DEPARTURE_DATE", "DEPARTURE_DATE", lambda _: "2023-01-11", 'WHERE (ID_FLIGHT = "TU0002_10_01_2023_11_00")')
+        assert check_daily_kpi(sql_table.conn) == []
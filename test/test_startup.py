@@ -0,0 +1,19 @@
+from benchmarks.bench_startup import import_time_ms, import_times
+from src.const import STARTUP_DEFERRED_MODULES, STARTUP_IMPORT_BUDGET_MS
+
+
+def test_import_times_are_parsed():
+    times = import_times("data_pipeline.api_requests")
+    self_us, cumulative_us = times["data_pipeline.api_requests"]
+    assert 0 < self_us <= cumulative_us
+    assert 0 < times["data_pipeline.sql_functions"][1] < cumulative_us
+
+
+def test_ingest_does_not_import_the_report_and_twitter_dependencies():
+    times = import_times("data_pipeline.api_requests")
+    assert [name for name in STARTUP_DEFERRED_MODULES if name in times] == []
+    assert "data_analysis.pillow_reports" not in import_times("api_job")
+
+
+def test_ingest_import_time_is_within_budget():
+    assert import_time_ms("data_pipeline.api_requests") < STARTUP_IMPORT_BUDGET_MS
@@ -0,0 +1,99 @@
+import io
+import json
+import os
+from datetime import datetime
+
+import pytest
+import pytz
+
+import api_job
+import twitter_job
+from benchmarks.payloads import fake_schedule
+from data_pipeline.snapshots import SnapshotStore
+from src import tracing
+from src.tracing import NO_SPAN, TRACER, iterate, rotate, span, trace_job
+
+TZ = pytz.timezone("Africa/Tunis")
+REPORT_SPANS = {"clean", "kpi_query", "plot", "composite", "save"}
+
+
+def read_spans(path):
+    with open(path, "r", encoding="UTF-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_disabled_tracer_is_a_no_op():
+    items = [[1, 2], [3]]
+    records = list(TRACER.records)
+    assert not TRACER.enabled
+    assert span("upsert", rows=2) is NO_SPAN
+    assert iterate("parse", items) is items
+
+    with span("upsert", rows=2) as trace:
+        trace.set(rows=3)
+    assert trace is NO_SPAN
+    assert TRACER.records == records
+
+
+def test_trace_file_is_rotated(tmp_path, monkeypatch):
+    path = str(tmp_path / "traces.jsonl")
+    with trace_job("first", path):
+        pass
+    assert not rotate(path, max_bytes=1 << 20)
+    monkeypatch.setattr(tracing, "TRACE_FILE_MAX_BYTES", 1)
+    with trace_job("second", path):
+        pass
+    assert [record["job"] for record in read_spans(f"{path}.1")] == ["first"]
+    assert [record["job"] for record in read_spans(path)] == ["second"]
+
+
+def test_spans_are_json_lines():
+    output = io.StringIO()
+    TRACER.start("test", output)
+    try:
+        with span("ingest") as ingest:
+            for batch in iterate("parse", iter([[1, 2], [3]])):
+                with span("upsert", rows=len(batch)):
+                    pass
+            ingest.set(new=3)
+        with pytest.raises(ZeroDivisionError):
+            with span("clean"):
+                1 / 0
+    finally:
+        records = TRACER.stop()
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert lines == records
+    assert [record["span"] for record in records] == ["parse", "upsert", "parse", "upsert", "parse", "ingest", "clean"]
+    ingest = records[5]
+    assert ingest["new"] == 3 and ingest["parent"] is None
+    assert all(record["parent"] == ingest["id"] for record in records[:5])
+    assert records[-1]["error"] == "ZeroDivisionError"
+    assert TRACER.summary()["upsert"] == {"count": 2, "duration_ms": pytest.approx(records[1]["duration_ms"] + records[3]["duration_ms"]), "rows": 3}
+    assert span("ingest") is NO_SPAN
+
+
+def test_job_flows_are_traced(tmp_path, monkeypatch, capsys):
+    path_sql_db = str(tmp_path / "test.db")
+    trace_path = str(tmp_path / "traces.jsonl")
+    snapshots = SnapshotStore(str(tmp_path / "snapshots"))
+    day = datetime(2023, 1, 10)
+    snapshots.append("TUN", "DEPARTURE", fake_schedule(30, day, seed=0), TZ.localize(day.replace(hour=9)).timestamp())
+
+    picture = api_job.main(day.replace(hour=12), path_sql_db, snapshots, trace_path)[0]
+    os.remove(picture)
+    spans = read_spans(trace_path)
+    names = {record["span"] for record in spans}
+    assert {"api_job", "ingest", "parse", "enrich", "correct", "upsert"} | REPORT_SPANS <= names
+    assert sum(record["rows"] for record in spans if record["span"] == "upsert") == 30
+    ingest = next(record for record in spans if record["span"] == "ingest")
+    assert ingest["new"] == 30 and ingest["timestamp_hits"] + ingest["timestamp_misses"] > 0
+    assert "Trace summary of api_job" in capsys.readouterr().out
+
+    tweets = []
+    monkeypatch.setattr(twitter_job, "post_tweet_with_pic", lambda text, picture, settings: tweets.append(picture))
+    twitter_job.main(datetime(2023, 1, 11, 9), path_sql_db, trace_path)
+    os.remove(tweets[0])
+    spans = [record for record in read_spans(trace_path) if record["job"] == "twitter_job"]
+    assert {"twitter_job", "tweet"} | REPORT_SPANS <= {record["span"] for record in spans}
+    assert next(record for record in spans if record["span"] == "clean")["rows"] > 0
@@ -1,14 +1,19 @@
 import json
 import os
+import random
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
+import numpy as np
+import pandas as pd
 import pytest
-import requests
 
 import src.utils as U
-from data_pipeline.api_requests import fatal_code
+from data_analysis.pandas_matplotlib import get_df_sql_data
+from src.airports import get_airports
+from src.const import TIMESTAMP_CACHE_SIZE
 
 
 class TestTimeAttribute:
@@ -28,6 +33,36 @@ class TestTimeAttribute:
         ta = U.TimeAttribute(start_date)
         assert ta.get_mins_between(end_date) == 30
 
+    def test_fields_are_formatted_on_access(self):
+        ta = U.TimeAttribute("2023-01-10T07:05:00+01:00")
+        assert not hasattr(ta, "__dict__")
+        assert not hasattr(ta, "_isodate")
+        assert (ta.isodate, ta.dateformat, ta.hour, ta.full_hour, ta.month) == ("2023-01-10", "10/01/2023", "07", "07:05", "01")
+        assert (ta.full_under_score, ta.short_under_score, ta.full_day) == ("10_01_2023_07_05", "10_01_2023", "Tue 10 Jan 2023")
+        assert ta.isodate is ta.isodate
+
+    def test_clock(self):
+        calls = []
+
+        def clock():
+            calls.append(1)
+            return U.PYTZ_TN.localize(datetime(2023, 1, 10, 12))
+
+        ta = U.TimeAttribute(clock=clock)
+        assert calls == []
+        assert ta.today.strftime("%Y-%m-%d %H:%M") == "2023-01-10 12:00"
+        assert ta.yesterday.strftime("%Y-%m-%d %H:%M") == "2023-01-09 12:00"
+        assert len(calls) == 1
+
+    def test_timestamps_are_parsed_once(self):
+        U.parse_timestamp.cache_clear()
+        first = U.TimeAttribute("2023-01-10 10:00")
+        key = U.get_flight_key("TU0712", "2023-01-10 10:00")
+        assert U.parse_timestamp("2023-01-10 10:00") is first.datetime
+        assert key == f"TU0712_{first.full_under_score}"
+        cache_info = U.parse_timestamp.cache_info()
+        assert (cache_info.hits, cache_info.misses, cache_info.maxsize) == (2, 1, TIMESTAMP_CACHE_SIZE)
+
     def test_get_days_between(self):
         start_date = datetime.now()
         end_date = start_date + timedelta(days=5)
@@ -81,6 +116,17 @@ def test_get_airport_country():
     assert "Wrong Type: airport_iata must be a string" in str(excinfo.value)
 
 
+def test_airport_info():
+    assert U.airport_info("CDG") == ("CHARLES DE GAULLE", "FRANCE")
+    assert U.airport_info(" cdg ") is U.airport_info("CDG")
+    assert U.airport_info("XXX") == ("UNKNOWN", "UNKNOWN")
+    assert get_airports() is get_airports()
+
+    with pytest.raises(AssertionError) as excinfo:
+        U.airport_info(None)
+    assert "Wrong Type: airport_iata must be a string" in str(excinfo.value)
+
+
 def test_get_airport_name():
     # Test valid airport IATA code
     airport_iata = "CDG"
@@ -151,7 +197,132 @@ class TestFileFolderManager:
             assert json.load(open(ffm.file_dir)) == test_dict
 
 
-def test_fatal_code():
-    response = requests.Response()
-    response.status_code = 400
-    assert fatal_code(response) == True
+def random_legs(nb_legs, seed=0):
+    rand = random.Random(seed)
+    legs = []
+    for _ in range(nb_legs):
+        # Past and far future days so the status does not depend on the time of the test
+        scheduled = datetime(rand.choice([2022, 2099]), rand.randint(1, 12), rand.randint(1, 28), rand.randint(0, 23), rand.randrange(0, 60, 5))
+        estimated = scheduled + timedelta(minutes=rand.choice([-10, 0, 25, 90]))
+        actual = estimated + timedelta(minutes=rand.choice([-5, 0, 15]))
+        legs.append(
+            (
+                rand.choice(["", actual.strftime("%Y-%m-%d %H:%M")]),
+                rand.choice(["", estimated.strftime("%Y-%m-%d %H:%M")]),
+                scheduled.strftime("%Y-%m-%d %H:%M"),
+                rand.choice(["scheduled", "cancelled", "active", "landed"]),
+                rand.choice([0, 5, 30]),
+            )
+        )
+    return legs
+
+
+@pytest.mark.parametrize("text", ["active", "landed"])
+def test_correct_datetime_info_batch_parity(text):
+    legs = random_legs(500)
+    now = datetime.now()
+    expected = [U.correct_datetime_info(*leg, text, now) for leg in legs]
+    hours, dates, statuses, delays = U.correct_datetime_info_batch(*zip(*legs), text, now)
+    assert list(zip(hours, dates, statuses, delays)) == expected
+
+
+def test_correct_datetime_info_batch_empty():
+    hours, dates, statuses, delays = U.correct_datetime_info_batch([], [], [], [], [], "active")
+    assert len(hours) == len(dates) == len(statuses) == len(delays) == 0
+
+
+@pytest.fixture
+def host_timezone(monkeypatch):
+    """
+    Change the local timezone of the process, the one of the naive timestamps
+    """
+
+    def set_timezone(tz):
+        monkeypatch.setenv("TZ", tz)
+        time.tzset()
+
+    yield set_timezone
+    monkeypatch.undo()
+    time.tzset()
+
+
+def wall_times(start, hours=6, step=5):
+    start = datetime.fromisoformat(start)
+    return [(start + timedelta(minutes=minutes)).strftime("%Y-%m-%d %H:%M") for minutes in range(0, hours * 60, step)]
+
+
+@pytest.mark.skipif(not hasattr(time, "tzset"), reason="the local timezone cannot be changed")
+@pytest.mark.parametrize(
+    "tz, start",
+    [
+        ("UTC", "2023-01-10 00:00"),
+        # Tunisia had a DST until 2008, the host runs in its time
+        ("Africa/Tunis", "2008-03-30 00:00"),
+        ("Africa/Tunis", "2008-10-26 00:00"),
+        ("Europe/Paris", "2023-03-26 00:00"),
+        ("Europe/Paris", "2023-10-29 00:00"),
+        # DST change of 30 minutes
+        ("Australia/Lord_Howe", "2023-10-01 00:00"),
+        # Not a zoneinfo key, the naive timestamps are converted one by one
+        ("CET-1CEST,M3.5.0,M10.5.0/3", "2023-10-29 00:00"),
+    ],
+)
+def test_localize_timestamps_parity(host_timezone, tz, start):
+    host_timezone(tz)
+    times = wall_times(start)
+    values = times + [f"{time_str}+02:00" for time_str in times[:24]] + ["2023-01-10T09:00Z", "2023-01-10", "2023-01-10 10:00:00.123456", "", None]
+    localized = U.localize_timestamps(values)
+    assert str(localized.tz) == U.TUNISIA_TZ
+    for time_str, timestamp in zip(values, localized):
+        if not time_str:
+            assert timestamp is pd.NaT
+            continue
+        # parse_timestamp is memoized for the host timezone of the other tests
+        expected = U.parse_timestamp.__wrapped__(time_str)
+        actual = timestamp.to_pydatetime()
+        assert (actual.timestamp(), actual.utcoffset(), f"{actual:%Y-%m-%d %H:%M:%S.%f}") == (expected.timestamp(), expected.utcoffset(), f"{expected:%Y-%m-%d %H:%M:%S.%f}"), time_str
+
+
+@pytest.mark.skipif(not hasattr(time, "tzset"), reason="the local timezone cannot be changed")
+def test_keys_follow_the_host_timezone(host_timezone):
+    # The keys already saved by a host in UTC must not change
+    host_timezone("UTC")
+    U.parse_timestamp.cache_clear()
+    try:
+        assert U.get_flight_key("TU1", "2023-01-10 10:00") == "TU1_10_01_2023_11_00"
+        hours, dates, _, _ = U.correct_datetime_info_batch([""], [""], ["2023-01-10 23:30"], ["scheduled"], [0], "landed")
+        assert (hours[0], dates[0]) == ("00h", "2023-01-11")
+    finally:
+        U.parse_timestamp.cache_clear()
+
+
+@pytest.mark.skipif(not hasattr(time, "tzset"), reason="the local timezone cannot be changed")
+def test_correct_datetime_info_batch_dst_parity(host_timezone):
+    host_timezone("Africa/Tunis")
+    now = datetime(2008, 10, 26, 2, 30)
+    legs = [(actual, "", scheduled, "scheduled", 0) for scheduled, actual in zip(wall_times("2008-10-26 00:00"), wall_times("2008-10-26 01:00"))]
+    legs += [("", "", scheduled, "active", 5) for scheduled in wall_times("2008-03-30 00:00")]
+    U.parse_timestamp.cache_clear()
+    try:
+        expected = [U.correct_datetime_info(*leg, "landed", now) for leg in legs]
+    finally:
+        U.parse_timestamp.cache_clear()
+    hours, dates, statuses, delays = U.correct_datetime_info_batch(*zip(*legs), "landed", now)
+    assert list(zip(hours, dates, statuses, delays)) == expected
+
+
+def test_localize_datetime64():
+    naive = np.array(["2023-01-10T09:00", "NaT"], dtype="datetime64[ns]")
+    aware = pd.Series(pd.to_datetime(["2023-01-10 09:00"], utc=True))
+    assert list(U.localize_timestamps(naive).strftime("%Y-%m-%d %H:%M%z")) == [U.parse_timestamp.__wrapped__("2023-01-10 09:00").strftime("%Y-%m-%d %H:%M%z"), np.nan]
+    assert U.localize_timestamps(aware)[0].isoformat() == "2023-01-10T10:00:00+01:00"
+    assert len(U.localize_timestamps([])) == 0
+
+
+def test_df_timestamps_are_localized(kpi_table):
+    df = get_df_sql_data("2023-01-10 12:00", "DEPARTURE", kpi_table)
+    assert len(df) == 3
+    assert str(df["DEPARTURE_SCHEDULED"].dt.tz) == str(df["ARRIVAL_ACTUAL"].dt.tz) == U.TUNISIA_TZ
+    assert df["DEPARTURE_SCHEDULED"].iloc[0] == U.parse_timestamp("2023-01-10 10:00")
+    assert df["ARRIVAL_SCHEDULED"].iloc[0] == U.parse_timestamp("2023-01-10 12:00")
+    assert df["DEPARTURE_ACTUAL"].isna().all()
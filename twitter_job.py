@@ -6,25 +6,41 @@ from datetime import datetime, timedelta
 #!/usr/bin/python3
 from data_analysis.pillow_reports import generate_report
 from data_pipeline.sql_functions import SqlManager
-from src.utils import TimeAttribute, post_tweet_with_pic
+from src.const import TRACE_FILE_NAME
+from src.tracing import span, trace_job
+from src.utils import FileFolderManager, TimeAttribute, post_tweet_with_pic
 
-# Adding Airlines
-if __name__ == "__main__":
 
-    yesterday = TimeAttribute(datetime.now() - timedelta(days=1))
-    sql_table = SqlManager()
+def main(now=None, path_sql_db=None, trace_path=None, settings=None):
+    """
+    Clean the flights of yesterday, generate its report and post it, the stages are traced
+
+    :param now: (datetime, optional) the time of the job. Default is None, which uses the current time.
+    :param path_sql_db: (str, optional) path of the SQLite database. Default is None, see SqlManager.
+    :param trace_path: (str, optional) the JSON lines file of the spans. Default is None, TRACE_FILE_NAME next to the database.
+    :param settings: (Settings, optional) the settings. Default is None, which uses get_settings().
+    :return: (str) the text of the tweet
+    """
+    if now is None:
+        now = datetime.now()
+    if trace_path is None:
+        trace_path = FileFolderManager(directory="data_pipeline/", name_file=TRACE_FILE_NAME).file_dir
+
+    yesterday = TimeAttribute(now - timedelta(days=1))
+    with trace_job("twitter_job", trace_path):
+        with SqlManager(path_sql_db, settings) as sql_table:
 
-    sql_table.clean_sql_table(yesterday.datetime)
+            sql_table.clean_sql_table(yesterday.datetime)
 
-    (
-        picture_to_upload,
-        nb_delays_arr,
-        nb_delays_dep,
-        arrival_delayed_max,
-        text_worse,
-    ) = generate_report(yesterday.datetime)
+            (
+                picture_to_upload,
+                nb_delays_arr,
+                nb_delays_dep,
+                arrival_delayed_max,
+                text_worse,
+            ) = generate_report(yesterday.datetime, sql_table)
 
-    tweet_text = f"""
+        tweet_text = f"""
 📊 Daily ingest of ✈️  #Tunisair delay performance
 Date: {yesterday.dateformat} with {nb_delays_dep} #delayed_departure and {nb_delays_arr} #delayed_arrival
 The worst flight was
@@ -32,4 +48,11 @@ The worst flight was
 🇹🇳 #Tunisia #Flight #DataAnalyst #Nouvelair #Airfrance #Transavia
 """
 
-    post_tweet_with_pic(tweet_text, picture_to_upload)
+        with span("tweet"):
+            post_tweet_with_pic(tweet_text, picture_to_upload, settings)
+    return tweet_text
+
+
+# Adding Airlines
+if __name__ == "__main__":
+    main()